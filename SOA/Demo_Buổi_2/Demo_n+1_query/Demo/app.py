@@ -1,35 +1,44 @@
-from flask import Flask, Response, request, jsonify
-from sqlalchemy import create_engine
+from flask import Flask, Response, request, jsonify, stream_with_context
+from sqlalchemy import select
 from sqlalchemy.orm import sessionmaker, joinedload
-from model import Book
+from model import Author, Book, Category
 from flasgger import Swagger
+from catalog_cache import CatalogCache, make_backend
+from query_counter import QueryCounter
+from token_verifier import TokenVerifier
+import db
+import os
 import yaml
 import json
-import urllib.parse
 import requests
 from functools import wraps
 
-with open("config.yaml", "r", encoding="utf-8") as f:
-    config = yaml.safe_load(f)
-
-db_conf = config["database"]
+CONFIG_PATH = os.getenv("CONFIG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml"))
 
-params = {
-    "DRIVER": f"{{{db_conf['driver']}}}",
-    "SERVER": db_conf["server"],
-    "DATABASE": db_conf["database"],
-    "Trusted_Connection": "yes",
-    "Encrypt": "yes" if db_conf.get("encrypt", False) else "no",
-}
+with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+    config = yaml.safe_load(f)
 
-# Build connection string (dùng để kết nối và sinh model.py từ SQLcodegen)
-connection_string = f"mssql+pyodbc:///?odbc_connect={urllib.parse.quote_plus(';'.join(f'{k}={v}' for k, v in params.items()))}"
+DEBUG = os.getenv("FLASK_DEBUG", str(config.get("debug", False))).lower() in ("1", "true")
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "1000"))  # Số row mỗi lần fetch khi stream /books-stream
 
+db_conf = config["database"]
+# DATABASE_URL (vd. sqlite:///books.db) thay cho SQL Server khi test / benchmark
+db_conf["url"] = os.getenv("DATABASE_URL", db_conf.get("url"))
 
-engine = create_engine(connection_string, echo=True)
+engine = db.build_engine(db_conf, debug=DEBUG)
 SessionLocal = sessionmaker(bind=engine)
 
 app = Flask(__name__)
+# Session theo request: đóng ở teardown, connection trả về pool ngay
+db.init_app(app, SessionLocal)
+
+# Đếm query theo request, cảnh báo (hoặc raise, khi N1_RAISE=true) khi nghi N+1
+qc_conf = config.get("query_counter", {})
+query_counter = QueryCounter(
+    n1_threshold=qc_conf.get("n1_threshold", 3),
+    raise_on_n1=os.getenv("N1_RAISE", str(qc_conf.get("raise_on_n1", False))).lower() in ("1", "true")
+)
+query_counter.init_app(app, engine)
 
 swagger_conf = config["swagger"]
 
@@ -39,7 +48,21 @@ for spec in swagger_conf.get("specs", []):
 
 swagger = Swagger(app, config=swagger_conf)
 
-AUTH_SERVICE_URL = "http://localhost:3000/protected"
+auth_conf = config.get("auth", {})
+AUTH_SERVICE_BASE_URL = os.getenv("AUTH_SERVICE_URL", auth_conf.get("url", "http://localhost:3000"))
+AUTH_SERVICE_URL = f"{AUTH_SERVICE_BASE_URL}/protected"
+
+# Kết quả xác thực được cache theo token; auth_service chỉ được gọi khi cache miss
+token_verifier = TokenVerifier(
+    AUTH_SERVICE_URL,
+    timeout=auth_conf.get("timeout", 5),
+    cache_ttl=auth_conf.get("cache_ttl", 300),
+    negative_ttl=auth_conf.get("negative_ttl", 5),
+    max_entries=auth_conf.get("max_entries", 10000),
+    pool_size=auth_conf.get("pool_size", 20),
+    jwt_key=os.getenv("AUTH_JWT_KEY", auth_conf.get("jwt_key")) or None,
+    jwt_algorithms=auth_conf.get("jwt_algorithms", ["RS256"])
+)
 
 def token_required_remote(f):
     @wraps(f)
@@ -57,19 +80,9 @@ def token_required_remote(f):
             app.logger.warning("Missing Authorization header")
             return jsonify({"message": "Token is missing"}), 401
 
-        try:
-            resp = requests.get(AUTH_SERVICE_URL, headers={"Authorization": f"Bearer {token}"}, timeout=5)
-        except requests.exceptions.ConnectionError:
-            return jsonify({"message": "Auth service unreachable"}), 503
-        except requests.exceptions.Timeout:
-            return jsonify({"message": "Auth service timeout"}), 504
-
-        if resp.status_code != 200:
-            try:
-                msg = resp.json().get("message", "Token invalid or expired")
-            except ValueError:
-                msg = "Token invalid or expired"
-            return jsonify({"message": msg}), resp.status_code
+        result = token_verifier.verify(token)
+        if not result.ok:
+            return jsonify({"message": result.message}), result.status
 
         return f(*args, **kwargs)
     return decorated
@@ -103,8 +116,8 @@ def login():
     password = request.form.get("password")
 
     try:
-        resp = requests.post(
-            "http://localhost:3000/login",
+        resp = token_verifier.session.post(
+            f"{AUTH_SERVICE_BASE_URL}/login",
             json={"username": username, "password": password},
             timeout=5
         )
@@ -113,6 +126,26 @@ def login():
 
     return Response(resp.content, status=resp.status_code, content_type=resp.headers.get("Content-Type"))
 
+def load_book_list():
+    """Book + Author trong một query (joinedload)"""
+    session = db.get_session()
+    books = session.query(Book).options(joinedload(Book.Author_)).all()
+    return [
+        {"title": b.Title, "author": b.Author_.Name if b.Author_ else None}
+        for b in books
+    ]
+
+# Danh sách đã serialize được giữ trong bộ nhớ (hoặc backend dùng chung);
+# commit nào ghi vào Book / Author / Category sẽ tăng version và làm mới cache
+cache_conf = config.get("catalog_cache", {})
+catalog_cache = CatalogCache(
+    load_book_list,
+    backend=make_backend(os.getenv("CATALOG_CACHE_BACKEND", cache_conf.get("backend"))),
+    max_age=cache_conf.get("max_age", 300),
+    enabled=cache_conf.get("enabled", True)
+)
+catalog_cache.watch(SessionLocal, [Book, Author, Category])
+
 # Route gây ra N+1 # Truy cập book.Author
 # Query riêng cho từng row - N queries
 @app.route("/books")
@@ -124,7 +157,7 @@ def get_books_nplus1():
       200:
         description: Danh sách sách và tác giả
     """
-    session = SessionLocal()
+    session = db.get_session()
     books = session.query(Book).all()
     result = []
     for book in books:
@@ -143,22 +176,44 @@ def get_books_nplus1():
 @app.route("/books-solution")
 def get_books_optimized():
     """
-    Lấy danh sách sách (đã tối ưu bằng joinedload)
+    Lấy danh sách sách (đã tối ưu bằng joinedload, qua catalog cache)
     ---
     responses:
       200:
         description: Danh sách sách với thông tin tác giả (tối ưu)
     """
-    session = SessionLocal()
-    books = session.query(Book).options(joinedload(Book.Author_)).all()
-    result = [
-        {"title": b.Title, "author": b.Author_.Name if b.Author_ else None}
-        for b in books
-    ]
-    return Response(
-        json.dumps(result, ensure_ascii=False, indent=2),
-        content_type="application/json; charset=utf-8"
+    return Response(catalog_cache.get(), content_type="application/json; charset=utf-8")
+
+# Chỉ lấy 2 cột cần dùng (không dựng ORM entity), đọc theo chunk từ cursor
+# và stream mảng JSON từng phần: bộ nhớ không phụ thuộc số row
+@app.route("/books-stream")
+def get_books_stream():
+    """
+    Lấy danh sách sách (chỉ select title + author, stream JSON theo chunk)
+    ---
+    responses:
+      200:
+        description: Danh sách sách và tác giả, gửi dần theo từng chunk
+    """
+    session = db.get_session()
+    stmt = (
+        select(Book.Title, Author.Name)
+        .outerjoin(Author, Book.Author_Id == Author.Id)
+        .order_by(Book.Id)
+        .execution_options(yield_per=STREAM_CHUNK_SIZE)
     )
+    rows = session.execute(stmt)
+
+    def generate():
+        sep = "["
+        for chunk in rows.partitions():
+            body = json.dumps([{"title": title, "author": author} for title, author in chunk], ensure_ascii=False)
+            yield sep + body[1:-1]
+            sep = ","
+        yield "[]" if sep == "[" else "]"
+
+    # stream_with_context giữ request (và session) sống đến khi gửi xong
+    return Response(stream_with_context(generate()), content_type="application/json; charset=utf-8")
 
 @app.route("/books-jwt-remote")
 @token_required_remote
@@ -172,16 +227,33 @@ def get_books_jwt_remote():
       200:
         description: Danh sách sách với JWT kiểm tra qua Node.js auth_service
     """
-    session = SessionLocal()
-    books = session.query(Book).options(joinedload(Book.Author_)).all()
-    result = [
-        {"title": b.Title, "author": b.Author_.Name if b.Author_ else None}
-        for b in books
-    ]
-    return Response(
-        json.dumps(result, ensure_ascii=False, indent=2),
-        content_type="application/json; charset=utf-8"
-    )
+    return Response(catalog_cache.get(), content_type="application/json; charset=utf-8")
+
+@app.route("/cache/stats")
+def cache_stats():
+    """
+    Hit rate và bộ nhớ của catalog cache
+    ---
+    responses:
+      200:
+        description: Số hit / miss, version hiện tại và số byte đang cache
+    """
+    return jsonify(catalog_cache.info())
+
+@app.route("/metrics")
+def metrics():
+    """
+    Prometheus metrics (số query và thời gian DB mỗi request, ứng viên N+1)
+    ---
+    responses:
+      200:
+        description: Metrics dạng text của Prometheus
+    """
+    try:
+        from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+    except ImportError:
+        return jsonify({"message": "prometheus_client is not installed"}), 501
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
 
 @app.route("/")
 def index():
@@ -194,7 +266,7 @@ def index():
     """
     return Response(
         json.dumps({
-            "routes": ["/books", "/books-solution", "/books-jwt-remote"],
+            "routes": ["/books", "/books-solution", "/books-stream", "/books-jwt-remote", "/cache/stats", "/metrics"],
             "swagger": swagger_conf.get("specs_route", "/swagger/"),
             "description": "Demo N+1 query issue, solution, và JWT remote auth"
         }, ensure_ascii=False, indent=2),
@@ -203,4 +275,4 @@ def index():
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    app.run(debug=DEBUG)
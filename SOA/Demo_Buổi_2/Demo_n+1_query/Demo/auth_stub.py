@@ -0,0 +1,52 @@
+"""Local stand-in for auth_service and JWT-shaped tokens, for tests and benchmark.py"""
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_token(user_id: int = 1, expires_in: float = 3600, valid: bool = True) -> str:
+    """JWT-shaped token the stub auth service accepts (signature "valid") or rejects"""
+    def part(data: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    claims = {"id": user_id, "exp": int(time.time() + expires_in)}
+    return f"{part({'alg': 'none', 'typ': 'JWT'})}.{part(claims)}.{'valid' if valid else 'forged'}"
+
+
+def start_stub_auth_service(latency: float = 0.0):
+    """
+    Local stand-in for auth_service's GET /protected (keep-alive HTTP/1.1).
+    Returns (server, base_url, calls); stop with server.shutdown().
+    """
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+        def do_GET(self):
+            calls.append(self.path)
+            if latency:
+                time.sleep(latency)
+            token = (self.headers.get("Authorization") or "").split(" ")[-1]
+            parts = token.split(".")
+            try:
+                claims = json.loads(base64.urlsafe_b64decode(parts[1] + "=" * (-len(parts[1]) % 4)))
+                ok = parts[2] == "valid" and claims["exp"] > time.time()
+            except (IndexError, KeyError, ValueError):
+                ok = False
+            status, body = (200, b'{"message": "Hello user, this is protected."}') if ok else (403, b"Forbidden")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json" if ok else "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", calls
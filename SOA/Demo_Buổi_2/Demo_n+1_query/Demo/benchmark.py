@@ -0,0 +1,158 @@
+"""
+Offline benchmarks for the N+1 demo (SQLite stand-in, no SQL Server needed).
+
+    python benchmark.py listing                  # /books-solution vs /books-stream at 1M rows
+    python benchmark.py listing --rows 100000
+    python benchmark.py auth                     # protected-route auth: per-call requests.get vs pooled vs cached
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from auth_stub import make_token, start_stub_auth_service
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def seed_books(path: str, rows: int, authors: int = 1000):
+    """SQLite database with `rows` books spread over `authors` authors"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    from sqlalchemy import insert
+    import db
+    from model import Author, Base, Book
+
+    engine = db.build_engine({"url": os.environ["DATABASE_URL"]})
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Author), [{"Name": f"Author {i}"} for i in range(authors)])
+        for start in range(0, rows, 50_000):
+            conn.execute(insert(Book), [
+                {"Title": f"Book {i}", "ISBN": f"978-{i:09d}", "Published_Year": 1950 + i % 75,
+                 "Author_Id": 1 + i % authors}
+                for i in range(start, min(start + 50_000, rows))
+            ])
+    engine.dispose()
+
+
+def peak_rss_kb():
+    """Peak RSS of this process in KB; None where the resource module is missing (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(route: str) -> dict:
+    """One route in this (fresh) process: time to first byte, total time, peak RSS"""
+    import app as app_module
+
+    client = app_module.app.test_client()
+    baseline_kb = peak_rss_kb()
+    start = time.perf_counter()
+    response = client.get(route, buffered=False)
+    chunks = iter(response.response)
+    size = len(next(chunks, b""))
+    ttfb = time.perf_counter() - start
+    for chunk in chunks:
+        size += len(chunk)
+    total = time.perf_counter() - start
+    response.close()
+    peak_kb = peak_rss_kb()
+    return {"route": route, "ttfb_ms": ttfb * 1000, "total_ms": total * 1000, "bytes": size,
+            "peak_rss_mb": None if peak_kb is None else peak_kb / 1024,
+            "rss_growth_mb": None if peak_kb is None else (peak_kb - baseline_kb) / 1024}
+
+
+def bench_auth(args):
+    import requests
+    from token_verifier import TokenVerifier
+
+    server, base_url, calls = start_stub_auth_service(latency=args.auth_latency_ms / 1000)
+    url = f"{base_url}/protected"
+    tokens = [make_token(user_id=i) for i in range(args.users)]
+
+    def per_call(token):
+        # Before: a new TCP connection per protected request
+        return requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=5).status_code == 200
+
+    pooled = TokenVerifier(url, cache_ttl=0, negative_ttl=0)
+    cached = TokenVerifier(url)
+    variants = [
+        ("requests.get per call", per_call),
+        ("pooled Session, no cache", lambda token: pooled.verify(token).ok),
+        ("pooled Session + cache", lambda token: cached.verify(token).ok),
+    ]
+
+    print(f"{args.requests} verifications, {args.users} distinct tokens, {args.concurrency} threads, "
+          f"auth service latency {args.auth_latency_ms} ms")
+    print(f"{'variant':<26} {'req/s':>9} {'mean ms':>9} {'auth calls':>11}")
+    try:
+        for name, verify in variants:
+            calls.clear()
+            latencies = []
+
+            def timed(i):
+                start = time.perf_counter()
+                assert verify(tokens[i % len(tokens)])
+                latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(timed, range(args.requests)))
+            elapsed = time.perf_counter() - start
+            print(f"{name:<26} {args.requests / elapsed:>9.0f} {sum(latencies) / len(latencies) * 1000:>9.2f} {len(calls):>11}")
+    finally:
+        server.shutdown()
+
+
+def bench_listing(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "books.db")
+        print(f"Seeding {args.rows:,} books...", flush=True)
+        seed_books(path, args.rows)
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{path}", "FLASK_DEBUG": "false"}
+
+        print(f"{'route':<18} {'TTFB ms':>10} {'total ms':>10} {'MB sent':>9} {'peak RSS MB':>12} {'RSS growth MB':>14}")
+        for route in ("/books-solution", "/books-stream"):
+            # Separate process per route, so one route's peak RSS does not hide the other's
+            out = subprocess.run([sys.executable, __file__, "_measure", route], env=env, cwd=HERE,
+                                 capture_output=True, text=True, check=True)
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            rss = ("n/a", "n/a") if r["peak_rss_mb"] is None else (f"{r['peak_rss_mb']:.1f}", f"{r['rss_growth_mb']:.1f}")
+            print(f"{r['route']:<18} {r['ttfb_ms']:>10.1f} {r['total_ms']:>10.1f} {r['bytes'] / 1e6:>9.1f} "
+                  f"{rss[0]:>12} {rss[1]:>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ls = sub.add_parser("listing", help="/books-solution vs /books-stream: TTFB, total time, peak RSS")
+    ls.add_argument("--rows", type=int, default=1_000_000)
+
+    au = sub.add_parser("auth", help="Protected-route auth: per-call requests.get vs pooled Session vs cache")
+    au.add_argument("--requests", type=int, default=2000)
+    au.add_argument("--users", type=int, default=50)
+    au.add_argument("--concurrency", type=int, default=8)
+    au.add_argument("--auth-latency-ms", type=float, default=2.0)
+
+    ms = sub.add_parser("_measure")  # internal: one route, run in a child process
+    ms.add_argument("route")
+
+    args = parser.parse_args()
+    if args.command == "_measure":
+        print(json.dumps(measure(args.route)))
+    elif args.command == "auth":
+        bench_auth(args)
+    else:
+        bench_listing(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Read-through cache cho danh sách book/author đã serialize, invalidate theo version."""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from itertools import chain
+from typing import Any, Callable, Iterable, Optional
+from urllib.parse import urlparse
+
+from sqlalchemy import event
+
+try:
+    import redis
+except ImportError:  # redis là tùy chọn: chỉ cần cho backend redis://
+    redis = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: khóa file bằng msvcrt
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+# Windows khóa bắt buộc: khóa một byte nằm xa sau nội dung để reader không bị chặn
+_LOCK_OFFSET = 1 << 30
+
+
+@contextmanager
+def _exclusive(f):
+    """Khóa ghi file đang mở giữa các process (flock trên Unix, msvcrt.locking trên Windows)"""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield  # nhả khóa khi đóng file
+        return
+    f.seek(_LOCK_OFFSET)
+    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+    try:
+        yield
+    finally:
+        f.seek(_LOCK_OFFSET)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class RedisBackend:
+    """Version + body dùng chung qua Redis (nhiều worker, nhiều host)"""
+
+    def __init__(self, url: str, prefix: str = "catalog"):
+        if redis is None:
+            raise RuntimeError("catalog_cache.backend is redis:// but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def version(self) -> int:
+        return int(self.client.get(f"{self.prefix}:version") or 0)
+
+    def bump(self) -> int:
+        return self.client.incr(f"{self.prefix}:version")
+
+    def get(self, version: int) -> Optional[bytes]:
+        return self.client.get(f"{self.prefix}:body:{version}")
+
+    def set(self, version: int, body: bytes, ttl: float):
+        self.client.set(f"{self.prefix}:body:{version}", body, ex=max(int(ttl), 1))
+
+
+class FileBackend:
+    """Version + body dùng chung qua một thư mục (các worker trên cùng host)"""
+
+    def __init__(self, directory: str):
+        if fcntl is None and msvcrt is None:
+            raise RuntimeError("catalog_cache.backend is file:// but this platform has no file locking (fcntl/msvcrt)")
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._version_path = os.path.join(directory, "version")
+
+    def version(self) -> int:
+        try:
+            with open(self._version_path, "rb") as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def bump(self) -> int:
+        with open(self._version_path, "a+b") as f, _exclusive(f):
+            # read-increment-write an toàn giữa các process
+            f.seek(0)
+            version = int(f.read() or 0) + 1
+            f.seek(0)
+            f.truncate()
+            f.write(str(version).encode())
+            f.flush()
+        return version
+
+    def get(self, version: int) -> Optional[bytes]:
+        try:
+            with open(self._body_path(version), "rb") as f:
+                expires_at, _, body = f.read().partition(b"\n")
+        except FileNotFoundError:
+            return None
+        return body if float(expires_at) > time.time() else None
+
+    def set(self, version: int, body: bytes, ttl: float):
+        current = os.path.basename(self._body_path(version))
+        for name in os.listdir(self.directory):
+            if name.startswith("body-") and name != current:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+        path = self._body_path(version)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(f"{time.time() + ttl}\n".encode() + body)
+        os.replace(tmp, path)  # reader chỉ thấy file cũ hoặc file mới đầy đủ
+
+    def _body_path(self, version: int) -> str:
+        return os.path.join(self.directory, f"body-{version}.json")
+
+
+def make_backend(url: Optional[str]):
+    """"" -> None (chỉ cache trong process), redis://... hoặc file:///path"""
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackend(url)
+    if url.startswith("file://"):
+        return FileBackend(urlparse(url).path)
+    raise ValueError(f"Unsupported catalog cache backend: {url}")
+
+
+class CatalogCache:
+    """
+    Giữ kết quả của ``loader()`` dưới dạng bytes đã serialize, gắn với một
+    version. Mỗi lần ghi (commit có thay đổi Book/Author/Category, xem
+    ``watch``) version tăng và lần đọc sau load lại; ``max_age`` là giới hạn
+    phòng khi dữ liệu bị sửa ngoài app.
+
+    Có ``backend`` thì version và body được dùng chung giữa các worker:
+    worker nào load trước thì các worker khác lấy luôn bytes từ backend.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], Any],
+        serialize: Callable[[Any], bytes] = lambda data: json.dumps(data, ensure_ascii=False, indent=2).encode(),
+        backend=None,
+        max_age: float = 300.0,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.loader = loader
+        self.serialize = serialize
+        self.backend = backend
+        self.max_age = max_age
+        self.enabled = enabled
+        self._clock = clock
+        self._local_version = 0
+        self._entry: Optional[tuple] = None  # (version, loaded_at, body)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "shared_hits": 0, "misses": 0, "invalidations": 0}
+
+    def version(self) -> int:
+        return self.backend.version() if self.backend is not None else self._local_version
+
+    def get(self) -> bytes:
+        if not self.enabled:
+            return self.serialize(self.loader())
+        version = self.version()
+        body = self._fresh(version)
+        if body is not None:
+            self.stats["hits"] += 1
+            return body
+
+        # Một lần load mỗi process; các request đồng thời chờ rồi dùng kết quả
+        with self._lock:
+            body = self._fresh(version)
+            if body is not None:
+                self.stats["hits"] += 1
+                return body
+            if self.backend is not None:
+                body = self.backend.get(version)
+                if body is not None:
+                    self.stats["shared_hits"] += 1
+                    self._entry = (version, self._clock(), body)
+                    return body
+            self.stats["misses"] += 1
+            body = self.serialize(self.loader())
+            self._entry = (version, self._clock(), body)
+            if self.backend is not None:
+                self.backend.set(version, body, self.max_age)
+            return body
+
+    def invalidate(self):
+        if self.backend is not None:
+            self.backend.bump()
+        else:
+            self._local_version += 1
+        self._entry = None
+        self.stats["invalidations"] += 1
+
+    def info(self) -> dict:
+        """Hit rate và bộ nhớ, cho endpoint /cache/stats"""
+        lookups = self.stats["hits"] + self.stats["shared_hits"] + self.stats["misses"]
+        entry = self._entry
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__ if self.backend is not None else "memory",
+            "version": self.version(),
+            **self.stats,
+            "hit_rate": round((self.stats["hits"] + self.stats["shared_hits"]) / lookups, 4) if lookups else 0.0,
+            "cached_version": entry[0] if entry else None,
+            "cached_bytes": len(entry[2]) if entry else 0,
+            "age_seconds": round(self._clock() - entry[1], 3) if entry else None,
+        }
+
+    def watch(self, session_factory, models: Iterable[type]):
+        """Tăng version sau mỗi commit của session_factory có ghi vào một trong các model"""
+        models = tuple(models)
+
+        @event.listens_for(session_factory, "after_flush")
+        def _mark_flush(session, flush_context):
+            # new / dirty / deleted vẫn là trạng thái trước flush ở thời điểm này
+            if any(isinstance(obj, models) for obj in chain(session.new, session.dirty, session.deleted)):
+                session.info["catalog_dirty"] = True
+
+        @event.listens_for(session_factory, "do_orm_execute")
+        def _mark_bulk(orm_execute_state):
+            # update(Book) / delete(Author) ... chạy qua session.execute
+            if (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert) and \
+                    any(mapper.class_ in models for mapper in orm_execute_state.all_mappers):
+                orm_execute_state.session.info["catalog_dirty"] = True
+
+        @event.listens_for(session_factory, "after_commit")
+        def _invalidate(session):
+            if session.info.pop("catalog_dirty", False):
+                self.invalidate()
+
+        @event.listens_for(session_factory, "after_rollback")
+        def _discard(session):
+            session.info.pop("catalog_dirty", None)
+
+    def _fresh(self, version: int) -> Optional[bytes]:
+        entry = self._entry
+        if entry is not None and entry[0] == version and self._clock() - entry[1] < self.max_age:
+            return entry[2]
+        return None
@@ -0,0 +1,87 @@
+"""Engine, connection pool và session theo từng request (đọc cấu hình từ config.yaml)."""
+import urllib.parse
+
+from flask import current_app, g
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Collation mà model.py (sinh từ SQL Server) gắn vào mọi cột Unicode
+SQL_SERVER_COLLATION = "SQL_Latin1_General_CP1_CI_AS"
+
+
+def connection_url(db_conf: dict) -> str:
+    """`url` trong config (vd. sqlite:///books.db) nếu có, không thì chuỗi ODBC tới SQL Server"""
+    if db_conf.get("url"):
+        return db_conf["url"]
+
+    params = {
+        "DRIVER": f"{{{db_conf['driver']}}}",
+        "SERVER": db_conf["server"],
+        "DATABASE": db_conf["database"],
+        "Trusted_Connection": "yes",
+        "Encrypt": "yes" if db_conf.get("encrypt", False) else "no",
+    }
+    # Build connection string (dùng để kết nối và sinh model.py từ SQLcodegen)
+    return f"mssql+pyodbc:///?odbc_connect={urllib.parse.quote_plus(';'.join(f'{k}={v}' for k, v in params.items()))}"
+
+
+def build_engine(db_conf: dict, debug: bool = False):
+    """
+    Engine với pool cấu hình được (database.pool trong config.yaml).
+    SQL echo chỉ bật khi debug (hoặc database.echo), vì nó log đồng bộ từng câu lệnh.
+    """
+    url = make_url(connection_url(db_conf))
+    pool_conf = db_conf.get("pool", {})
+    options = {"echo": db_conf.get("echo", debug)}
+
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory SQLite: mọi connection phải dùng chung một database
+        options.update(poolclass=StaticPool, connect_args={"check_same_thread": False})
+    else:
+        options.update(
+            pool_size=pool_conf.get("size", 10),
+            max_overflow=pool_conf.get("max_overflow", 20),
+            pool_timeout=pool_conf.get("timeout", 30),
+            pool_recycle=pool_conf.get("recycle", 1800),
+            pool_pre_ping=pool_conf.get("pre_ping", True),
+        )
+        if url.get_backend_name() == "sqlite":
+            options["connect_args"] = {"check_same_thread": False}
+
+    engine = create_engine(url, **options)
+
+    if url.get_backend_name() == "sqlite":
+        # SQLite stand-in (test, soak, benchmark): giả lập collation CI của SQL Server
+        @event.listens_for(engine, "connect")
+        def _register_collation(dbapi_connection, _):
+            dbapi_connection.create_collation(
+                SQL_SERVER_COLLATION,
+                lambda a, b: (a.lower() > b.lower()) - (a.lower() < b.lower())
+            )
+
+    return engine
+
+
+def init_app(app, session_factory: sessionmaker):
+    """
+    Một session cho mỗi request, tạo khi cần (get_session) và luôn được đóng
+    ở teardown, nên connection trả về pool ngay khi request kết thúc.
+    """
+    app.extensions["db_session_factory"] = session_factory
+
+    @app.teardown_appcontext
+    def close_session(exc):
+        session = g.pop("db_session", None)
+        if session is not None:
+            if exc is not None:
+                session.rollback()
+            session.close()
+
+
+def get_session():
+    """Session của request hiện tại"""
+    if "db_session" not in g:
+        g.db_session = current_app.extensions["db_session_factory"]()
+    return g.db_session
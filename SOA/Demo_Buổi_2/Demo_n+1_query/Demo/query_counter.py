@@ -0,0 +1,129 @@
+"""Đếm câu SQL theo request và phát hiện N+1 qua SQLAlchemy engine events."""
+import logging
+import re
+import time
+from collections import Counter as ShapeCounter
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+try:
+    from prometheus_client import Counter, Histogram
+except ImportError:  # prometheus_client là tùy chọn: chỉ còn response headers
+    Counter = Histogram = None
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+class NPlusOneError(RuntimeError):
+    """Cùng một câu lệnh (cùng shape) chạy quá nhiều lần trong một request"""
+
+
+def statement_shape(statement: str) -> str:
+    """Câu SQL với literal / IN-list được thay bằng ?, để gom các câu chỉ khác tham số"""
+    shape = _LITERALS.sub("?", statement)
+    shape = _IN_LISTS.sub("(?)", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+class RequestQueries:
+    __slots__ = ("count", "seconds", "shapes", "candidates")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = ShapeCounter()
+        self.candidates = []
+
+
+class QueryCounter:
+    """
+    Gắn vào engine (before/after_cursor_execute) và Flask app:
+
+    - mỗi request: số câu lệnh, tổng thời gian DB, số lần mỗi shape chạy
+    - shape nào chạy đến ``n1_threshold`` lần trong một request là ứng viên
+      N+1: log warning, hoặc raise ``NPlusOneError`` ngay tại chỗ query khi
+      ``raise_on_n1`` (dùng trong test)
+    - response headers X-DB-Query-Count / X-DB-Time-Ms / X-N1-Candidates và
+      Prometheus metrics (nếu cài prometheus_client)
+    """
+
+    def __init__(self, n1_threshold: int = 3, raise_on_n1: bool = False, registry=None):
+        self.n1_threshold = n1_threshold
+        self.raise_on_n1 = raise_on_n1
+        if Histogram is None:
+            self.queries = self.db_time = self.n1_candidates = None
+            return
+        kwargs = {} if registry is None else {"registry": registry}
+        self.queries = Histogram(
+            "db_queries_per_request",
+            "SQL statements executed per request",
+            ["endpoint"],
+            buckets=(1, 2, 3, 5, 10, 20, 50, 100, 250, 1000),
+            **kwargs
+        )
+        self.db_time = Histogram(
+            "db_time_per_request_seconds",
+            "Total time spent in SQL per request",
+            ["endpoint"],
+            **kwargs
+        )
+        self.n1_candidates = Counter(
+            "db_n_plus_one_candidates_total",
+            "Statement shapes repeated n1_threshold times within one request",
+            ["endpoint"],
+            **kwargs
+        )
+
+    def init_app(self, app, engine):
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    @staticmethod
+    def current():
+        """Thống kê của request hiện tại (None ngoài request)"""
+        return g.get("db_queries") if has_app_context() else None
+
+    def _start_request(self):
+        g.db_queries = RequestQueries()
+
+    def _finish_request(self, response):
+        stats = self.current()
+        if stats is None:
+            return response
+        # Với response streaming, chỉ tính các câu đã chạy trước khi gửi headers
+        response.headers["X-DB-Query-Count"] = str(stats.count)
+        response.headers["X-DB-Time-Ms"] = f"{stats.seconds * 1000:.2f}"
+        response.headers["X-N1-Candidates"] = str(len(stats.candidates))
+        if self.queries is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "<unmatched>"
+            self.queries.labels(endpoint=endpoint).observe(stats.count)
+            self.db_time.labels(endpoint=endpoint).observe(stats.seconds)
+            if stats.candidates:
+                self.n1_candidates.labels(endpoint=endpoint).inc(len(stats.candidates))
+        return response
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        stats = self.current()
+        if stats is None:
+            return
+        stats.count += 1
+        stats.seconds += elapsed
+        shape = statement_shape(statement)
+        stats.shapes[shape] += 1
+        if stats.shapes[shape] == self.n1_threshold:
+            stats.candidates.append(shape)
+            message = f"Possible N+1 on {request.path}: {self.n1_threshold}x {shape[:200]}"
+            if self.raise_on_n1:
+                raise NPlusOneError(message)
+            logger.warning(message)
@@ -0,0 +1,224 @@
+"""Tests for app.py on a SQLite stand-in (no SQL Server or auth service needed)"""
+import gc
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# Must be set before app.py builds its engine
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'books.db')}")
+
+import app as app_module
+from auth_stub import make_token, start_stub_auth_service
+from model import Author, Base, Book
+from catalog_cache import CatalogCache, FileBackend
+from query_counter import NPlusOneError, statement_shape
+from token_verifier import TokenVerifier
+
+AUTHORS = 20
+BOOKS = 200
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seeded():
+    Base.metadata.drop_all(app_module.engine)
+    Base.metadata.create_all(app_module.engine)
+    with app_module.SessionLocal() as session:
+        authors = [Author(Name=f"Author {i}") for i in range(AUTHORS)]
+        session.add_all(authors)
+        session.add_all(Book(Title=f"Book {i}", Author_=authors[i % AUTHORS]) for i in range(BOOKS))
+        session.commit()
+    yield
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+def test_books_routes_return_every_book(client):
+    for route in ("/books", "/books-solution"):
+        books = client.get(route).get_json()
+        assert len(books) == BOOKS
+        assert books[0] == {"title": "Book 0", "author": "Author 0"}
+
+
+def test_books_stream_matches_solution(client, monkeypatch):
+    monkeypatch.setattr(app_module, "STREAM_CHUNK_SIZE", 7)
+    response = client.get("/books-stream", buffered=False)
+    assert response.headers["X-DB-Query-Count"] == "1"
+    chunks = list(response.response)
+    response.close()
+    assert len(chunks) > BOOKS // 7
+    assert b"\n" not in b"".join(chunks)  # no indentation
+    assert json.loads(b"".join(chunks)) == client.get("/books-solution").get_json()
+    assert app_module.engine.pool.checkedout() == 0
+
+
+def test_session_closed_after_each_request(client):
+    client.get("/books-solution")
+    assert app_module.engine.pool.checkedout() == 0
+
+
+def test_books_solution_issues_one_query_regardless_of_rows(client, monkeypatch):
+    monkeypatch.setattr(app_module.catalog_cache, "enabled", False)  # every call goes to the database
+    assert client.get("/books-solution").headers["X-DB-Query-Count"] == "1"
+
+    with app_module.SessionLocal() as session:
+        extra = [Book(Title=f"Extra {i}", Author_=Author(Name=f"Extra author {i}")) for i in range(300)]
+        session.add_all(extra)
+        session.commit()
+        try:
+            response = client.get("/books-solution")
+            assert len(response.get_json()) == BOOKS + 300
+            assert response.headers["X-DB-Query-Count"] == "1"
+            assert response.headers["X-N1-Candidates"] == "0"
+        finally:
+            for book in extra:
+                session.delete(book.Author_)
+                session.delete(book)
+            session.commit()
+
+
+def test_nplus1_route_flagged(client, monkeypatch):
+    response = client.get("/books")
+    # 1 query for the books + 1 lazy load per distinct author
+    assert response.headers["X-DB-Query-Count"] == str(1 + AUTHORS)
+    assert response.headers["X-N1-Candidates"] == "1"
+    assert float(response.headers["X-DB-Time-Ms"]) > 0
+
+    monkeypatch.setattr(app_module.query_counter, "raise_on_n1", True)
+    monkeypatch.setattr(app_module.app, "testing", True)
+    with pytest.raises(NPlusOneError):
+        client.get("/books")
+    assert client.get("/books-solution").status_code == 200
+
+
+def test_statement_shape_ignores_literals():
+    assert statement_shape("SELECT * FROM Book WHERE Id = 5 AND Title = 'it''s'") == \
+        statement_shape("SELECT *\n  FROM Book WHERE Id = 12 AND Title = 'x'")
+    assert statement_shape("SELECT 1 WHERE Id IN (?, ?, ?)") == "SELECT ? WHERE Id IN (?)"
+
+
+def test_catalog_cache_serves_bytes_until_a_write(client):
+    app_module.catalog_cache.invalidate()
+    first = client.get("/books-solution")
+    assert first.headers["X-DB-Query-Count"] == "1"
+    cached = client.get("/books-solution")
+    assert cached.headers["X-DB-Query-Count"] == "0" and cached.data == first.data
+
+    # A commit touching Book bumps the version; a read-only session does not
+    with app_module.SessionLocal() as session:
+        session.query(Book).all()
+        session.commit()
+    assert client.get("/books-solution").headers["X-DB-Query-Count"] == "0"
+    with app_module.SessionLocal() as session:
+        session.get(Book, 1).Title = "Renamed"
+        session.commit()
+        try:
+            response = client.get("/books-solution")
+            assert response.headers["X-DB-Query-Count"] == "1"
+            assert response.get_json()[0]["title"] == "Renamed"
+        finally:
+            session.get(Book, 1).Title = "Book 0"
+            session.commit()
+
+    stats = client.get("/cache/stats").get_json()
+    assert stats["invalidations"] >= 2 and stats["cached_bytes"] == 0
+    assert 0 < stats["hit_rate"] < 1
+
+
+def test_catalog_cache_shared_between_workers(tmp_path):
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return [{"title": "Book", "author": "Author"}]
+
+    # Two caches on one FileBackend stand in for two Flask workers
+    worker_a, worker_b = (CatalogCache(loader, backend=FileBackend(str(tmp_path))) for _ in range(2))
+    assert worker_a.get() == worker_b.get()
+    assert len(loads) == 1 and worker_b.stats["shared_hits"] == 1
+
+    worker_a.invalidate()  # a write in worker A is seen by worker B
+    worker_b.get()
+    assert len(loads) == 2 and worker_b.version() == 1
+
+
+@pytest.fixture
+def auth_service(monkeypatch):
+    server, base_url, calls = start_stub_auth_service()
+    monkeypatch.setattr(app_module.token_verifier, "auth_url", f"{base_url}/protected")
+    app_module.token_verifier.clear()
+    yield server, calls
+    server.shutdown()
+
+
+def test_protected_route_verifies_each_token_once(client, auth_service):
+    server, calls = auth_service
+    headers = {"Authorization": f"Bearer {make_token()}"}
+    assert [client.get("/books-jwt-remote", headers=headers).status_code for _ in range(3)] == [200] * 3
+    assert len(calls) == 1
+
+    # Rejections are cached too (briefly)
+    forged = {"Authorization": f"Bearer {make_token(valid=False)}"}
+    for _ in range(2):
+        response = client.get("/books-jwt-remote", headers=forged)
+        assert response.status_code == 403 and response.get_json() == {"message": "Token invalid or expired"}
+    assert len(calls) == 2
+    assert client.get("/books-jwt-remote").status_code == 401
+
+    # Auth service errors are never cached
+    app_module.token_verifier.auth_url = "http://127.0.0.1:1/protected"  # nothing listens there
+    other = {"Authorization": f"Bearer {make_token(user_id=2)}"}
+    assert [client.get("/books-jwt-remote", headers=other).status_code for _ in range(2)] == [503, 503]
+    assert client.get("/books-jwt-remote", headers=headers).status_code == 200  # still cached
+
+
+def test_verification_cached_until_token_expiry(auth_service):
+    server, calls = auth_service
+    now = [time.time()]
+    verifier = TokenVerifier(app_module.token_verifier.auth_url, cache_ttl=300, clock=lambda: now[0])
+    token = make_token(expires_in=60)
+
+    assert verifier.verify(token).ok and verifier.verify(token).ok
+    assert len(calls) == 1
+    now[0] += 61  # past exp: the cached success is gone, the service decides again
+    verifier.verify(token)
+    assert len(calls) == 2
+
+
+def test_pool_occupancy_flat_under_concurrent_soak(monkeypatch):
+    monkeypatch.setattr(app_module.catalog_cache, "enabled", False)
+    pool = app_module.engine.pool
+    limit = pool.size() + pool._max_overflow
+    samples = []
+    done = threading.Event()
+
+    def monitor():
+        while not done.is_set():
+            samples.append(pool.checkedout())
+            done.wait(0.005)
+
+    def call(_):
+        return app_module.app.test_client().get("/books-solution").status_code
+
+    # Without GC a leaked session would keep its connection checked out for good
+    gc.disable()
+    watcher = threading.Thread(target=monitor)
+    watcher.start()
+    try:
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            statuses = list(executor.map(call, range(1000)))
+    finally:
+        done.set()
+        watcher.join()
+        gc.enable()
+
+    assert statuses == [200] * 1000
+    assert max(samples) <= limit
+    assert pool.checkedout() == 0
@@ -0,0 +1,143 @@
+"""Xác thực JWT qua auth_service, có cache kết quả và (tùy chọn) verify chữ ký tại chỗ."""
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import jwt  # PyJWT, chỉ cần khi verify tại chỗ
+except ImportError:
+    jwt = None
+
+logger = logging.getLogger(__name__)
+
+
+class Verification(NamedTuple):
+    ok: bool
+    status: int
+    message: str
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """`exp` trong payload (epoch giây), đọc KHÔNG kiểm tra chữ ký; None nếu không có"""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenVerifier:
+    """
+    - Gọi ``auth_url`` qua một ``requests.Session`` dùng chung (keep-alive,
+      pool ``pool_size`` connection) thay vì mở TCP mới mỗi request.
+    - Token hợp lệ được cache (key = SHA-256 của token) đến khi hết hạn
+      (``exp``), tối đa ``cache_ttl`` giây; token bị từ chối (401/403) được
+      cache ``negative_ttl`` giây. Lỗi của auth service (5xx, timeout,
+      không kết nối được) không bao giờ được cache.
+    - Có ``jwt_key`` (public key PEM cho RS256/ES256, hoặc secret cho HS256)
+      và cài PyJWT: chữ ký được verify tại chỗ, không gọi auth service.
+    """
+
+    def __init__(
+        self,
+        auth_url: str,
+        timeout: float = 5.0,
+        cache_ttl: float = 300.0,
+        negative_ttl: float = 5.0,
+        max_entries: int = 10000,
+        pool_size: int = 20,
+        jwt_key: Optional[str] = None,
+        jwt_algorithms: Sequence[str] = ("RS256",),
+        clock: Callable[[], float] = time.time,
+    ):
+        self.auth_url = auth_url
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.jwt_algorithms = list(jwt_algorithms)
+        self._clock = clock
+        if jwt_key and jwt is None:
+            logger.warning("jwt_key is configured but PyJWT is not installed: verifying through the auth service")
+        self.jwt_key = jwt_key if jwt is not None else None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # sha256(token) -> (expires_at, Verification)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "remote_calls": 0, "local_verifications": 0}
+
+    def verify(self, token: str) -> Verification:
+        key = hashlib.sha256(token.encode()).hexdigest()
+        now = self._clock()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+
+        if self.jwt_key is not None:
+            result, ttl = self._verify_locally(token, now)
+        else:
+            result, ttl = self._verify_remote(token, now)
+
+        if ttl > 0:
+            with self._lock:
+                self._cache[key] = (now + ttl, result)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _positive_ttl(self, token: str, now: float) -> float:
+        expires = token_expiry(token)
+        return self.cache_ttl if expires is None else min(expires - now, self.cache_ttl)
+
+    def _verify_remote(self, token: str, now: float):
+        with self._lock:
+            self.stats["remote_calls"] += 1
+        try:
+            resp = self.session.get(self.auth_url, headers={"Authorization": f"Bearer {token}"}, timeout=self.timeout)
+        except requests.exceptions.Timeout:
+            return Verification(False, 504, "Auth service timeout"), 0
+        except requests.exceptions.ConnectionError:
+            return Verification(False, 503, "Auth service unreachable"), 0
+
+        if resp.status_code == 200:
+            return Verification(True, 200, "OK"), self._positive_ttl(token, now)
+        try:
+            msg = resp.json().get("message", "Token invalid or expired")
+        except ValueError:
+            msg = "Token invalid or expired"
+        ttl = self.negative_ttl if resp.status_code in (401, 403) else 0
+        return Verification(False, resp.status_code, msg), ttl
+
+    def _verify_locally(self, token: str, now: float):
+        with self._lock:
+            self.stats["local_verifications"] += 1
+        try:
+            jwt.decode(token, self.jwt_key, algorithms=self.jwt_algorithms)
+        except jwt.ExpiredSignatureError:
+            return Verification(False, 403, "Token expired"), self.negative_ttl
+        except jwt.InvalidTokenError:
+            return Verification(False, 403, "Token invalid or expired"), self.negative_ttl
+        return Verification(True, 200, "OK"), self._positive_ttl(token, now)
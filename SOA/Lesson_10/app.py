@@ -1,46 +1,117 @@
-from fastapi import FastAPI, HTTPException, Request, status, Path
-from fastapi.responses import PlainTextResponse
+from fastapi import FastAPI, HTTPException, Request, status, Path, Query, Body
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 from fastapi.openapi.utils import get_openapi
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from starlette.routing import Match
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator
+from typing import Any, List, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import json
 import logging
 import time
 import os
 import uvicorn
 import httpx
-import requests
 import pybreaker
 from datetime import datetime
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from limits import parse as parse_limit
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from resilience import AdaptiveCircuitBreaker, Bulkhead, BulkheadFullError, Deadline, DeadlineExceeded, Hedger, current_deadline
+from product_store import ProductStore
+from enrichment_cache import EnrichmentCache
+from enrichment_refresher import EnrichmentRefresher
+from logging_setup import setup_logging
+from metrics_exposition import CachedExposition, accepts_gzip
+import ratelimit_storage  # registers the shm:// rate limit storage scheme
+from compression import CompressionMiddleware
+from health import HealthProbeMiddleware, LoopLagMonitor
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse
+except ImportError:  # orjson is optional: stdlib json
+    orjson = None
 
 # CONFIGURATION
 
 DEBUG = os.getenv("DEBUG", "True").lower() == "true"
+RELOAD = os.getenv("RELOAD", "False").lower() == "true"  # Auto-reload only when explicitly requested
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
-REDIS_URL = os.getenv("REDIS_URL", "memory://")  # Fallback to memory if Redis not available
+LOG_MODE = os.getenv("LOG_MODE", "queue")  # "queue": I/O in a background thread, "sync": write inline
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_ACCESS_SAMPLE_RATE = float(os.getenv("LOG_ACCESS_SAMPLE_RATE", "1.0"))  # Fraction of access lines kept
+METRICS_CACHE_SECONDS = float(os.getenv("METRICS_CACHE_SECONDS", "1.0"))  # Scrapes within this window share one render
+# Rate limit storage: redis://... when Redis is available, otherwise shm:// shares
+# counters between the worker processes on this host (memory:// is per process)
+REDIS_URL = os.getenv("REDIS_URL", "shm://")
+EXTERNAL_API_BASE_URL = os.getenv("EXTERNAL_API_BASE_URL", "https://jsonplaceholder.typicode.com")
+EXTERNAL_API_TIMEOUT = float(os.getenv("EXTERNAL_API_TIMEOUT", "5.0"))  # Per-call deadline (seconds)
+EXTERNAL_API_MAX_CONNECTIONS = int(os.getenv("EXTERNAL_API_MAX_CONNECTIONS", "100"))
+EXTERNAL_API_MAX_KEEPALIVE = int(os.getenv("EXTERNAL_API_MAX_KEEPALIVE", "20"))
+EXTERNAL_API_MAX_CONCURRENT = int(os.getenv("EXTERNAL_API_MAX_CONCURRENT", "50"))  # Bulkhead: upstream calls in flight
+EXTERNAL_API_MAX_QUEUE = int(os.getenv("EXTERNAL_API_MAX_QUEUE", "100"))  # Bulkhead: callers waiting for a slot
+EXTERNAL_API_QUEUE_TIMEOUT = float(os.getenv("EXTERNAL_API_QUEUE_TIMEOUT", "1.0"))  # Bulkhead: max wait (seconds)
+# Deadline propagation: the client's remaining budget (ms) arrives in this header and is passed upstream
+DEADLINE_HEADER = os.getenv("DEADLINE_HEADER", "X-Request-Timeout-Ms")
+GET_PRODUCT_BUDGET = float(os.getenv("GET_PRODUCT_BUDGET", "2.0"))  # Budget (seconds) when the header is absent
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "False").lower() == "true"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))  # Hedge once the first attempt is slower than this quantile
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.01"))  # Never hedge sooner (seconds)
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))  # At most this many hedges per call
+ENRICHMENT_CACHE_SIZE = int(os.getenv("ENRICHMENT_CACHE_SIZE", "10000"))
+ENRICHMENT_CACHE_TTL = float(os.getenv("ENRICHMENT_CACHE_TTL", "300"))  # Successes (seconds)
+ENRICHMENT_CACHE_NEGATIVE_TTL = float(os.getenv("ENRICHMENT_CACHE_NEGATIVE_TTL", "5"))  # Failures (seconds)
+ENRICHMENT_CACHE_STALE_TTL = float(os.getenv("ENRICHMENT_CACHE_STALE_TTL", "600"))  # Serve expired successes this long while reloading
+ENRICHMENT_REFRESH_ENABLED = os.getenv("ENRICHMENT_REFRESH_ENABLED", "True").lower() == "true"
+ENRICHMENT_REFRESH_INTERVAL = float(os.getenv("ENRICHMENT_REFRESH_INTERVAL", "30"))  # Seconds between prefetch cycles
+ENRICHMENT_REFRESH_TOP_K = int(os.getenv("ENRICHMENT_REFRESH_TOP_K", "1000"))  # Hottest product ids kept warm
+ENRICHMENT_REFRESH_CONCURRENCY = int(os.getenv("ENRICHMENT_REFRESH_CONCURRENCY", "4"))  # Upstream calls per cycle at once
+ENRICHMENT_REFRESH_DRAIN_SECONDS = float(os.getenv("ENRICHMENT_REFRESH_DRAIN_SECONDS", "5"))  # Shutdown grace period
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))  # Open at this failure rate...
+BREAKER_MINIMUM_CALLS = int(os.getenv("BREAKER_MINIMUM_CALLS", "5"))  # ...once the window has this many calls
+BREAKER_WINDOW_SECONDS = int(os.getenv("BREAKER_WINDOW_SECONDS", "30"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "2.0"))  # Slower calls count as failures
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))  # Doubled per consecutive trip...
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv("BREAKER_MAX_OPEN_SECONDS", "300"))  # ...up to this
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "3"))  # Concurrent probes / successes to close
+PRODUCTS_PAGE_SIZE = int(os.getenv("PRODUCTS_PAGE_SIZE", "100"))  # Default `limit` once paginating
+PRODUCTS_PAGE_MAX = int(os.getenv("PRODUCTS_PAGE_MAX", "1000"))
+JSON_ENCODER = os.getenv("JSON_ENCODER", "orjson" if orjson else "json")  # "orjson" (if installed) or "json"
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "True").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))  # Smaller bodies are sent as is
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))  # Items per /products:batch request
+BATCH_ITEMS_PER_MINUTE = int(os.getenv("BATCH_ITEMS_PER_MINUTE", "10000"))  # Item budget per client and operation
+READINESS_CACHE_SECONDS = float(os.getenv("READINESS_CACHE_SECONDS", "0.5"))  # Probes within this window share one check
+READINESS_MAX_LOOP_LAG = float(os.getenv("READINESS_MAX_LOOP_LAG", "0.5"))  # Not ready above this event loop lag (seconds)
+READINESS_MAX_LOG_BACKLOG = int(os.getenv("READINESS_MAX_LOG_BACKLOG", "50000"))  # Not ready above this many queued log records
 
 # LOGGING SETUP
-# Setup basic logging
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
+# File + console handlers; in queue mode they run on a background listener thread
+log_listener = setup_logging(
+    level=LOG_LEVEL,
+    mode=LOG_MODE,
+    fmt=LOG_FORMAT,
+    log_file=LOG_FILE,
+    access_sample_rate=LOG_ACCESS_SAMPLE_RATE
 )
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger("app.access")
 
 # METRICS SETUP (Prometheus)
 
-from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
 
 registry = CollectorRegistry()
 
+# `endpoint` is always a route template ("/products/{product_id}"), never the raw
+# path, so the number of series stays bounded no matter how many ids are requested
+
 request_count = Counter(
     'api_requests_total',
     'Total API requests',
@@ -55,38 +126,121 @@ request_duration = Histogram(
     registry=registry
 )
 
+requests_in_progress = Gauge(
+    'api_requests_in_progress',
+    'API requests currently being handled',
+    ['method', 'endpoint'],
+    registry=registry
+)
+
+response_size = Histogram(
+    'api_response_size_bytes',
+    'API response body size',
+    ['method', 'endpoint'],
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000),
+    registry=registry
+)
+
+# /metrics body, rendered in a worker thread and cached for METRICS_CACHE_SECONDS
+metrics_exposition = CachedExposition(registry, ttl=METRICS_CACHE_SECONDS)
+
 # RATE LIMITING SETUP
 
 limiter = Limiter(
     key_func=get_remote_address,
     storage_uri=REDIS_URL,
-    default_limits=["100/minute"]
+    default_limits=["100/minute"],
+    enabled=RATE_LIMIT_ENABLED
 )
 
 # CIRCUIT BREAKER SETUP
 
-external_api_breaker = pybreaker.CircuitBreaker(
-    fail_max=3,
-    reset_timeout=30,
-    exclude=[KeyError]
+# Opens on the failure rate over a sliding window (errors, timeouts and slow calls)
+external_api_breaker = AdaptiveCircuitBreaker(
+    "external_api",
+    failure_rate_threshold=BREAKER_FAILURE_RATE,
+    window_seconds=BREAKER_WINDOW_SECONDS,
+    minimum_calls=BREAKER_MINIMUM_CALLS,
+    slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+    open_seconds=BREAKER_OPEN_SECONDS,
+    max_open_seconds=BREAKER_MAX_OPEN_SECONDS,
+    half_open_max_calls=BREAKER_HALF_OPEN_CALLS,
+    exclude=[KeyError, DeadlineExceeded],
+    registry=registry
 )
 
-def sync_external_call(product_id: int):
-    """Sync wrapper for circuit breaker"""
-    import requests
-    
+# Bulkhead around the breaker: caps upstream fan-out, rejects at once when the queue is full
+external_api_bulkhead = Bulkhead(
+    "external_api",
+    max_concurrent=EXTERNAL_API_MAX_CONCURRENT,
+    max_queue=EXTERNAL_API_MAX_QUEUE,
+    queue_timeout=EXTERNAL_API_QUEUE_TIMEOUT,
+    registry=registry
+)
+
+# Second attempt after the observed p95, whichever answers first wins
+external_api_hedger = Hedger(
+    "external_api",
+    quantile=HEDGE_QUANTILE,
+    min_delay=HEDGE_MIN_DELAY,
+    max_ratio=HEDGE_MAX_RATIO,
+    registry=registry
+)
+
+# Default budgets per route template; a client header may only shorten them
+ROUTE_BUDGETS = {
+    "/products/{product_id}": GET_PRODUCT_BUDGET,
+}
+
+# Shared HTTP client: one connection pool for every outbound call
+http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared AsyncClient, creating it on first use"""
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            base_url=EXTERNAL_API_BASE_URL,
+            timeout=httpx.Timeout(EXTERNAL_API_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=EXTERNAL_API_MAX_CONNECTIONS,
+                max_keepalive_connections=EXTERNAL_API_MAX_KEEPALIVE
+            )
+        )
+    return http_client
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+@external_api_bulkhead
+@external_api_breaker
+async def external_api_call(product_id: int, timeout: float = EXTERNAL_API_TIMEOUT, client_deadline: bool = False):
+    """
+    Async external call, guarded by the bulkhead and the circuit breaker.
+    client_deadline: timeout was cut short by the client's budget, so running
+    out of it is not held against the upstream (DeadlineExceeded)
+    """
     if product_id == 999:
         raise Exception("Simulated circuit breaker failure")
     
-    url = f"https://jsonplaceholder.typicode.com/posts/{product_id}"
-    logger.info(f"Calling external API: {url}")
+    url = f"/posts/{product_id}"
+    logger.info(f"Calling external API: {EXTERNAL_API_BASE_URL}{url}")
     
-    response = requests.get(url, timeout=5.0)
+    # Deadline covers pool wait + connect + read; a timeout counts as a breaker failure.
+    # The upstream gets what is left of it, so it can give up when we will
+    headers = {DEADLINE_HEADER: str(int(timeout * 1000))}
+    try:
+        response = await asyncio.wait_for(get_http_client().get(url, headers=headers, timeout=timeout), timeout=timeout)
+    except asyncio.TimeoutError:
+        if client_deadline:
+            raise DeadlineExceeded(f"Client deadline reached after {timeout:g}s") from None
+        raise
     response.raise_for_status()
     return response.json()
 
-external_api_call = external_api_breaker(sync_external_call)
-
 # DATA MODELS
 
 class Product(BaseModel):
@@ -107,6 +261,9 @@ class Product(BaseModel):
             }
         }
 
+class ProductDetail(Product):
+    external_info: Optional[dict] = Field(None, description="Data enriched from the external API", example={"title": "sunt aut facere", "rating": 4.5})
+
 class ProductCreate(BaseModel):
     name: str = Field(..., min_length=2, max_length=100, description="Product name", example="New Product")
     price: float = Field(..., gt=0, description="Product price", example=29.99)
@@ -129,6 +286,28 @@ class ProductUpdate(BaseModel):
     description: Optional[str] = Field(None, max_length=500, description="Product description")
     in_stock: Optional[bool] = Field(None, description="Stock availability")
 
+    @field_validator("name", "price", "in_stock")
+    @classmethod
+    def not_null(cls, value):
+        # Bỏ qua field thì giữ giá trị cũ; gửi null thì không hợp lệ (chỉ description được null)
+        if value is None:
+            raise ValueError("may be omitted but not null")
+        return value
+
+class ProductBatchUpdate(ProductUpdate):
+    id: int = Field(..., ge=1, description="Product ID to update", example=1)
+
+class BatchItemResult(BaseModel):
+    index: int = Field(..., description="Position of the item in the request", example=0)
+    status: int = Field(..., description="HTTP-style status of this item", example=201)
+    id: Optional[int] = Field(None, description="Product ID", example=4)
+    error: Optional[str] = Field(None, description="Why the item was rejected", example="price: Input should be greater than 0")
+
+class BatchResult(BaseModel):
+    succeeded: int = Field(..., description="Items applied", example=2)
+    failed: int = Field(..., description="Items rejected", example=1)
+    results: List[BatchItemResult] = Field(..., description="One entry per item, in request order")
+
 class HealthCheck(BaseModel):
     status: str = Field(..., description="Health status", example="healthy")
     timestamp: str = Field(..., description="Current timestamp", example="2025-12-03T17:20:41.553212")
@@ -142,8 +321,9 @@ class ErrorResponse(BaseModel):
     detail: str = Field(..., description="Error detail", example="Resource not found")
 
 class CircuitBreakerStatus(BaseModel):
-    circuit_breaker_state: str = Field(..., description="Circuit breaker state", example="STATE_CLOSED")
-    fail_count: int = Field(..., description="Number of failures", example=0)
+    circuit_breaker_state: str = Field(..., description="Circuit breaker state", example="closed")
+    fail_count: int = Field(..., description="Failed or slow calls in the sliding window", example=0)
+    window: dict = Field(..., description="Sliding window counters", example={"calls": 4, "failures": 1, "slow_calls": 0, "failure_rate": 0.25})
     result: dict = Field(..., description="Operation result")
 
 class RateLimitTest(BaseModel):
@@ -152,14 +332,104 @@ class RateLimitTest(BaseModel):
 
 # FAKE DATABASE
 
-# Simple in-memory database for demo
-products_db = [
+# Simple in-memory database for demo (indexed by id, stock and price)
+products_db = ProductStore([
     {"id": 1, "name": "Laptop", "price": 999.99, "description": "Gaming laptop", "in_stock": True},
     {"id": 2, "name": "Mouse", "price": 29.99, "description": "Wireless mouse", "in_stock": True},
     {"id": 3, "name": "Keyboard", "price": 79.99, "description": "Mechanical keyboard", "in_stock": False}
-]
+])
+
+# Prebuilt JSON body of GET /products, rebuilt only when products_db.version changes
+products_json_cache = {"version": None, "body": b""}
+
+def encode_json(data) -> bytes:
+    if JSON_ENCODER == "orjson":
+        return orjson.dumps(data)
+    # Same encoding as FastAPI's JSONResponse
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def get_products_json() -> bytes:
+    """Serialized product list, rebuilt once per catalog version"""
+    if products_json_cache["version"] != products_db.version:
+        # Rows were validated on write; copying the Product columns is enough
+        body = encode_json(project(products_db, None))
+        products_json_cache.update(version=products_db.version, body=body)
+    return products_json_cache["body"]
+
+PRODUCT_FIELDS = tuple(Product.model_fields)
+
+def parse_fields(fields: Optional[str]) -> Optional[tuple]:
+    """`fields=name,price` -> ("id", "name", "price"); id is always kept (it is the cursor)"""
+    if not fields:
+        return None
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted - set(PRODUCT_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}. Allowed: {', '.join(PRODUCT_FIELDS)}"
+        )
+    return tuple(f for f in PRODUCT_FIELDS if f in wanted or f == "id")
+
+def project(products, fields: Optional[tuple]) -> list:
+    """Only copy the requested columns; the store rows are already validated on write"""
+    if fields is None:
+        return [{f: p.get(f) for f in PRODUCT_FIELDS} for p in products]
+    return [{f: p.get(f) for f in fields} for p in products]
+
+def product_filter(in_stock: Optional[bool], min_price: Optional[float], max_price: Optional[float]):
+    """Predicate for ProductStore.page, or None when nothing is filtered"""
+    if in_stock is None and min_price is None and max_price is None:
+        return None
+    lo = float("-inf") if min_price is None else min_price
+    hi = float("inf") if max_price is None else max_price
+    return lambda p: (in_stock is None or p["in_stock"] == in_stock) and lo <= p["price"] <= hi
+
+# CONDITIONAL REQUESTS (ETag)
+# Validators come from version counters, so a 304 is decided before any
+# serialization or enrichment happens. A catalog ETag covers every view of
+# /products (filters, pages, fields): each URL's body only changes with the catalog.
+
+def catalog_etag() -> str:
+    return f'"{products_db.epoch}-{products_db.version}"'
+
+def product_etag(product_id: int) -> str:
+    return f'"{products_db.epoch}-{product_id}-{products_db.revision(product_id)}"'
+
+def etag_matches(header: Optional[str], etag: str, weak: bool = False) -> bool:
+    """If-None-Match uses weak comparison (W/ ignored), If-Match strong comparison"""
+    for candidate in (header or "").split(","):
+        candidate = candidate.strip()
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    if etag_matches(request.headers.get("if-none-match"), etag, weak=True):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return None
+
+def check_if_match(request: Request, etag: str):
+    """Optimistic concurrency: reject the write if the client's copy is stale"""
+    if_match = request.headers.get("if-match")
+    if if_match is not None and not etag_matches(if_match, etag):
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Product was modified (ETag mismatch)")
 
 # FASTAPI APP SETUP
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_lag_monitor.start()
+    if ENRICHMENT_REFRESH_ENABLED:
+        enrichment_refresher.start()
+    yield
+    # Drain background refreshes before their HTTP client goes away
+    await enrichment_refresher.stop()
+    await close_http_client()
+    await loop_lag_monitor.stop()
+
 app = FastAPI(
     title="Production API Demo",
     description="""
@@ -203,7 +473,10 @@ app = FastAPI(
         },
     ],
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
+    # orjson serializes the (already jsonable_encoder'ed) content several times faster
+    default_response_class=ORJSONResponse if JSON_ENCODER == "orjson" else JSONResponse
 )
 
 app.state.limiter = limiter
@@ -222,33 +495,166 @@ app_start_time = time.time()
 
 # MIDDLEWARE FOR METRICS & LOGGING
 
-@app.middleware("http")
-async def metrics_middleware(request: Request, call_next):
-    """Middleware để collect metrics và logging"""
-    start_time = time.time()
-    method = request.method
-    path = request.url.path
+UNMATCHED_ROUTE = "<unmatched>"
 
-    logger.info(f"Request: {method} {path} from {get_remote_address(request)}")
-    
-    response = await call_next(request)
-    
-    duration = time.time() - start_time
-    status_code = response.status_code
-    
-    request_count.labels(method=method, endpoint=path, status=status_code).inc()
-    request_duration.labels(method=method, endpoint=path).observe(duration)
-    
-    logger.info(f"Response: {method} {path} -> {status_code} ({duration:.3f}s)")
-    
-    return response
+def route_template(scope) -> str:
+    """Path template of the route serving this request; unknown paths share one bucket"""
+    partial = None
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path  # path matches, method does not (405)
+    return partial or UNMATCHED_ROUTE
+
+class MetricsMiddleware:
+    """
+    Middleware để collect metrics và logging, written as plain ASGI.
+
+    Unlike @app.middleware("http") (BaseHTTPMiddleware) it spawns no task and
+    never wraps or buffers the response body: it only peeks at the
+    ``http.response.start`` / ``http.response.body`` messages on their way out,
+    so streaming responses keep streaming.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        method = scope["method"]
+        path = scope["path"]
+        endpoint = route_template(scope)
+        status_code = 500  # if the app dies before sending a response
+        body_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, body_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                body_size += len(message.get("body", b""))
+            await send(message)
+
+        in_progress = requests_in_progress.labels(method=method, endpoint=endpoint)
+        in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            duration = time.perf_counter() - start_time
+            request_count.labels(method=method, endpoint=endpoint, status=status_code).inc()
+            request_duration.labels(method=method, endpoint=endpoint).observe(duration)
+            response_size.labels(method=method, endpoint=endpoint).observe(body_size)
+
+            # One structured access line per request (sampled via LOG_ACCESS_SAMPLE_RATE)
+            client = scope.get("client")
+            access_logger.info(
+                f"{method} {path} -> {status_code}",
+                extra={
+                    "method": method,
+                    "path": path,
+                    "endpoint": endpoint,
+                    "status": status_code,
+                    "duration_ms": round(duration * 1000, 3),
+                    "client": client[0] if client else "127.0.0.1"
+                }
+            )
+
+# HEALTH PROBES
+
+loop_lag_monitor = LoopLagMonitor(registry=registry)
+
+def readiness() -> tuple:
+    """
+    Ready unless this worker is overloaded: a lagging event loop, a full
+    bulkhead queue or a log writer falling behind. An open breaker is only
+    reported: products are still served, just without enrichment.
+    """
+    log_backlog = log_listener.queue.qsize() if log_listener is not None else 0
+    bulkhead_full = external_api_bulkhead.queue_depth >= external_api_bulkhead.max_queue > 0
+    details = {
+        "circuit_breaker": external_api_breaker.current_state,
+        "event_loop_lag_ms": round(loop_lag_monitor.lag * 1000, 1),
+        "backlog": {
+            "external_api_in_flight": external_api_bulkhead.in_flight,
+            "external_api_queued": external_api_bulkhead.queue_depth,
+            "enrichment_loads": enrichment_cache.inflight,
+            "log_records": log_backlog,
+        },
+    }
+    ready = loop_lag_monitor.lag < READINESS_MAX_LOOP_LAG and not bulkhead_full and log_backlog < READINESS_MAX_LOG_BACKLOG
+    return ready, details
+
+# Compression runs inside MetricsMiddleware, so api_response_size_bytes counts bytes on the wire
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+app.add_middleware(MetricsMiddleware)
+# Outermost: probes are answered before metrics, access logging, compression and rate limiting
+app.add_middleware(HealthProbeMiddleware, check=readiness, cache_seconds=READINESS_CACHE_SECONDS)
 
 
 # EXTERNAL API CLIENT (với Circuit Breaker)
 
-async def get_external_data(product_id: int):
-    """Simulate external API call với circuit breaker protection"""
-    return external_api_call(product_id)
+async def get_external_data(product_id: int, timeout: Optional[float] = None):
+    """
+    External API call với circuit breaker protection. Without an explicit
+    timeout it gets whatever is left of the current request's deadline
+    (capped at EXTERNAL_API_TIMEOUT), and is hedged when HEDGE_ENABLED.
+    """
+    client_deadline = False
+    if timeout is None:
+        deadline = current_deadline.get()
+        timeout = EXTERNAL_API_TIMEOUT if deadline is None else min(deadline.remaining(), EXTERNAL_API_TIMEOUT)
+        client_deadline = deadline is not None and deadline.client_supplied and timeout < EXTERNAL_API_TIMEOUT
+    if timeout <= 0:
+        raise DeadlineExceeded(f"No time left to enrich product {product_id}")
+    if not HEDGE_ENABLED:
+        return await external_api_call(product_id, timeout=timeout, client_deadline=client_deadline)
+    return await external_api_hedger.call(
+        lambda left: external_api_call(product_id, timeout=left, client_deadline=client_deadline), timeout
+    )
+
+def request_deadline(request: Request) -> Deadline:
+    """Route budget, shortened by the client's DEADLINE_HEADER (remaining milliseconds)"""
+    route = request.scope.get("route")
+    budget = ROUTE_BUDGETS.get(route.path if route else None, EXTERNAL_API_TIMEOUT)
+    header = request.headers.get(DEADLINE_HEADER)
+    if header:
+        try:
+            client_budget = max(float(header) / 1000, 0.0)
+        except ValueError:
+            client_budget = budget  # malformed header: keep the route budget
+        if client_budget < budget:
+            return Deadline(client_budget, client_supplied=True)
+    return Deadline(budget)
+
+# Cache in front of get_external_data (LRU + TTL, failures cached briefly)
+enrichment_cache = EnrichmentCache(
+    get_external_data,
+    max_size=ENRICHMENT_CACHE_SIZE,
+    ttl=ENRICHMENT_CACHE_TTL,
+    negative_ttl=ENRICHMENT_CACHE_NEGATIVE_TTL,
+    registry=registry,
+    uncached=[BulkheadFullError, DeadlineExceeded],
+    stale_ttl=ENRICHMENT_CACHE_STALE_TTL
+)
+
+# Prefetches the hottest product ids so reads find them in the cache
+enrichment_refresher = EnrichmentRefresher(
+    enrichment_cache,
+    interval=ENRICHMENT_REFRESH_INTERVAL,
+    top_k=ENRICHMENT_REFRESH_TOP_K,
+    concurrency=ENRICHMENT_REFRESH_CONCURRENCY,
+    drain_seconds=ENRICHMENT_REFRESH_DRAIN_SECONDS,
+    keep=lambda product_id: products_db.get(product_id) is not None,
+    registry=registry
+)
 
 # API ENDPOINTS
 
@@ -266,6 +672,8 @@ async def root():
         "version": "1.0.0", 
         "docs-swagger": "/docs",
         "health": "/health",
+        "liveness": "/health/live",
+        "readiness": "/health/ready",
         "metrics": "/metrics",
         "features": [
             "Rate Limiting",
@@ -308,13 +716,13 @@ async def health_check():
         uptime=uptime
     )
     
-    logger.info("Health check performed")
+    logger.debug("Health check performed")
     return health_data
 
 @app.get(
     "/metrics",
     summary="Prometheus metrics",
-    description="Prometheus metrics endpoint for monitoring and observability",
+    description="Prometheus metrics endpoint for monitoring and observability. Output is cached briefly and gzip-encoded when the scraper accepts it.",
     tags=["monitoring"],
     responses={
         200: {
@@ -327,25 +735,30 @@ async def health_check():
         }
     }
 )
-async def get_metrics():
+async def get_metrics(request: Request):
     """Prometheus metrics endpoint"""
-    logger.info("Metrics requested")
-    return PlainTextResponse(
-        content=generate_latest(registry),
-        media_type=CONTENT_TYPE_LATEST
+    gzipped = accepts_gzip(request.headers.get("accept-encoding"))
+    headers = {"Content-Encoding": "gzip", "Vary": "Accept-Encoding"} if gzipped else {"Vary": "Accept-Encoding"}
+    return Response(
+        content=await metrics_exposition.render(gzipped=gzipped),
+        media_type=CONTENT_TYPE_LATEST,
+        headers=headers
     )
 
 @app.get(
     "/products",
     response_model=List[Product],
     summary="Get all products",
-    description="Get all products from the database. Rate limited to 50 requests per minute.",
+    description="Get all products from the database, optionally filtered by stock or price range, paginated (limit/after) or projected (fields). Sends a catalog ETag and answers If-None-Match with 304. Rate limited to 50 requests per minute.",
     tags=["products"],
     responses={
         200: {
             "description": "List of all products",
             "model": List[Product]
         },
+        304: {
+            "description": "Not modified (If-None-Match matched the catalog ETag)"
+        },
         429: {
             "description": "Rate limit exceeded",
             "model": ErrorResponse
@@ -353,21 +766,112 @@ async def get_metrics():
     }
 )
 @limiter.limit("50/minute") 
-async def get_products(request: Request):
-    """Get all products (với rate limiting)"""
+async def get_products(
+    request: Request,
+    in_stock: Optional[bool] = Query(None, description="Only products with this stock status"),
+    min_price: Optional[float] = Query(None, ge=0, description="Minimum price (inclusive)"),
+    max_price: Optional[float] = Query(None, ge=0, description="Maximum price (inclusive)"),
+    limit: Optional[int] = Query(None, ge=1, le=PRODUCTS_PAGE_MAX, description="Page size; enables keyset pagination (ordered by id)"),
+    after: Optional[int] = Query(None, ge=0, description="Cursor: return products with id > after (from the X-Next-Cursor header)"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. name,price (id is always included)", example="name,price")
+):
+    """Get all products (với rate limiting), or one page of them when limit/after is given"""
     logger.info("Getting all products")
-    return products_db
+    projection = parse_fields(fields)
+    etag = catalog_etag()
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    headers = {"ETag": etag}
+
+    if limit is not None or after is not None:
+        # Keyset pagination: seek to `after` in the id index, no offset scan
+        limit = limit or PRODUCTS_PAGE_SIZE
+        rows = products_db.page(after, limit + 1, product_filter(in_stock, min_price, max_price))
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1]["id"]
+            headers["X-Next-Cursor"] = str(next_cursor)
+            headers["Link"] = f'<{request.url.include_query_params(after=next_cursor, limit=limit)}>; rel="next"'
+        return Response(content=encode_json(project(rows, projection)), media_type="application/json", headers=headers)
+
+    if min_price is not None or max_price is not None:
+        products = products_db.by_price(min_price, max_price)
+        if in_stock is not None:
+            products = [p for p in products if p["in_stock"] == in_stock]
+    elif in_stock is not None:
+        products = products_db.by_stock(in_stock)
+    elif projection is None:
+        return Response(content=get_products_json(), media_type="application/json", headers=headers)
+    else:
+        products = products_db
+    return Response(content=encode_json(project(products, projection)), media_type="application/json", headers=headers)
+
+@app.get(
+    "/products/stream",
+    summary="Stream all products (NDJSON)",
+    description="All products as newline-delimited JSON (one object per line), streamed in chunks so memory stays flat for bulk consumers. Accepts the same filters, `after` and `fields` as GET /products. Rate limited to 10 requests per minute.",
+    tags=["products"],
+    responses={
+        200: {
+            "description": "One JSON product per line",
+            "content": {
+                "application/x-ndjson": {
+                    "example": '{"id":1,"name":"Laptop","price":999.99}\n{"id":2,"name":"Mouse","price":29.99}\n'
+                }
+            }
+        },
+        429: {
+            "description": "Rate limit exceeded",
+            "model": ErrorResponse
+        }
+    }
+)
+@limiter.limit("10/minute")
+async def stream_products(
+    request: Request,
+    in_stock: Optional[bool] = Query(None, description="Only products with this stock status"),
+    min_price: Optional[float] = Query(None, ge=0, description="Minimum price (inclusive)"),
+    max_price: Optional[float] = Query(None, ge=0, description="Maximum price (inclusive)"),
+    after: Optional[int] = Query(None, ge=0, description="Start after this product id (resume an interrupted export)"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return (id is always included)")
+):
+    """Stream products as NDJSON (với rate limiting)"""
+    logger.info("Streaming products")
+    projection = parse_fields(fields)
+    etag = catalog_etag()
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    where = product_filter(in_stock, min_price, max_price)
+
+    async def lines():
+        # Walk the id index one page at a time: concurrent writes never break
+        # the iteration, and the event loop gets control back between chunks
+        cursor = after
+        while True:
+            rows = products_db.page(cursor, PRODUCTS_PAGE_MAX, where)
+            if not rows:
+                return
+            cursor = rows[-1]["id"]
+            yield b"".join(encode_json(row) + b"\n" for row in project(rows, projection))
+            await asyncio.sleep(0)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"ETag": etag})
 
 @app.get(
     "/products/{product_id}",
-    response_model=Product,
+    response_model=ProductDetail,
     summary="Get product by ID",
-    description="Get a specific product by ID.  Rate limited to 100 requests per minute.",
+    description="Get a specific product by ID. Sends an ETag and answers If-None-Match with 304 (no enrichment call). Rate limited to 100 requests per minute.",
     tags=["products"],
     responses={
         200: {
             "description": "Product found",
-            "model": Product
+            "model": ProductDetail
+        },
+        304: {
+            "description": "Not modified (If-None-Match matched the ETag)"
         },
         404: {
             "description": "Product not found",
@@ -387,34 +891,61 @@ async def get_products(request: Request):
 @limiter.limit("100/minute")  
 async def get_product(
     product_id: int = Path(..., description="Product ID to retrieve", example=1, ge=1),
-    request: Request = None
+    request: Request = None,
+    response: Response = None
 ):
     """
     Get product by ID (với external API integration và circuit breaker)
     """
     logger.info(f"Getting product {product_id}")
     
-    product = next((p for p in products_db if p["id"] == product_id), None)
+    product = products_db.get(product_id)
     
     if not product:
         logger.warning(f"Product {product_id} not found")
         raise HTTPException(status_code=404, detail="Product not found")
+
+    # The ETag follows the stored row and is only sent with successfully enriched
+    # bodies, so a client never revalidates (and keeps) an enrichment error fallback
+    etag = product_etag(product_id)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
     
+    enrichment_refresher.record(product_id)
+
+    # Enrichment goes into a per-response view; the stored row is never mutated.
+    # It may only use what is left of the request's budget: a shared (coalesced)
+    # load keeps running for other callers, this one just stops waiting
+    deadline = request_deadline(request)
+    token = current_deadline.set(deadline)
     try:
-        external_data = await get_external_data(product_id)
-        product["external_info"] = {
+        if deadline.expired:
+            raise asyncio.TimeoutError()
+        external_data = await asyncio.wait_for(enrichment_cache.get(product_id), deadline.remaining())
+        external_info = {
             "title": external_data.get("title", "N/A"),
             "rating": 4.5 
         }
         logger.info(f"Product {product_id} enriched with external data")
     except pybreaker.CircuitBreakerError:
         logger.warning(f"Circuit breaker open for product {product_id}")
-        product["external_info"] = {"error": "External service temporarily unavailable"}
+        external_info = {"error": "External service temporarily unavailable"}
+    except BulkheadFullError:
+        logger.warning(f"Too many upstream calls in flight, skipping enrichment for product {product_id}")
+        external_info = {"error": "External service busy"}
+    except asyncio.TimeoutError:
+        logger.warning(f"Deadline ({deadline.budget:g}s) reached while enriching product {product_id}")
+        external_info = {"error": "External service timeout"}
     except Exception as e:
         logger.warning(f"Could not enrich product {product_id}: {str(e)}")
-        product["external_info"] = {"error": "External service error"}
-    
-    return product
+        external_info = {"error": "External service error"}
+    finally:
+        current_deadline.reset(token)
+
+    if "error" not in external_info:
+        response.headers["ETag"] = etag
+    return ProductDetail(**product, external_info=external_info)
 
 @app.post(
     "/products",
@@ -451,23 +982,16 @@ async def create_product(product: ProductCreate, request: Request):
     if product.price <= 0:
         raise HTTPException(status_code=400, detail="Price must be positive")
     
-    new_id = max([p["id"] for p in products_db]) + 1
-    
-    new_product = {
-        "id": new_id,
-        **product.dict()
-    }
+    new_product = products_db.create(product.model_dump())
     
-    products_db.append(new_product)
-    
-    logger.info(f"Product created with ID {new_id}")
+    logger.info(f"Product created with ID {new_product['id']}")
     return new_product
 
 @app.put(
     "/products/{product_id}",
     response_model=Product,
     summary="Update product",
-    description="Update an existing product by ID. Rate limited to 20 requests per minute.",
+    description="Update an existing product by ID. Send If-Match with the ETag you read to avoid lost updates (412 on mismatch). Rate limited to 20 requests per minute.",
     tags=["products"],
     responses={
         200: {
@@ -478,6 +1002,10 @@ async def create_product(product: ProductCreate, request: Request):
             "description": "Product not found",
             "model": ErrorResponse
         },
+        412: {
+            "description": "If-Match does not match the current ETag",
+            "model": ErrorResponse
+        },
         429: {
             "description": "Rate limit exceeded",
             "model": ErrorResponse
@@ -488,19 +1016,20 @@ async def create_product(product: ProductCreate, request: Request):
 async def update_product(
     product_id: int = Path(..., description="Product ID to update", example=1, ge=1),
     product_update: ProductUpdate = None,
-    request: Request = None
+    request: Request = None,
+    response: Response = None
 ):
-    """Update product (với moderate rate limiting)"""
+    """Update product (với moderate rate limiting); honours If-Match"""
     logger.info(f"Updating product {product_id}")
     
-    # Find product
-    for i, product in enumerate(products_db):
-        if product["id"] == product_id:
-            update_data = product_update.dict(exclude_unset=True)
-            products_db[i].update(update_data)
-            
-            logger.info(f"Product {product_id} updated")
-            return products_db[i]
+    if product_id in products_db:
+        check_if_match(request, product_etag(product_id))
+    update_data = product_update.model_dump(exclude_unset=True)
+    product = products_db.update(product_id, update_data)
+    if product is not None:
+        logger.info(f"Product {product_id} updated")
+        response.headers["ETag"] = product_etag(product_id)
+        return product
     
     logger.warning(f"Product {product_id} not found for update")
     raise HTTPException(status_code=404, detail="Product not found")
@@ -509,7 +1038,7 @@ async def update_product(
     "/products/{product_id}",
     response_model=APIResponse,
     summary="Delete product",
-    description="Delete a product by ID. Very strict rate limiting applies (5 requests per minute).",
+    description="Delete a product by ID, optionally guarded by If-Match (412 on mismatch). Very strict rate limiting applies (5 requests per minute).",
     tags=["products"],
     responses={
         200: {
@@ -528,6 +1057,10 @@ async def update_product(
             "description": "Product not found",
             "model": ErrorResponse
         },
+        412: {
+            "description": "If-Match does not match the current ETag",
+            "model": ErrorResponse
+        },
         429: {
             "description": "Rate limit exceeded",
             "model": ErrorResponse
@@ -539,22 +1072,179 @@ async def delete_product(
     product_id: int = Path(..., description="Product ID to delete", example=1, ge=1),
     request: Request = None
 ):
-    """Delete product (với very strict rate limiting)"""
+    """Delete product (với very strict rate limiting); honours If-Match"""
     logger.info(f"Deleting product {product_id}")
     
-    # Find and remove product
-    for i, product in enumerate(products_db):
-        if product["id"] == product_id:
-            deleted_product = products_db.pop(i)
-            logger.info(f"Product {product_id} deleted: {deleted_product['name']}")
-            return APIResponse(
-                message=f"Product '{deleted_product['name']}' deleted successfully",
-                data={"deleted_product_id": product_id}
-            )
+    if product_id in products_db:
+        check_if_match(request, product_etag(product_id))
+    deleted_product = products_db.delete(product_id)
+    if deleted_product is not None:
+        enrichment_cache.invalidate(product_id)
+        logger.info(f"Product {product_id} deleted: {deleted_product['name']}")
+        return APIResponse(
+            message=f"Product '{deleted_product['name']}' deleted successfully",
+            data={"deleted_product_id": product_id}
+        )
     
     logger.warning(f"Product {product_id} not found for deletion")
     raise HTTPException(status_code=404, detail="Product not found")
 
+# BATCH ENDPOINTS
+# Whole list validated in one pass, valid rows applied to the store in one write
+# (no await in between, so no other request sees a half-applied batch); bad rows
+# are reported per item instead of failing the batch.
+
+batch_item_limit = parse_limit(f"{BATCH_ITEMS_PER_MINUTE}/minute")
+
+def charge_batch(request: Request, scope: str, weight: int):
+    """Count a batch against the per-minute item budget: 500 items cost 500, not 1"""
+    if not limiter.enabled or weight == 0:
+        return
+    if not limiter.limiter.hit(batch_item_limit, get_remote_address(request), scope, cost=weight):
+        logger.warning(f"Batch item budget exceeded for {get_remote_address(request)} ({scope}, {weight} items)")
+        raise HTTPException(status_code=429, detail=f"Rate limit exceeded: {batch_item_limit} items")
+
+def check_batch_size(items: list):
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch too large: {len(items)} items (max {BATCH_MAX_ITEMS})"
+        )
+
+def validate_batch(adapter: TypeAdapter, items: list):
+    """
+    Validate the whole list in one pass. Returns (models by index, errors by
+    index); only when some rows are invalid are the rest validated again.
+    """
+    try:
+        return dict(enumerate(adapter.validate_python(items))), {}
+    except ValidationError as exc:
+        errors = {}
+        for error in exc.errors():
+            index, field = error["loc"][0], ".".join(str(part) for part in error["loc"][1:])
+            errors.setdefault(index, []).append(f"{field}: {error['msg']}" if field else error["msg"])
+    valid = [i for i in range(len(items)) if i not in errors]
+    models = adapter.validate_python([items[i] for i in valid])
+    return dict(zip(valid, models)), {i: "; ".join(msgs) for i, msgs in errors.items()}
+
+def batch_result(results: List[BatchItemResult]) -> BatchResult:
+    succeeded = sum(1 for r in results if r.error is None)
+    return BatchResult(succeeded=succeeded, failed=len(results) - succeeded, results=results)
+
+product_create_list = TypeAdapter(List[ProductCreate])
+product_update_list = TypeAdapter(List[ProductBatchUpdate])
+product_id_list = TypeAdapter(List[int])
+
+@app.post(
+    "/products:batch",
+    response_model=BatchResult,
+    summary="Create products in bulk",
+    description=f"Create up to {BATCH_MAX_ITEMS} products in one request. Invalid rows are reported per item, the valid ones are created. Rate limited to 10 requests and {BATCH_ITEMS_PER_MINUTE} items per minute.",
+    tags=["products"],
+    responses={
+        413: {"description": "Too many items", "model": ErrorResponse},
+        429: {"description": "Rate limit exceeded", "model": ErrorResponse}
+    }
+)
+@limiter.limit("10/minute")
+async def create_products_batch(
+    request: Request,
+    items: List[Any] = Body(..., description="Products to create (ProductCreate objects)")
+):
+    """Bulk create (rate limit theo số item)"""
+    check_batch_size(items)
+    charge_batch(request, "products_batch:create", len(items))
+    models, errors = validate_batch(product_create_list, items)
+
+    created = iter(products_db.create_many(models[i].model_dump() for i in sorted(models)))
+    results = [
+        BatchItemResult(index=i, status=422, error=errors[i]) if i in errors
+        else BatchItemResult(index=i, status=201, id=next(created)["id"])
+        for i in range(len(items))
+    ]
+    logger.info(f"Batch create: {len(models)} created, {len(errors)} rejected")
+    return batch_result(results)
+
+@app.patch(
+    "/products:batch",
+    response_model=BatchResult,
+    summary="Update products in bulk",
+    description=f"Partially update up to {BATCH_MAX_ITEMS} products; each item carries its `id` plus the fields to change. Rate limited to 20 requests and {BATCH_ITEMS_PER_MINUTE} items per minute.",
+    tags=["products"],
+    responses={
+        413: {"description": "Too many items", "model": ErrorResponse},
+        429: {"description": "Rate limit exceeded", "model": ErrorResponse}
+    }
+)
+@limiter.limit("20/minute")
+async def update_products_batch(
+    request: Request,
+    items: List[Any] = Body(..., description="Updates (ProductUpdate fields plus id)")
+):
+    """Bulk update (rate limit theo số item)"""
+    check_batch_size(items)
+    charge_batch(request, "products_batch:update", len(items))
+    models, errors = validate_batch(product_update_list, items)
+
+    valid = sorted(models)
+    updated = products_db.update_many(
+        (models[i].id, models[i].model_dump(exclude_unset=True, exclude={"id"})) for i in valid
+    )
+    outcome = dict(zip(valid, updated))
+    results = []
+    for i in range(len(items)):
+        if i in errors:
+            results.append(BatchItemResult(index=i, status=422, error=errors[i]))
+        elif outcome[i] is None:
+            results.append(BatchItemResult(index=i, status=404, id=models[i].id, error="Product not found"))
+        else:
+            results.append(BatchItemResult(index=i, status=200, id=models[i].id))
+    logger.info(f"Batch update: {sum(1 for r in results if r.status == 200)} updated, {sum(1 for r in results if r.status != 200)} rejected")
+    return batch_result(results)
+
+@app.delete(
+    "/products:batch",
+    response_model=BatchResult,
+    summary="Delete products in bulk",
+    description=f"Delete up to {BATCH_MAX_ITEMS} products by id. Unknown ids are reported as 404 items, non-integer ids as 422 items. Rate limited to 5 requests and {BATCH_ITEMS_PER_MINUTE} items per minute.",
+    tags=["products"],
+    responses={
+        413: {"description": "Too many items", "model": ErrorResponse},
+        429: {"description": "Rate limit exceeded", "model": ErrorResponse}
+    }
+)
+@limiter.limit("5/minute")
+async def delete_products_batch(
+    request: Request,
+    ids: List[Any] = Body(..., description="Product IDs to delete", example=[1, 2])
+):
+    """Bulk delete (rate limit theo số item)"""
+    check_batch_size(ids)
+    charge_batch(request, "products_batch:delete", len(ids))
+    valid_ids, errors = validate_batch(product_id_list, ids)
+
+    outcome = dict(zip(sorted(valid_ids), products_db.delete_many(valid_ids[i] for i in sorted(valid_ids))))
+    results = []
+    for i in range(len(ids)):
+        if i in errors:
+            results.append(BatchItemResult(index=i, status=422, error=errors[i]))
+        elif outcome[i] is None:
+            results.append(BatchItemResult(index=i, status=404, id=valid_ids[i], error="Product not found"))
+        else:
+            enrichment_cache.invalidate(valid_ids[i])
+            results.append(BatchItemResult(index=i, status=200, id=valid_ids[i]))
+    deleted = sum(1 for r in results if r.status == 200)
+    logger.info(f"Batch delete: {deleted} deleted, {len(results) - deleted} rejected")
+    return batch_result(results)
+
+def breaker_status() -> dict:
+    window = external_api_breaker.snapshot()
+    return {
+        "circuit_breaker_state": window.pop("state"),
+        "fail_count": window["failures"],
+        "window": window
+    }
+
 @app.get(
     "/test/circuit-breaker",
     response_model=CircuitBreakerStatus,
@@ -573,30 +1263,27 @@ async def test_circuit_breaker(request: Request):
     logger.info("Testing circuit breaker")
     
     # Print current state before test
-    logger.info(f"Circuit breaker state before: {external_api_breaker.state.__class__.__name__}, fail count: {external_api_breaker.fail_counter}")
+    logger.info(f"Circuit breaker state before: {external_api_breaker.current_state}, window: {external_api_breaker.snapshot()}")
     
     try:
         result = await get_external_data(999)
         
         return CircuitBreakerStatus(
-            circuit_breaker_state=external_api_breaker.state.__class__.__name__,
-            fail_count=external_api_breaker.fail_counter,
+            **breaker_status(),
             result=result
         )
     except pybreaker.CircuitBreakerError:
         logger.warning("Circuit breaker is open during test")
         return CircuitBreakerStatus(
-            circuit_breaker_state=external_api_breaker.state.__class__.__name__,
-            fail_count=external_api_breaker.fail_counter,
+            **breaker_status(),
             result={"error": "Circuit breaker is open"}
         )
     except Exception as e:
         logger.error(f"Circuit breaker test failed: {str(e)}")
         # Log state after failure
-        logger.info(f"Circuit breaker state after failure: {external_api_breaker.state.__class__.__name__}, fail count: {external_api_breaker.fail_counter}")
+        logger.info(f"Circuit breaker state after failure: {external_api_breaker.current_state}, window: {external_api_breaker.snapshot()}")
         return CircuitBreakerStatus(
-            circuit_breaker_state=external_api_breaker.state.__class__.__name__,
-            fail_count=external_api_breaker.fail_counter,
+            **breaker_status(),
             result={"error": str(e)}
         )
 
@@ -604,7 +1291,7 @@ async def test_circuit_breaker(request: Request):
     "/test/circuit-breaker/reset",
     response_model=CircuitBreakerStatus,
     summary="Reset circuit breaker",
-    description="Manually reset the circuit breaker to initial state (count = 0, state = CLOSED)",
+    description="Manually reset the circuit breaker to its initial state (empty window, state = closed)",
     tags=["testing"],
     responses={
         200: {
@@ -617,15 +1304,13 @@ async def reset_circuit_breaker(request: Request):
     """Reset circuit breaker về trạng thái ban đầu"""
     logger.info("Resetting circuit breaker manually")
     
-    # Reset circuit breaker
-    external_api_breaker.close()  # Force close circuit
-    external_api_breaker.fail_counter = 0  # Reset fail counter
+    # Closed, empty window, open-duration backoff forgotten
+    external_api_breaker.reset()
     
-    logger.info(f"Circuit breaker reset - State: {external_api_breaker.state.__class__.__name__}, Fail count: {external_api_breaker.fail_counter}")
+    logger.info(f"Circuit breaker reset - State: {external_api_breaker.current_state}, window: {external_api_breaker.snapshot()}")
     
     return CircuitBreakerStatus(
-        circuit_breaker_state=external_api_breaker.state.__class__.__name__,
-        fail_count=external_api_breaker.fail_counter,
+        **breaker_status(),
         result={"message": "Circuit breaker reset successfully"}
     )
 
@@ -657,6 +1342,8 @@ async def test_rate_limit(request: Request):
 
 # MAIN ENTRY POINT
 
+# Single process, for development. Production: python serve.py (multi-worker)
+
 if __name__ == "__main__":
     logger.info("Starting Production API Demo")
     
@@ -665,6 +1352,6 @@ if __name__ == "__main__":
         "app:app",
         host="0.0.0.0",
         port=8000,
-        reload=DEBUG,
+        reload=RELOAD,
         log_level=LOG_LEVEL.lower()
     )
\ No newline at end of file
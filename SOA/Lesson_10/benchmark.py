@@ -0,0 +1,413 @@
+"""
+Offline micro-benchmarks for Lesson_10.
+
+    python benchmark.py store            # CRUD latency, ProductStore vs list
+    python benchmark.py store --sizes 10000 100000
+    python benchmark.py logging          # p99 at 2k RPS, sync vs queued logging
+    python benchmark.py middleware       # per-request overhead of the metrics middleware
+    python benchmark.py workers          # /products throughput, serve.py with 1 vs N workers
+    python benchmark.py pagination       # GET /products at 1M rows: full vs page vs NDJSON stream
+    python benchmark.py compression      # JSON encoder CPU time and gzip/brotli bytes at 10k products
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+
+from product_store import ProductStore
+
+
+def make_products(n: int):
+    return [
+        {"id": i, "name": f"Product {i}", "price": round(random.uniform(1, 2000), 2),
+         "description": f"Description {i}", "in_stock": i % 3 != 0}
+        for i in range(1, n + 1)
+    ]
+
+
+def timed(fn, ops: int) -> float:
+    """Average microseconds per call of fn(i) over ops calls"""
+    start = time.perf_counter()
+    for i in range(ops):
+        fn(i)
+    return (time.perf_counter() - start) / ops * 1e6
+
+
+# STORE: CRUD latency vs the old linear products_db list
+
+class ListStore:
+    """The pre-index implementation, copied from the old app.py handlers"""
+
+    def __init__(self, products):
+        self.rows = [dict(p) for p in products]
+
+    def get(self, product_id):
+        return next((p for p in self.rows if p["id"] == product_id), None)
+
+    def create(self, data):
+        product = {"id": max([p["id"] for p in self.rows]) + 1, **data}
+        self.rows.append(product)
+        return product
+
+    def update(self, product_id, changes):
+        for i, product in enumerate(self.rows):
+            if product["id"] == product_id:
+                self.rows[i].update(changes)
+                return self.rows[i]
+
+    def delete(self, product_id):
+        for i, product in enumerate(self.rows):
+            if product["id"] == product_id:
+                return self.rows.pop(i)
+
+
+def bench_store(sizes):
+    print(f"{'rows':>9} {'store':>12} {'get us':>11} {'create us':>11} {'update us':>11} {'delete us':>11}")
+    for n in sizes:
+        products = make_products(n)
+        for name, store in (("list", ListStore(products)), ("ProductStore", ProductStore(products))):
+            # The list scans the whole table per call, so fewer ops keep the run short
+            ops = 20 if name == "list" else 2000
+            ids = [random.randint(1, n) for _ in range(ops)]
+            new = {"name": "New", "price": 10.0, "description": None, "in_stock": True}
+            get_us = timed(lambda i: store.get(ids[i]), ops)
+            create_us = timed(lambda i: store.create(new), ops)
+            update_us = timed(lambda i: store.update(ids[i], {"price": 42.0}), ops)
+            delete_us = timed(lambda i: store.delete(ids[i]), ops)
+            print(f"{n:>9} {name:>12} {get_us:>11.2f} {create_us:>11.2f} {update_us:>11.2f} {delete_us:>11.2f}")
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def open_loop(client: httpx.AsyncClient, path: str, rps: int, seconds: float):
+    """
+    Fire requests on a fixed schedule (open loop) and return latencies in ms,
+    measured from the scheduled send time so queueing delay is included.
+    """
+    latencies = []
+    total = int(rps * seconds)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def one(scheduled: float):
+        await client.get(path)
+        latencies.append((loop.time() - scheduled) * 1000)
+
+    tasks = []
+    for i in range(total):
+        scheduled = start + i / rps
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one(scheduled)))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+# LOGGING: request latency with log I/O on the event loop vs the queued pipeline
+
+def bench_logging(rps: int, seconds: float):
+    import app as app_module
+    from logging_setup import setup_logging
+
+    print(f"{rps} RPS for {seconds}s against GET / (in-process)")
+    print(f"{'mode':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for mode in ("sync", "queue"):
+        with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+            # Console handler writes to /dev/null so the terminal is not the bottleneck
+            with contextlib.redirect_stderr(devnull):
+                listener = setup_logging(mode=mode, fmt="json", log_file=os.path.join(tmp, "bench.log"))
+
+            async def run():
+                transport = httpx.ASGITransport(app=app_module.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                    await open_loop(client, "/", rps // 10, 1.0)  # warm up
+                    return await open_loop(client, "/", rps, seconds)
+
+            latencies = asyncio.run(run())
+            if listener is not None:
+                listener.stop()
+        print(f"{mode:>6} {statistics.median(latencies):>9.2f} {percentile(latencies, 99):>9.2f} {max(latencies):>9.2f}")
+
+
+# MIDDLEWARE: per-request overhead, BaseHTTPMiddleware vs pure ASGI
+
+def legacy_metrics_middleware(app_module):
+    """The @app.middleware("http") version from before MetricsMiddleware"""
+    async def metrics_middleware(request, call_next):
+        start_time = time.perf_counter()
+        method = request.method
+        path = request.url.path
+        endpoint = app_module.route_template(request.scope)
+        in_progress = app_module.requests_in_progress.labels(method=method, endpoint=endpoint)
+        in_progress.inc()
+        try:
+            response = await call_next(request)
+        finally:
+            in_progress.dec()
+        duration = time.perf_counter() - start_time
+        status_code = response.status_code
+        app_module.request_count.labels(method=method, endpoint=endpoint, status=status_code).inc()
+        app_module.request_duration.labels(method=method, endpoint=endpoint).observe(duration)
+        content_length = response.headers.get("content-length")
+        if content_length is not None:
+            app_module.response_size.labels(method=method, endpoint=endpoint).observe(int(content_length))
+        app_module.access_logger.info(f"{method} {path} -> {status_code}")
+        return response
+    return metrics_middleware
+
+
+async def drive_asgi(asgi_app, path: str, n: int) -> float:
+    """Call the ASGI app directly n times; returns microseconds per request"""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1234),
+             "server": ("bench", 80)}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(n):
+        requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await asyncio.sleep(3600)  # client stays connected
+
+        await asgi_app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def bench_middleware(n: int):
+    from fastapi import FastAPI
+    from starlette.middleware.base import BaseHTTPMiddleware
+    import app as app_module
+
+    logging.disable(logging.CRITICAL)  # measure middleware mechanics, not log I/O
+    variants = {}
+    for name in ("none", "BaseHTTPMiddleware", "MetricsMiddleware"):
+        bench_app = FastAPI()
+        bench_app.get("/")(app_module.root)
+        if name == "BaseHTTPMiddleware":
+            bench_app.add_middleware(BaseHTTPMiddleware, dispatch=legacy_metrics_middleware(app_module))
+        elif name == "MetricsMiddleware":
+            bench_app.add_middleware(app_module.MetricsMiddleware)
+        variants[name] = bench_app
+
+    print(f"GET / x {n}, ASGI app called directly")
+    print(f"{'middleware':>20} {'us/request':>11} {'overhead us':>12}")
+    results = {name: asyncio.run(drive_asgi(bench_app, "/", n)) for name, bench_app in variants.items()}
+    for name, us in results.items():
+        print(f"{name:>20} {us:>11.1f} {us - results['none']:>12.1f}")
+
+
+# WORKERS: throughput of serve.py with 1 vs N worker processes
+
+async def closed_loop(url: str, concurrency: int, seconds: float):
+    """`concurrency` clients sending back-to-back requests; returns (requests, latencies ms)"""
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def worker():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(url)
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return len(latencies), latencies
+
+
+def wait_for_port(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def bench_workers(worker_counts, concurrency: int, seconds: float, port: int):
+    env = dict(os.environ, RATE_LIMIT_ENABLED="false", LOG_ACCESS_SAMPLE_RATE="0", LOG_LEVEL="WARNING")
+    url = f"http://127.0.0.1:{port}/products"
+    print(f"GET /products, {concurrency} concurrent clients, {seconds}s per run")
+    print(f"{'workers':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for workers in worker_counts:
+        server = subprocess.Popen(
+            [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(url)
+            asyncio.run(closed_loop(url, concurrency, 1.0))  # warm up
+            count, latencies = asyncio.run(closed_loop(url, concurrency, seconds))
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+        print(f"{workers:>8} {count / seconds:>9.0f} {statistics.median(latencies):>8.2f} {percentile(latencies, 99):>8.2f}")
+
+
+# PAGINATION: time and memory of one GET /products at 1M rows
+
+async def fetch(asgi_app, path: str) -> int:
+    """One request through the ASGI app, reading the body chunk by chunk; returns bytes received"""
+    transport = httpx.ASGITransport(app=asgi_app)
+    received = 0
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async with client.stream("GET", path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_raw():
+                received += len(chunk)
+    return received
+
+
+def bench_pagination(rows: int):
+    import app as app_module
+
+    logging.disable(logging.CRITICAL)
+    app_module.limiter.enabled = False
+    app_module.products_db = ProductStore(make_products(rows))
+    cases = [
+        ("full list", "/products"),
+        ("full list fields=id,price", "/products?fields=id,price"),
+        ("page limit=100", f"/products?limit=100&after={rows // 2}"),
+        ("page limit=1000 fields=id,price", f"/products?limit=1000&after={rows // 2}&fields=id,price"),
+        ("NDJSON stream", "/products/stream"),
+        ("NDJSON stream fields=id,price", "/products/stream?fields=id,price"),
+    ]
+
+    print(f"{rows} products, one cold request each (ASGI, in-process)")
+    print(f"{'request':>32} {'ms':>9} {'MB sent':>9} {'peak MB':>9}")
+    for name, path in cases:
+        app_module.products_json_cache["version"] = None  # measure the serialization, not the cache
+        start = time.perf_counter()
+        size = asyncio.run(fetch(app_module.app, path))
+        elapsed = (time.perf_counter() - start) * 1000
+
+        # Second run under tracemalloc (slower) just for the allocation peak.
+        # httpx.ASGITransport buffers the whole body, so the peak includes the client's copy
+        app_module.products_json_cache["version"] = None
+        tracemalloc.start()
+        asyncio.run(fetch(app_module.app, path))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:>32} {elapsed:>9.1f} {size / 1e6:>9.1f} {peak / 1e6:>9.1f}")
+
+
+# COMPRESSION: serialization CPU time and bytes on the wire
+
+def bench_compression(rows: int, repeat: int):
+    import json
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    import app as app_module
+    import compression
+
+    logging.disable(logging.CRITICAL)
+    products = make_products(rows)
+
+    encoders = {"jsonable_encoder + json (FastAPI default)": lambda: JSONResponse(jsonable_encoder(products)).body,
+                "json.dumps": lambda: json.dumps(products, ensure_ascii=False, separators=(",", ":")).encode()}
+    if app_module.orjson is not None:
+        encoders["jsonable_encoder + orjson (ORJSONResponse)"] = lambda: app_module.ORJSONResponse(jsonable_encoder(products)).body
+        encoders["orjson.dumps"] = lambda: app_module.orjson.dumps(products)
+
+    print(f"{rows} products, serialization ({repeat} runs)")
+    print(f"{'encoder':>44} {'ms':>8}")
+    for name, encode in encoders.items():
+        print(f"{name:>44} {timed(lambda i: encode(), repeat) / 1000:>8.2f}")
+
+    body = app_module.orjson.dumps(products) if app_module.orjson else encoders["json.dumps"]()
+    encodings = ["gzip"] + (["br"] if compression.brotli else [])
+    print(f"\n{'encoding':>10} {'bytes':>10} {'ratio':>6} {'ms':>8}")
+    print(f"{'identity':>10} {len(body):>10} {1:>6.2f} {0:>8.2f}")
+    for encoding in encodings:
+        ms = timed(lambda i: compression.compress_body(body, encoding), repeat) / 1000
+        size = len(compression.compress_body(body, encoding))
+        print(f"{encoding:>10} {size:>10} {size / len(body):>6.2f} {ms:>8.2f}")
+    if not compression.brotli:
+        print("(brotli not installed: pip install brotli)")
+
+    # End to end through the app, cache rebuilt every request so encoding is included
+    app_module.limiter.enabled = False
+    app_module.products_db = ProductStore(products)
+
+    async def run(accept_encoding: str):
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                app_module.products_json_cache["version"] = None
+                response = await client.get("/products", headers={"Accept-Encoding": accept_encoding})
+            return (time.perf_counter() - start) / repeat * 1000, response.num_bytes_downloaded
+
+    print(f"\nGET /products (JSON_ENCODER={app_module.JSON_ENCODER})")
+    print(f"{'Accept-Encoding':>16} {'ms':>8} {'wire bytes':>11}")
+    for accept_encoding in ["identity"] + encodings:
+        ms, wire = asyncio.run(run(accept_encoding))
+        print(f"{accept_encoding:>16} {ms:>8.2f} {wire:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    store = sub.add_parser("store", help="CRUD latency of ProductStore vs the old list")
+    store.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+
+    log = sub.add_parser("logging", help="p99 latency with sync vs queued logging")
+    log.add_argument("--rps", type=int, default=2000)
+    log.add_argument("--seconds", type=float, default=5.0)
+
+    mw = sub.add_parser("middleware", help="Per-request overhead of the metrics middleware")
+    mw.add_argument("--requests", type=int, default=20000)
+
+    wk = sub.add_parser("workers", help="/products throughput with 1 vs N serve.py workers")
+    wk.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    wk.add_argument("--concurrency", type=int, default=64)
+    wk.add_argument("--seconds", type=float, default=10.0)
+    wk.add_argument("--port", type=int, default=8090)
+
+    pg = sub.add_parser("pagination", help="GET /products at 1M rows: full list vs page vs NDJSON stream")
+    pg.add_argument("--rows", type=int, default=1_000_000)
+
+    cp = sub.add_parser("compression", help="JSON encoder CPU time and gzip/brotli bytes for GET /products")
+    cp.add_argument("--rows", type=int, default=10_000)
+    cp.add_argument("--repeat", type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == "store":
+        bench_store(args.sizes)
+    elif args.command == "logging":
+        bench_logging(args.rps, args.seconds)
+    elif args.command == "middleware":
+        bench_middleware(args.requests)
+    elif args.command == "workers":
+        bench_workers(args.workers, args.concurrency, args.seconds, args.port)
+    elif args.command == "pagination":
+        bench_pagination(args.rows)
+    elif args.command == "compression":
+        bench_compression(args.rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
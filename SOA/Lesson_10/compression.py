@@ -0,0 +1,170 @@
+"""Size-thresholded gzip / brotli response compression as a pure ASGI middleware."""
+import asyncio
+import gzip
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # brotli is optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "application/xml")
+# Bodies above this are compressed in a worker thread instead of on the event loop
+THREAD_THRESHOLD = 256 * 1024
+
+
+def choose_encoding(accept_encoding: Optional[str], brotli_available: bool = brotli is not None) -> Optional[str]:
+    """Best of br / gzip allowed by the Accept-Encoding header (highest q wins, br on ties)"""
+    best, best_q = None, 0.0
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if coding not in ("br", "gzip") or (coding == "br" and not brotli_available):
+            continue
+        q = 1.0
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        if q > best_q or (q == best_q and q > 0 and coding == "br"):
+            best, best_q = coding, q
+    return best
+
+
+class _Compressor:
+    """Incremental compressor, so streamed bodies are compressed chunk by chunk"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._impl = brotli.Compressor(quality=brotli_quality)
+            self.compress, self.flush = self._impl.process, self._impl.finish
+        else:
+            self._impl = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+            self.compress, self.flush = self._impl.compress, self._impl.flush
+
+
+def compress_body(body: bytes, encoding: str, gzip_level: int = 5, brotli_quality: int = 4) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses of compressible types once they reach ``minimum_size``
+    bytes, using brotli when the client accepts it (and the package is
+    installed), gzip otherwise.
+
+    Responses that already carry a Content-Encoding (e.g. /metrics) are left
+    alone. A strong ETag gets the encoding appended (``"abc-gzip"``) so each
+    representation keeps a distinct validator; the suffix is stripped again
+    from incoming If-None-Match / If-Match so the app sees its own ETags.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 5, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        scope = _strip_etag_suffixes(scope)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                start_message = message  # held back until we know the body size
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                start, start_message = start_message, None
+                if not self._should_compress(start, body, more_body):
+                    await send(start)
+                    await send(message)
+                    compressor = False
+                    return
+                if not more_body:
+                    # Whole body in one message
+                    if len(body) >= THREAD_THRESHOLD:
+                        body = await asyncio.to_thread(compress_body, body, encoding, self.gzip_level, self.brotli_quality)
+                    else:
+                        body = compress_body(body, encoding, self.gzip_level, self.brotli_quality)
+                    await send(_compressed_start(start, encoding, len(body)))
+                    await send({"type": "http.response.body", "body": body})
+                    compressor = False
+                    return
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                await send(_compressed_start(start, encoding, None))
+
+            if not compressor:
+                await send(message)
+                return
+            chunk = compressor.compress(body)
+            if not more_body:
+                chunk += compressor.flush()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _should_compress(self, start: dict, body: bytes, more_body: bool) -> bool:
+        headers = {k.lower(): v for k, v in start.get("headers", [])}
+        if b"content-encoding" in headers or start["status"] in (204, 304):
+            return False
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+        # A stream is compressed regardless of its first chunk's size
+        return more_body or len(body) >= self.minimum_size
+
+
+def _compressed_start(start: dict, encoding: str, length: Optional[int]) -> dict:
+    headers = []
+    vary = None
+    for key, value in start.get("headers", []):
+        name = key.lower()
+        if name == b"content-length":
+            continue
+        if name == b"etag" and not value.startswith(b"W/") and value.endswith(b'"'):
+            value = value[:-1] + b"-" + encoding.encode() + b'"'
+        if name == b"vary":
+            vary = value
+            continue
+        headers.append((key, value))
+    headers.append((b"content-encoding", encoding.encode()))
+    headers.append((b"vary", b"Accept-Encoding" if vary is None else vary + b", Accept-Encoding"))
+    if length is not None:
+        headers.append((b"content-length", str(length).encode()))
+    return {**start, "headers": headers}
+
+
+def _strip_etag_suffixes(scope: dict) -> dict:
+    """`"abc-gzip"` / `"abc-br"` in If-None-Match / If-Match -> `"abc"`"""
+    changed = False
+    headers = []
+    for key, value in scope["headers"]:
+        if key in (b"if-none-match", b"if-match") and (b'-gzip"' in value or b'-br"' in value):
+            value = value.replace(b'-gzip"', b'"').replace(b'-br"', b'"')
+            changed = True
+        headers.append((key, value))
+    return {**scope, "headers": headers} if changed else scope
@@ -0,0 +1,160 @@
+"""LRU + TTL cache for external enrichment results, with request coalescing."""
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Sequence, Type
+
+from prometheus_client import CollectorRegistry, Counter
+
+
+class EnrichmentCache:
+    """
+    Cache in front of an async loader (``get_external_data``).
+
+    - Successes are kept for ``ttl`` seconds, failures for ``negative_ttl``
+      seconds, so a broken upstream is not retried on every request.
+    - At most ``max_size`` entries; the least recently used one is evicted.
+    - Concurrent misses for the same key share one in-flight load.
+    - Exceptions listed in ``uncached`` (momentary, local conditions such as a
+      full bulkhead) are raised but never negatively cached.
+    - Stale-while-revalidate: for ``stale_ttl`` seconds after it expires a
+      success is still served, and reloaded in the background. A failed
+      reload keeps the stale value instead of replacing it with the error.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[Hashable], Awaitable[Any]],
+        max_size: int = 10000,
+        ttl: float = 300.0,
+        negative_ttl: float = 5.0,
+        registry: Optional[CollectorRegistry] = None,
+        clock: Callable[[], float] = time.monotonic,
+        uncached: Sequence[Type[BaseException]] = (),
+        stale_ttl: float = 0.0,
+    ):
+        self.loader = loader
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.uncached = tuple(uncached)
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        # key -> (expires_at, ok, value or exception)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+        self.hits = Counter(
+            'enrichment_cache_hits_total',
+            'Enrichment cache hits',
+            ['result'],
+            registry=registry
+        )
+        self.misses = Counter(
+            'enrichment_cache_misses_total',
+            'Enrichment cache misses',
+            registry=registry
+        )
+        self.coalesced = Counter(
+            'enrichment_cache_coalesced_total',
+            'Misses served by an already in-flight upstream call',
+            registry=registry
+        )
+        self.evictions = Counter(
+            'enrichment_cache_evictions_total',
+            'Enrichment cache evictions',
+            ['reason'],
+            registry=registry
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def inflight(self) -> int:
+        """Loads currently running (inline misses and background reloads)"""
+        return len(self._inflight)
+
+    async def get(self, key: Hashable) -> Any:
+        """Cached value for key; a cached failure is raised again"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, ok, value = entry
+            now = self._clock()
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits.labels(result="success" if ok else "failure").inc()
+                if ok:
+                    return value
+                raise value
+            if ok and expires_at + self.stale_ttl > now:
+                self._entries.move_to_end(key)
+                self.hits.labels(result="stale").inc()
+                self.refresh(key, detached=True)
+                return value
+            del self._entries[key]
+            self.evictions.labels(reason="expired").inc()
+
+        self.misses.inc()
+        if key in self._inflight:
+            self.coalesced.inc()
+        # shield: one cancelled waiter must not cancel the load for the others
+        return await asyncio.shield(self.refresh(key))
+
+    def refresh(self, key: Hashable, detached: bool = False) -> asyncio.Future:
+        """
+        Start loading key (or join the load in flight). A detached load runs
+        in an empty context, so it does not inherit the current request's
+        deadline.
+        """
+        pending = self._inflight.get(key)
+        if pending is None:
+            context = contextvars.Context() if detached else None
+            pending = asyncio.get_running_loop().create_task(self._load(key), context=context)
+            # Nobody may await a background reload: retrieve its error here
+            pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._inflight[key] = pending
+        return pending
+
+    def needs_refresh(self, key: Hashable, within: float = 0.0) -> bool:
+        """True if key is missing, failed, or expires in the next ``within`` seconds"""
+        entry = self._entries.get(key)
+        return entry is None or not entry[1] or entry[0] - self._clock() < within
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Wait for in-flight loads (e.g. background reloads) to finish"""
+        if self._inflight:
+            await asyncio.wait(list(self._inflight.values()), timeout=timeout)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def _load(self, key: Hashable) -> Any:
+        try:
+            value = await self.loader(key)
+        except Exception as exc:
+            if not isinstance(exc, self.uncached) and not self._has_stale(key):
+                self._store(key, False, exc, self.negative_ttl)
+            raise
+        else:
+            self._store(key, True, value, self.ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def _has_stale(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] and entry[0] + self.stale_ttl > self._clock()
+
+    def _store(self, key: Hashable, ok: bool, value: Any, ttl: float):
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        self._entries[key] = (self._clock() + ttl, ok, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions.labels(reason="size").inc()
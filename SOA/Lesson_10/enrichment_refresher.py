@@ -0,0 +1,178 @@
+"""Background prefetch of enrichment data for the most requested keys."""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+from enrichment_cache import EnrichmentCache
+
+logger = logging.getLogger(__name__)
+
+_SEEDS = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F)
+
+
+class FrequencySketch:
+    """
+    Count-min sketch of access counts (TinyLFU style): fixed memory whatever
+    the number of keys, estimates never below the true count. Every
+    ``sample_size`` increments all counters are halved, so old popularity
+    fades and a newly hot key overtakes yesterday's.
+    """
+
+    def __init__(self, width: int = 4096, sample_size: Optional[int] = None):
+        self.width = 1 << max(width - 1, 1).bit_length()  # power of two: index with a mask
+        self._mask = self.width - 1
+        self._rows = [[0] * self.width for _ in _SEEDS]
+        self.sample_size = sample_size or 10 * self.width
+        self._additions = 0
+
+    def increment(self, key: Hashable) -> int:
+        estimate = None
+        for row, seed in zip(self._rows, _SEEDS):
+            i = hash((key, seed)) & self._mask
+            row[i] += 1
+            estimate = row[i] if estimate is None else min(estimate, row[i])
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._age()
+        return estimate
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[hash((key, seed)) & self._mask] for row, seed in zip(self._rows, _SEEDS))
+
+    def _age(self):
+        for row in self._rows:
+            for i, count in enumerate(row):
+                if count:
+                    row[i] = count >> 1
+        self._additions //= 2
+
+
+class EnrichmentRefresher:
+    """
+    Keeps the enrichment cache warm for the hottest keys, so reads are served
+    from memory instead of waiting on the upstream.
+
+    ``record(key)`` is called on every read and only touches the sketch and a
+    bounded candidate set. Every ``interval`` seconds the ``top_k`` candidates
+    with the highest estimated frequency are refreshed if their entry is
+    missing or expires before the next cycle, at most ``concurrency`` loads at
+    a time. ``stop()`` lets the running cycle and in-flight loads finish for
+    up to ``drain_seconds`` before cancelling them.
+    """
+
+    def __init__(
+        self,
+        cache: EnrichmentCache,
+        interval: float = 30.0,
+        top_k: int = 1000,
+        concurrency: int = 4,
+        drain_seconds: float = 5.0,
+        keep: Optional[Callable[[Hashable], bool]] = None,
+        registry: Optional[CollectorRegistry] = None,
+    ):
+        self.cache = cache
+        self.interval = interval
+        self.top_k = top_k
+        self.concurrency = concurrency
+        self.drain_seconds = drain_seconds
+        self.keep = keep
+        self.sketch = FrequencySketch(width=top_k * 16)
+        # Keys that may be hot; pruned back to top_k on every cycle
+        self._candidates: Dict[Hashable, None] = {}
+        self._admit_above = 0  # estimate a new key needs while the candidate set is full
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+        self.refreshes = Counter(
+            'enrichment_refresh_total',
+            'Background enrichment refreshes',
+            ['result'],
+            registry=registry
+        )
+        self.cycle_duration = Histogram(
+            'enrichment_refresh_cycle_seconds',
+            'Duration of one background refresh cycle',
+            registry=registry
+        )
+        self.tracked = Gauge(
+            'enrichment_refresh_tracked_keys',
+            'Keys currently considered for background refresh',
+            registry=registry
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def record(self, key: Hashable):
+        estimate = self.sketch.increment(key)
+        if key in self._candidates:
+            return
+        if len(self._candidates) < 4 * self.top_k or estimate > self._admit_above:
+            self._candidates[key] = None
+
+    def hottest(self) -> List[Hashable]:
+        """Top ``top_k`` candidates by estimated frequency (prunes the rest)"""
+        keys = self._candidates
+        if self.keep is not None:
+            keys = [key for key in keys if self.keep(key)]
+        ranked = sorted(keys, key=self.sketch.estimate, reverse=True)[:self.top_k]
+        self._candidates = dict.fromkeys(ranked)
+        self._admit_above = self.sketch.estimate(ranked[-1]) if len(ranked) >= self.top_k else 0
+        self.tracked.set(len(ranked))
+        return ranked
+
+    async def refresh_once(self) -> int:
+        """One cycle: reload the hot keys that are missing or about to expire"""
+        start = time.perf_counter()
+        due = [key for key in self.hottest() if self.cache.needs_refresh(key, within=self.interval)]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh(key):
+            async with semaphore:
+                try:
+                    await self.cache.refresh(key)
+                    self.refreshes.labels(result="success").inc()
+                except Exception as e:
+                    # Failures keep serving the stale value; the next cycle retries
+                    self.refreshes.labels(result="failure").inc()
+                    logger.debug(f"Background refresh of {key} failed: {e}")
+
+        await asyncio.gather(*(refresh(key) for key in due))
+        self.cycle_duration.observe(time.perf_counter() - start)
+        return len(due)
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop scheduling cycles and drain in-flight work for up to ``drain_seconds``"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        deadline = time.monotonic() + self.drain_seconds
+        done, _ = await asyncio.wait([self._task], timeout=self.drain_seconds)
+        if not done:
+            logger.warning("Enrichment refresher did not drain in time, cancelling")
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.cache.drain(max(deadline - time.monotonic(), 0.0))
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+                break  # stop() was called while sleeping
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.refresh_once()
+            except Exception as e:
+                logger.error(f"Enrichment refresh cycle failed: {e}")
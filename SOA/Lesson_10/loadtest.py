@@ -0,0 +1,468 @@
+"""
+Load generator for the Lesson_10 API (replaces the old test_demo.py script).
+
+Drives every endpoint with a weighted request mix, either open loop (a fixed
+or Poisson arrival rate, latency measured from the scheduled send time so
+queueing is not hidden) or closed loop (N clients back to back). Latencies go
+into HDR-style histograms and the run is written as a JSON report that
+``compare`` can diff against an earlier one.
+
+By default the app runs in-process (httpx.ASGITransport) with a local stub in
+place of the external API, so no server or internet is needed.
+
+    python loadtest.py run                                   # 200 req/s for 30s, in-process
+    python loadtest.py run --rate 500 --seconds 60 --out after.json
+    python loadtest.py run --rate 0 --concurrency 32         # closed loop, 32 clients
+    python loadtest.py run --url http://localhost:8000       # a running server (python serve.py)
+    python loadtest.py run --mix get_product=50,list_products=50
+    python loadtest.py compare before.json after.json --threshold 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+REPORT_VERSION = 1
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of integer microsecond values: values below 256 get
+    exact slots, larger ones go into power-of-two ranges split into 128
+    linear slots. Recording is O(1) and every value is kept within 1/128
+    (< 0.8%) relative error, whatever the range.
+    """
+
+    SUB_BUCKETS = 128
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max = 0
+
+    @classmethod
+    def _index(cls, value: int) -> int:
+        if value < 2 * cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - 8
+        return 2 * cls.SUB_BUCKETS + (shift - 1) * cls.SUB_BUCKETS + (value >> shift) - cls.SUB_BUCKETS
+
+    @classmethod
+    def _highest(cls, index: int) -> int:
+        """Largest value that lands in ``index``"""
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+        shift = (index - 2 * cls.SUB_BUCKETS) // cls.SUB_BUCKETS + 1
+        mantissa = (index - 2 * cls.SUB_BUCKETS) % cls.SUB_BUCKETS + cls.SUB_BUCKETS
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value_us: float):
+        value = max(int(value_us), 0)
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def percentile(self, pct: float) -> int:
+        if not self.total:
+            return 0
+        target = max(1, math.ceil(self.total * pct / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._highest(index), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "unit": "us",
+            "count": self.total,
+            "min": self.min or 0,
+            "max": self.max,
+            # [highest equivalent value, count] per non-empty slot
+            "buckets": [[self._highest(i), self.counts[i]] for i in sorted(self.counts)],
+        }
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statuses: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    def summary(self, seconds: float) -> dict:
+        failed = sum(self.errors.values()) + sum(n for code, n in self.statuses.items() if int(code) >= 500)
+        return {
+            "requests": self.latency.total,
+            "rps": round(self.latency.total / seconds, 2) if seconds else 0.0,
+            "failed": failed,
+            "statuses": dict(sorted(self.statuses.items())),
+            "errors": dict(self.errors),
+            "latency_ms": {f"p{p:g}": self.latency.percentile(p) / 1000 for p in PERCENTILES}
+                          | {"max": self.latency.max / 1000},
+            "histogram": self.latency.to_dict(),
+        }
+
+
+# REQUEST MIX
+# Each scenario sends one request and returns it; `state` keeps ids and ETags
+# seen so far so writes and conditional GETs target real products.
+
+class MixState:
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.ids: List[int] = []
+        self.created: List[int] = []
+        self.etags: Dict[int, str] = {}
+        self.writes: Counter = Counter()  # successful created / updated / deleted
+
+    def some_id(self) -> int:
+        return self.rng.choice(self.ids) if self.ids else 1
+
+
+async def root(client, state):
+    return await client.get("/")
+
+async def health(client, state):
+    return await client.get("/health")
+
+async def list_products(client, state):
+    return await client.get("/products")
+
+async def list_page(client, state):
+    return await client.get("/products", params={"limit": 50, "after": max(state.some_id() - 1, 0)})
+
+async def list_filtered(client, state):
+    return await client.get("/products", params={"in_stock": True, "max_price": 500, "fields": "name,price"})
+
+async def get_product(client, state):
+    product_id = state.some_id()
+    response = await client.get(f"/products/{product_id}")
+    if "etag" in response.headers:
+        state.etags[product_id] = response.headers["etag"]
+    return response
+
+async def get_product_conditional(client, state):
+    product_id = state.some_id()
+    etag = state.etags.get(product_id)
+    return await client.get(f"/products/{product_id}", headers={"If-None-Match": etag} if etag else {})
+
+async def create_product(client, state):
+    response = await client.post("/products", json={
+        "name": f"Load {state.rng.randrange(10**6)}", "price": round(state.rng.uniform(1, 2000), 2),
+        "description": "created by loadtest", "in_stock": state.rng.random() < 0.7})
+    if response.is_success:  # 201 Created
+        product_id = response.json()["id"]
+        state.created.append(product_id)
+        state.ids.append(product_id)
+        state.writes["created"] += 1
+    return response
+
+async def update_product(client, state):
+    product_id = state.rng.choice(state.created) if state.created else state.some_id()
+    etag = state.etags.get(product_id)
+    response = await client.put(f"/products/{product_id}", json={"price": round(state.rng.uniform(1, 2000), 2)},
+                                headers={"If-Match": etag} if etag else {})
+    if response.is_success:
+        state.writes["updated"] += 1
+    return response
+
+async def delete_product(client, state):
+    if not state.created:
+        return await get_product(client, state)
+    product_id = state.created.pop(state.rng.randrange(len(state.created)))
+    state.ids.remove(product_id)
+    response = await client.delete(f"/products/{product_id}")
+    if response.is_success:
+        state.writes["deleted"] += 1
+    return response
+
+async def batch_create(client, state):
+    items = [{"name": f"Batch {i}", "price": round(state.rng.uniform(1, 100), 2)} for i in range(50)]
+    return await client.post("/products:batch", json=items)
+
+async def stream_products(client, state):
+    return await client.get("/products/stream", params={"fields": "id,price"})
+
+async def metrics(client, state):
+    return await client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+
+async def rate_limit_probe(client, state):
+    return await client.get("/test/rate-limit")
+
+async def circuit_breaker_probe(client, state):
+    return await client.get("/test/circuit-breaker")
+
+# name -> (default weight, scenario); reads dominate, like a real catalog API
+SCENARIOS = {
+    "root": (2, root),
+    "health": (5, health),
+    "list_products": (15, list_products),
+    "list_page": (10, list_page),
+    "list_filtered": (5, list_filtered),
+    "get_product": (30, get_product),
+    "get_product_conditional": (10, get_product_conditional),
+    "create_product": (5, create_product),
+    "update_product": (5, update_product),
+    "delete_product": (3, delete_product),
+    "batch_create": (1, batch_create),
+    "stream_products": (1, stream_products),
+    "metrics": (2, metrics),
+    "rate_limit_probe": (1, rate_limit_probe),
+    "circuit_breaker_probe": (1, circuit_breaker_probe),
+}
+
+
+def parse_mix(spec: Optional[str]) -> Dict[str, int]:
+    if not spec:
+        return {name: weight for name, (weight, _) in SCENARIOS.items()}
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}. Known: {', '.join(SCENARIOS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+# TARGETS
+
+def stub_upstream(latency_ms: float, error_rate: float, rng: random.Random) -> httpx.AsyncClient:
+    """Local stand-in for jsonplaceholder: fixed latency, random 500s"""
+    async def handler(request: httpx.Request):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        if rng.random() < error_rate:
+            return httpx.Response(500, json={"error": "stub failure"})
+        post_id = int(request.url.path.rsplit("/", 1)[-1])
+        return httpx.Response(200, json={"id": post_id, "title": f"post {post_id}"})
+
+    return httpx.AsyncClient(base_url="http://upstream.stub", transport=httpx.MockTransport(handler))
+
+
+def make_client(args, rng: random.Random) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.url:
+        return httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout)
+
+    import app as app_module
+    if not args.app_logs:
+        logging.getLogger().setLevel(logging.WARNING)
+    # Every in-process request comes from one address: per-client limits would reject most of the mix
+    app_module.limiter.enabled = args.rate_limits
+    app_module.http_client = stub_upstream(args.upstream_latency_ms, args.upstream_error_rate, rng)
+    transport = httpx.ASGITransport(app=app_module.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://loadtest", limits=limits, timeout=args.timeout)
+
+
+# RUNNER
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, int], rng: random.Random):
+        self.client = client
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.rng = rng
+        self.state = MixState(rng)
+        self.stats: Dict[str, EndpointStats] = {name: EndpointStats() for name in self.names}
+
+    async def warm_up(self):
+        response = await self.client.get("/products", params={"fields": "id"})
+        response.raise_for_status()
+        self.state.ids = [p["id"] for p in response.json()]
+
+    async def one(self, started: float):
+        """Send one request from the mix; latency counts from `started`"""
+        name = self.rng.choices(self.names, self.weights)[0]
+        stats = self.stats[name]
+        try:
+            response = await SCENARIOS[name][1](self.client, self.state)
+            await response.aread()
+            stats.statuses[str(response.status_code)] += 1
+        except Exception as exc:
+            stats.errors[type(exc).__name__] += 1
+        stats.latency.record((time.perf_counter() - started) * 1e6)
+
+    async def open_loop(self, rate: float, seconds: float, concurrency: int, poisson: bool):
+        """
+        Requests arrive on schedule regardless of how fast the app answers.
+        At most `concurrency` are in flight; the rest wait, and that wait is
+        part of their latency (no coordinated omission).
+        """
+        in_flight = asyncio.Semaphore(concurrency)
+        tasks = set()
+
+        async def scheduled(at: float):
+            async with in_flight:
+                await self.one(at)
+
+        start = time.perf_counter()
+        next_at = start
+        while next_at < start + seconds:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.ensure_future(scheduled(next_at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            next_at += self.rng.expovariate(rate) if poisson else 1 / rate
+        await asyncio.gather(*tasks)
+
+    async def closed_loop(self, seconds: float, concurrency: int):
+        deadline = time.perf_counter() + seconds
+
+        async def client_loop():
+            while time.perf_counter() < deadline:
+                await self.one(time.perf_counter())
+
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    async with make_client(args, rng) as client:
+        load = LoadTest(client, mix, rng)
+        await load.warm_up()
+        started_at = datetime.now(timezone.utc).isoformat()
+        start = time.perf_counter()
+        if args.rate > 0:
+            await load.open_loop(args.rate, args.seconds, args.concurrency, args.arrivals == "poisson")
+        else:
+            await load.closed_loop(args.seconds, args.concurrency)
+        elapsed = time.perf_counter() - start
+
+    overall = EndpointStats()
+    for stats in load.stats.values():
+        overall.latency.merge(stats.latency)
+        overall.statuses.update(stats.statuses)
+        overall.errors.update(stats.errors)
+    return {
+        "report_version": REPORT_VERSION,
+        "started_at": started_at,
+        "target": args.url or "in-process",
+        "config": {
+            "mode": "open" if args.rate > 0 else "closed",
+            "rate": args.rate, "arrivals": args.arrivals, "seconds": args.seconds,
+            "concurrency": args.concurrency, "seed": args.seed, "mix": mix,
+            "upstream_latency_ms": args.upstream_latency_ms, "upstream_error_rate": args.upstream_error_rate,
+            "rate_limits": args.rate_limits,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "overall": overall.summary(elapsed),
+        "endpoints": {name: stats.summary(elapsed) for name, stats in load.stats.items() if stats.latency.total},
+        "writes": {kind: load.state.writes[kind] for kind in ("created", "updated", "deleted")},
+    }
+
+
+def write_problems(report: dict) -> List[str]:
+    """Write scenarios that ran but never changed anything (a broken mix looks healthy otherwise)"""
+    problems = []
+    for scenario, kind in (("create_product", "created"), ("delete_product", "deleted")):
+        ran = report["endpoints"].get(scenario, {}).get("requests", 0)
+        if ran and not report["writes"][kind]:
+            problems.append(f"{scenario} ran {ran} times but no product was {kind}")
+    return problems
+
+
+def print_report(report: dict):
+    cfg = report["config"]
+    print(f"{report['target']}: {cfg['mode']} loop, {cfg['rate']} req/s, {cfg['concurrency']} concurrent, {report['elapsed_s']}s")
+    print(f"{'endpoint':>24} {'req':>7} {'rps':>8} {'fail':>5} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'p99.9 ms':>9} {'max ms':>8}")
+    rows = list(report["endpoints"].items()) + [("OVERALL", report["overall"])]
+    for name, s in rows:
+        lat = s["latency_ms"]
+        print(f"{name:>24} {s['requests']:>7} {s['rps']:>8.1f} {s['failed']:>5} {lat['p50']:>8.2f} "
+              f"{lat['p90']:>8.2f} {lat['p99']:>8.2f} {lat['p99.9']:>9.2f} {lat['max']:>8.2f}")
+    writes = report["writes"]
+    print(f"writes: {writes['created']} created, {writes['updated']} updated, {writes['deleted']} deleted")
+
+
+def compare(old: dict, new: dict, threshold: float) -> int:
+    """Print old -> new per endpoint; returns the number of p99 regressions above threshold %"""
+    def change(a: float, b: float) -> float:
+        return (b - a) / a * 100 if a else 0.0
+
+    regressions = 0
+    print(f"{'endpoint':>24} {'rps old':>9} {'rps new':>9} {'p50 old':>8} {'p50 new':>8} {'p99 old':>8} {'p99 new':>8} {'p99 %':>7}")
+    names = [n for n in old["endpoints"] if n in new["endpoints"]] + ["OVERALL"]
+    for name in names:
+        a = old["overall"] if name == "OVERALL" else old["endpoints"][name]
+        b = new["overall"] if name == "OVERALL" else new["endpoints"][name]
+        p99_change = change(a["latency_ms"]["p99"], b["latency_ms"]["p99"])
+        flag = ""
+        if p99_change > threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"{name:>24} {a['rps']:>9.1f} {b['rps']:>9.1f} {a['latency_ms']['p50']:>8.2f} {b['latency_ms']['p50']:>8.2f} "
+              f"{a['latency_ms']['p99']:>8.2f} {b['latency_ms']['p99']:>8.2f} {p99_change:>+6.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    r = sub.add_parser("run", help="Run the request mix and write a report")
+    r.add_argument("--url", help="Base URL of a running server (default: in-process app)")
+    r.add_argument("--rate", type=float, default=200, help="Arrivals per second (0 = closed loop)")
+    r.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+    r.add_argument("--seconds", type=float, default=30)
+    r.add_argument("--concurrency", type=int, default=100, help="Max requests in flight (closed loop: number of clients)")
+    r.add_argument("--mix", help="Scenario weights, e.g. get_product=50,list_products=10 (default: built-in mix)")
+    r.add_argument("--seed", type=int, default=1)
+    r.add_argument("--timeout", type=float, default=30)
+    r.add_argument("--upstream-latency-ms", type=float, default=20, help="In-process stub: external API latency")
+    r.add_argument("--upstream-error-rate", type=float, default=0.0, help="In-process stub: fraction of 500s")
+    r.add_argument("--rate-limits", action="store_true", help="In-process: keep rate limits on (all load is one client)")
+    r.add_argument("--app-logs", action="store_true", help="In-process: keep the app's INFO logs")
+    r.add_argument("--out", help="Write the JSON report here")
+
+    c = sub.add_parser("compare", help="Diff two reports")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=10, help="Exit 1 if any p99 grew by more than this %%")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        report = asyncio.run(run(args))
+        print_report(report)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {args.out}")
+        problems = write_problems(report)
+        for problem in problems:
+            print(f"ERROR: {problem}", file=sys.stderr)
+        return 1 if problems else 0
+
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    return 1 if compare(old, new, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Logging setup: JSON records, queue-based (off the event loop) batched writes, access-log sampling."""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message + any `extra` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only `rate` of INFO/DEBUG records; warnings and errors always pass"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class BatchingQueueListener:
+    """
+    Like logging.handlers.QueueListener, but drains up to `batch_size`
+    records at a time and writes them to each stream handler with a single
+    write + flush, instead of one flush per record.
+    """
+
+    _sentinel = None
+
+    def __init__(self, log_queue: queue.Queue, handlers: List[logging.Handler], batch_size: int = 512):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush everything already queued, then stop the writer thread"""
+        if self._thread is None:
+            return
+        self.queue.put_nowait(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+    def _monitor(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = self._sentinel in batch
+            self._emit([record for record in batch if record is not self._sentinel])
+            if stop:
+                return
+
+    def _emit(self, records: List[logging.LogRecord]):
+        # A record that fails to format or write goes to handler.handleError,
+        # like Handler.emit does; the writer thread must never die, or the
+        # queue grows without bound and nothing is logged again
+        for handler in self.handlers:
+            if not isinstance(handler, logging.StreamHandler):
+                for record in records:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)  # emit() handles its own errors
+                continue
+            lines = []
+            for record in records:
+                try:
+                    if record.levelno >= handler.level and handler.filter(record):
+                        lines.append(handler.format(record) + handler.terminator)
+                except Exception:
+                    handler.handleError(record)
+            if not lines:
+                continue
+            with handler.lock:
+                try:
+                    handler.stream.write("".join(lines))
+                    handler.stream.flush()
+                except Exception:
+                    handler.handleError(records[-1])
+
+
+def setup_logging(
+    level: str = "INFO",
+    mode: str = "queue",
+    fmt: str = "json",
+    log_file: str = "app.log",
+    access_sample_rate: float = 1.0,
+) -> Optional[BatchingQueueListener]:
+    """
+    Configure the root logger.
+
+    mode="sync" writes from the calling thread (the old basicConfig setup),
+    mode="queue" only enqueues on the calling thread and lets a background
+    listener do the disk/console I/O. Returns the listener; it is stopped
+    (and flushed) at interpreter exit.
+    """
+    if fmt == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.setLevel(getattr(logging, level.upper()))
+
+    # Per-request access lines can be sampled at high RPS
+    access_logger = logging.getLogger("app.access")
+    access_logger.filters.clear()
+    if access_sample_rate < 1.0:
+        access_logger.addFilter(SamplingFilter(access_sample_rate))
+
+    if mode != "queue":
+        for handler in handlers:
+            root.addHandler(handler)
+        return None
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    root.addHandler(queue_handler)
+    listener = BatchingQueueListener(log_queue, handlers)
+    listener.start()
+    atexit.register(listener.stop)
+
+    def restart_in_child():
+        # Threads do not survive fork (serve.py pre-forks workers): give the
+        # child a fresh queue and its own writer thread
+        fresh: queue.Queue = queue.Queue(-1)
+        queue_handler.queue = fresh
+        listener.queue = fresh
+        listener._thread = None
+        listener.start()
+
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=restart_in_child)
+    return listener
@@ -0,0 +1,60 @@
+"""Prometheus exposition rendered off the event loop and shared between scrapers."""
+import asyncio
+import gzip
+import time
+from typing import Callable, Optional
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+
+class CachedExposition:
+    """
+    Renders ``generate_latest(registry)`` in a worker thread and keeps the
+    bytes for ``ttl`` seconds, so scrapers arriving within that window (or
+    while a render is running) share a single render. The gzip variant is
+    compressed lazily, once per render.
+    """
+
+    def __init__(self, registry: CollectorRegistry, ttl: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.registry = registry
+        self.ttl = ttl
+        self._clock = clock
+        self._rendered_at = float("-inf")
+        self._body = b""
+        self._gzipped: Optional[bytes] = None
+        self._pending: Optional[asyncio.Future] = None
+
+    async def render(self, gzipped: bool = False) -> bytes:
+        if self._clock() - self._rendered_at >= self.ttl:
+            if self._pending is None:
+                self._pending = asyncio.ensure_future(self._render())
+            await asyncio.shield(self._pending)
+        body = self._body
+        if not gzipped:
+            return body
+        if self._gzipped is None:
+            compressed = await asyncio.to_thread(gzip.compress, body)
+            if self._body is body:  # no newer render landed meanwhile
+                self._gzipped = compressed
+            return compressed
+        return self._gzipped
+
+    def invalidate(self):
+        """Force the next scrape to render again"""
+        self._rendered_at = float("-inf")
+
+    async def _render(self):
+        try:
+            body = await asyncio.to_thread(generate_latest, self.registry)
+            self._body, self._gzipped, self._rendered_at = body, None, self._clock()
+        finally:
+            self._pending = None
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """True if the Accept-Encoding header allows gzip (and does not set q=0)"""
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() == "gzip":
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
@@ -0,0 +1,249 @@
+"""In-memory product repository with id, stock and price indexes."""
+import os
+import secrets
+from bisect import bisect_left, insort
+from itertools import count
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+
+class _SortedKeys:
+    """
+    Sorted list split into chunks of ~``load`` items (same idea as
+    sortedcontainers.SortedList), so add/remove only shift one small chunk
+    instead of the whole list.
+    """
+
+    def __init__(self, load: int = 1000):
+        self._load = load
+        self._chunks: List[list] = []
+        self._maxes: list = []
+
+    def __len__(self) -> int:
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def __iter__(self) -> Iterator:
+        for chunk in self._chunks:
+            yield from chunk
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._chunks[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._chunks[i], key)
+        if len(self._chunks[i]) > 2 * self._load:
+            chunk = self._chunks[i]
+            self._chunks[i:i + 1] = [chunk[:self._load], chunk[self._load:]]
+            self._maxes[i:i + 1] = [chunk[self._load - 1], chunk[-1]]
+
+    def remove(self, key):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return
+        chunk = self._chunks[i]
+        j = bisect_left(chunk, key)
+        if j == len(chunk) or chunk[j] != key:
+            return
+        del chunk[j]
+        if not chunk:
+            del self._chunks[i]
+            del self._maxes[i]
+        else:
+            self._maxes[i] = chunk[-1]
+
+    def irange(self, lo, hi) -> Iterator:
+        """Keys with lo <= key <= hi, in order"""
+        i = bisect_left(self._maxes, lo)
+        if i == len(self._maxes):
+            return
+        j = bisect_left(self._chunks[i], lo)
+        for chunk in self._chunks[i:]:
+            for key in chunk[j:]:
+                if key > hi:
+                    return
+                yield key
+            j = 0
+
+
+class ProductStore:
+    """
+    Products keyed by id, replacing the plain list that was scanned on every call.
+
+    - ``_by_id``: primary index, O(1) get / update / delete. Ids are handed out
+      by a monotonic counter and never reused.
+    - ``_id_order``: sorted ids, so a page ``id > after`` is found in O(log n)
+      (keyset pagination) instead of skipping ``offset`` rows.
+    - ``_by_stock``: sorted ids grouped by ``in_stock``.
+    - ``_by_price``: sorted ``(price, id)`` pairs for O(log n) range lookups.
+
+    ``version`` is bumped on every write so callers can cache derived data
+    (e.g. the serialized product list) and notice when it goes stale. Each
+    product also remembers the ``version`` of its last write (``revision``).
+    Together with ``epoch`` these make validators (ETags): ``epoch`` changes on
+    the first write in a new process, so forked serve.py workers whose copies
+    have diverged never hand out the same (epoch, version) for different data.
+    """
+
+    def __init__(self, products: Iterable[dict] = ()):
+        self._by_id: Dict[int, dict] = {}
+        self._id_order = _SortedKeys()
+        self._by_stock: Dict[bool, _SortedKeys] = {True: _SortedKeys(), False: _SortedKeys()}
+        self._by_price = _SortedKeys()
+        self._revisions: Dict[int, int] = {}
+        last_id = 0
+        for product in products:
+            self._insert(dict(product))
+            last_id = max(last_id, product["id"])
+        self._ids = count(last_id + 1)
+        self.version = 0
+        self.epoch = secrets.token_hex(4)
+        self._epoch_pid = os.getpid()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self._by_id.values())
+
+    def __contains__(self, product_id: int) -> bool:
+        return product_id in self._by_id
+
+    def get(self, product_id: int) -> Optional[dict]:
+        return self._by_id.get(product_id)
+
+    def revision(self, product_id: int) -> Optional[int]:
+        """``version`` of the last write to this product (0 = initial data)"""
+        return self._revisions.get(product_id)
+
+    def list(self) -> List[dict]:
+        return list(self._by_id.values())
+
+    def create(self, data: dict) -> dict:
+        product = {"id": next(self._ids), **data}
+        self._insert(product)
+        self._written([product["id"]])
+        return product
+
+    def update(self, product_id: int, changes: dict) -> Optional[dict]:
+        product = self._by_id.get(product_id)
+        if product is None:
+            return None
+        updated = self._replace(product, changes)
+        self._written([product_id])
+        return updated
+
+    def delete(self, product_id: int) -> Optional[dict]:
+        product = self._by_id.pop(product_id, None)
+        if product is not None:
+            self._id_order.remove(product_id)
+            self._unindex(product)
+            self._revisions.pop(product_id, None)
+            self._written([])
+        return product
+
+    def create_many(self, rows: Iterable[dict]) -> List[dict]:
+        """Create several products as one write (``version`` bumped once)"""
+        created = []
+        for data in rows:
+            product = {"id": next(self._ids), **data}
+            self._insert(product)
+            created.append(product)
+        if created:
+            self._written([product["id"] for product in created])
+        return created
+
+    def update_many(self, changes: Iterable[tuple]) -> List[Optional[dict]]:
+        """Apply ``(product_id, changes)`` pairs as one write; None for unknown ids"""
+        changes = list(changes)
+        # Check every new record first, so a bad item leaves the whole batch unapplied
+        for product_id, data in changes:
+            if product_id in self._by_id:
+                self._price_key({**self._by_id[product_id], **data})
+        updated = []
+        for product_id, data in changes:
+            product = self._by_id.get(product_id)
+            updated.append(None if product is None else self._replace(product, data))
+        if any(product is not None for product in updated):
+            self._written([product["id"] for product in updated if product is not None])
+        return updated
+
+    def delete_many(self, product_ids: Iterable[int]) -> List[Optional[dict]]:
+        """Delete several ids as one write; None for ids that were not there"""
+        deleted = []
+        for product_id in product_ids:
+            product = self._by_id.pop(product_id, None)
+            if product is not None:
+                self._id_order.remove(product_id)
+                self._unindex(product)
+                self._revisions.pop(product_id, None)
+            deleted.append(product)
+        if any(product is not None for product in deleted):
+            self._written([])
+        return deleted
+
+    def page(self, after: Optional[int] = None, limit: int = 100,
+             where: Optional[Callable[[dict], bool]] = None) -> List[dict]:
+        """Up to ``limit`` products with id > after (and matching ``where``), in id order"""
+        rows = []
+        if limit <= 0:
+            return rows
+        for product_id in self._id_order.irange(0 if after is None else after + 1, float("inf")):
+            product = self._by_id[product_id]
+            if where is None or where(product):
+                rows.append(product)
+                if len(rows) == limit:
+                    break
+        return rows
+
+    def by_stock(self, in_stock: bool) -> List[dict]:
+        return [self._by_id[i] for i in self._by_stock[in_stock]]
+
+    def by_price(self, min_price: Optional[float] = None, max_price: Optional[float] = None) -> List[dict]:
+        """Products with min_price <= price <= max_price, cheapest first"""
+        lo = (float("-inf") if min_price is None else min_price, 0)
+        hi = (float("inf") if max_price is None else max_price, float("inf"))
+        return [self._by_id[product_id] for _, product_id in self._by_price.irange(lo, hi)]
+
+    def _written(self, product_ids: List[int]):
+        if self._epoch_pid != os.getpid():
+            self.epoch, self._epoch_pid = secrets.token_hex(4), os.getpid()
+        self.version += 1
+        for product_id in product_ids:
+            self._revisions[product_id] = self.version
+
+    def _insert(self, product: dict):
+        self._by_id[product["id"]] = product
+        self._revisions[product["id"]] = 0
+        self._id_order.add(product["id"])
+        self._index(product)
+
+    def _replace(self, product: dict, changes: dict) -> dict:
+        """Swap in ``product`` + ``changes``; raises before touching any index if the new record is invalid"""
+        updated = {**product, **changes}
+        self._price_key(updated)
+        self._unindex(product)
+        self._by_id[product["id"]] = updated
+        self._index(updated)
+        return updated
+
+    @staticmethod
+    def _price_key(product: dict) -> tuple:
+        price = product.get("price")
+        if isinstance(price, bool) or not isinstance(price, (int, float)):
+            raise ValueError(f"Product {product['id']}: price must be a number, got {price!r}")
+        return price, product["id"]
+
+    def _index(self, product: dict):
+        price_key = self._price_key(product)
+        self._by_stock[bool(product.get("in_stock", True))].add(product["id"])
+        self._by_price.add(price_key)
+
+    def _unindex(self, product: dict):
+        self._by_stock[bool(product.get("in_stock", True))].remove(product["id"])
+        self._by_price.remove((product["price"], product["id"]))
@@ -0,0 +1,169 @@
+"""
+Host-local shared rate limit storage for ``limits`` / slowapi.
+
+Registers the ``shm://`` scheme: counters live in one SQLite file (by default
+in /dev/shm) shared by every worker process on the host, so
+``@limiter.limit("50/minute")`` means 50 per minute for the whole host, not
+50 per worker. Each process leases tokens from the shared counter in batches
+and spends them locally, so most checks are a dict lookup instead of a
+database round-trip.
+
+    storage_uri="shm://"                        # default file, one per PORT
+    storage_uri="shm:///dev/shm/api-limits.db"  # explicit file
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import weakref
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from limits.storage import Storage
+
+DEFAULT_SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def default_path(instance: Optional[str] = None) -> str:
+    """Default counter file, one per instance (PORT): apps on the same host never share or reset each other's counters"""
+    return os.path.join(DEFAULT_SHM_DIR, f"lesson10-ratelimit-{instance or os.getenv('PORT', '8000')}.sqlite")
+
+
+class _Lease:
+    __slots__ = ("window_end", "base", "granted", "used")
+
+    def __init__(self, window_end: float, base: int, granted: int):
+        self.window_end = window_end
+        self.base = base        # shared count before this lease was taken
+        self.granted = granted  # tokens reserved for this process
+        self.used = 0
+
+
+class SharedMemoryStorage(Storage):
+    """
+    Fixed-window counters in a shared SQLite file plus a per-process token
+    lease cache.
+
+    ``incr`` never lets the shared count exceed the limit: a process only
+    spends tokens it reserved with ``BEGIN IMMEDIATE`` (an exclusive, host-wide
+    lock). Tokens left unspent in a lease when the window rolls over are
+    simply lost, so the error is always on the side of admitting fewer
+    requests, never more. Lease size shrinks as the window fills up.
+
+    The limit is read from the key built by ``RateLimitItem.key_for``
+    (``.../<amount>/<multiples>/<granularity>``); keys without it fall back
+    to a plain shared counter.
+    """
+
+    STORAGE_SCHEME = ["shm"]
+
+    def __init__(self, uri: str = "shm://", wrap_exceptions: bool = False, batch_size: int = 10, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        parsed = urlparse(uri)
+        self.path = parsed.path or default_path()
+        query = parse_qs(parsed.query)
+        self.batch_size = int(query.get("batch", [batch_size])[0])
+        self._connect()
+        if hasattr(os, "register_at_fork"):
+            # A SQLite connection must not be shared with a forked child (serve.py workers)
+            ref = weakref.WeakMethod(self._connect)
+            os.register_at_fork(after_in_child=lambda: ref() and ref()())
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._leases: Dict[str, _Lease] = {}
+        self._conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        limit = _limit_from_key(key)
+        with self._lock:
+            now = time.time()
+            lease = self._leases.get(key)
+            if lease is not None and lease.window_end > now and lease.used + amount <= lease.granted:
+                lease.used += amount  # fast path: no shared state touched
+                return lease.base + lease.used
+            return self._sync(key, expiry, amount, limit, now)
+
+    def _sync(self, key: str, expiry: int, amount: int, limit: Optional[int], now: float) -> int:
+        """Reserve a new batch of tokens from the shared counter"""
+        self._leases.pop(key, None)
+        with self._transaction() as cur:
+            row = cur.execute("SELECT value, expires_at FROM counters WHERE key = ?", (key,)).fetchone()
+            count, window_end = row if row and row[1] > now else (0, now + expiry)
+            if limit is None:
+                count += amount
+                cur.execute("REPLACE INTO counters VALUES (?, ?, ?)", (key, count, window_end))
+                return count
+            remaining = limit - count
+            if remaining < amount:
+                return limit + 1  # over the limit, nothing reserved
+            granted = min(remaining, max(amount, min(self.batch_size, remaining // 2)))
+            cur.execute("REPLACE INTO counters VALUES (?, ?, ?)", (key, count + granted, window_end))
+        lease = _Lease(window_end, count, granted)
+        lease.used = amount
+        self._leases[key] = lease
+        return count + amount
+
+    def get(self, key: str) -> int:
+        """Tokens taken from the shared counter (including unspent leases)"""
+        row = self._conn.execute(
+            "SELECT value FROM counters WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        row = self._conn.execute(
+            "SELECT expires_at FROM counters WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self) -> bool:
+        try:
+            self._conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        with self._lock, self._transaction() as cur:
+            self._leases.clear()
+            return cur.execute("DELETE FROM counters").rowcount
+
+    def clear(self, key: str) -> None:
+        with self._lock, self._transaction() as cur:
+            self._leases.pop(key, None)
+            cur.execute("DELETE FROM counters WHERE key = ?", (key,))
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT: takes the write lock up front so read-modify-write is atomic across processes"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Cursor:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn.cursor()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _limit_from_key(key: str) -> Optional[int]:
+    parts = key.rsplit("/", 3)
+    if len(parts) == 4 and parts[1].isdigit():
+        return int(parts[1])
+    return None
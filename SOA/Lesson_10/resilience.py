@@ -0,0 +1,499 @@
+"""Resilience helpers for outbound calls (circuit breaker, bulkhead, deadlines and hedging for async code)."""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Awaitable, Callable, Deque, Optional, Sequence, Type
+
+import pybreaker
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Same state names as pybreaker, so callers can keep comparing against them
+STATE_CLOSED = pybreaker.STATE_CLOSED
+STATE_OPEN = pybreaker.STATE_OPEN
+STATE_HALF_OPEN = pybreaker.STATE_HALF_OPEN
+STATES = (STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN)
+
+
+class _Bucket:
+    __slots__ = ("second", "calls", "failures", "slow")
+
+    def __init__(self, second: int):
+        self.second = second
+        self.calls = 0
+        self.failures = 0
+        self.slow = 0
+
+
+class AdaptiveCircuitBreaker:
+    """
+    Circuit breaker for async callables, driven by the failure *rate* over a
+    sliding time window instead of a count of consecutive failures.
+
+    - closed: outcomes go into one-second buckets covering the last
+      ``window_seconds``. Once the window holds ``minimum_calls`` calls and
+      ``failure_rate_threshold`` of them failed, the breaker opens. A call
+      slower than ``slow_call_seconds`` counts as a failure even if it
+      returned a result.
+    - open: calls fail fast with ``pybreaker.CircuitBreakerError`` for
+      ``open_seconds``, doubled on every trip in a row (up to
+      ``max_open_seconds``), so a dead upstream is probed less and less often.
+    - half-open: at most ``half_open_max_calls`` probes run at once, everyone
+      else is still rejected. One failed probe opens the breaker again;
+      ``half_open_max_calls`` successful probes close it.
+
+    Exceptions in ``exclude`` are the caller's problem, not the upstream's:
+    they pass through and count as successes. Calls that finish after the
+    state changed under them are not recorded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        window_seconds: int = 30,
+        minimum_calls: int = 5,
+        slow_call_seconds: float = 2.0,
+        open_seconds: float = 30.0,
+        max_open_seconds: float = 300.0,
+        half_open_max_calls: int = 3,
+        exclude: Sequence[Type[BaseException]] = (),
+        registry: Optional[CollectorRegistry] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.window_seconds = window_seconds
+        self.minimum_calls = minimum_calls
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.exclude = tuple(exclude)
+        self._clock = clock
+
+        self._state = STATE_CLOSED
+        self._buckets: deque = deque()
+        self._calls = self._failures = self._slow = 0
+        self._trips = 0  # consecutive openings without a close in between
+        self.opened_at: Optional[float] = None
+        self.open_until = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+        self.state_gauge = Gauge(
+            'circuit_breaker_state',
+            'Circuit breaker state (1 for the current one)',
+            ['breaker', 'state'],
+            registry=registry
+        )
+        self.transitions = Counter(
+            'circuit_breaker_transitions_total',
+            'Circuit breaker state changes, by new state',
+            ['breaker', 'state'],
+            registry=registry
+        )
+        self.outcomes = Counter(
+            'circuit_breaker_calls_total',
+            'Calls through the circuit breaker, by outcome',
+            ['breaker', 'outcome'],
+            registry=registry
+        )
+        self.failure_rate_gauge = Gauge(
+            'circuit_breaker_failure_rate',
+            'Failure rate (failed + slow calls) over the sliding window',
+            ['breaker'],
+            registry=registry
+        )
+        self._publish_state()
+
+    @property
+    def current_state(self) -> str:
+        return self._state
+
+    @property
+    def failure_rate(self) -> float:
+        self._expire(self._clock())
+        return self._failures / self._calls if self._calls else 0.0
+
+    def snapshot(self) -> dict:
+        """Window counters, for status endpoints and tests"""
+        rate = self.failure_rate
+        return {
+            "state": self._state,
+            "calls": self._calls,
+            "failures": self._failures,
+            "slow_calls": self._slow,
+            "failure_rate": round(rate, 4),
+            "open_for_seconds": round(max(self.open_until - self._clock(), 0.0), 3) if self._state == STATE_OPEN else 0.0,
+        }
+
+    def reset(self):
+        """Back to closed with an empty window"""
+        self._clear_window()
+        self._trips = 0
+        self._transition(STATE_CLOSED)
+
+    async def call(self, func, *args, **kwargs):
+        probe = self._admit()
+        start = self._clock()
+        try:
+            result = await func(*args, **kwargs)
+        except self.exclude:
+            self._record(failed=False, slow=False, probe=probe)
+            raise
+        except Exception:
+            self._record(failed=True, slow=False, probe=probe)
+            raise
+        except BaseException:
+            # Cancelled: says nothing about the upstream, just free the probe slot
+            if probe:
+                self._probes_in_flight -= 1
+            raise
+        slow = self._clock() - start > self.slow_call_seconds
+        self._record(failed=slow, slow=slow, probe=probe)
+        return result
+
+    def __call__(self, func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.call(func, *args, **kwargs)
+        return wrapper
+
+    def _admit(self) -> bool:
+        """Returns True if this call is a half-open probe; raises while open"""
+        if self._state == STATE_OPEN:
+            if self._clock() < self.open_until:
+                self.outcomes.labels(breaker=self.name, outcome="rejected").inc()
+                raise pybreaker.CircuitBreakerError("Circuit breaker open, upstream calls suspended")
+            self._transition(STATE_HALF_OPEN)
+        if self._state == STATE_HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_max_calls:
+                self.outcomes.labels(breaker=self.name, outcome="rejected").inc()
+                raise pybreaker.CircuitBreakerError("Circuit breaker half-open, probe limit reached")
+            self._probes_in_flight += 1
+            return True
+        return False
+
+    def _record(self, failed: bool, slow: bool, probe: bool):
+        self.outcomes.labels(breaker=self.name, outcome="slow" if slow else "failure" if failed else "success").inc()
+        if probe:
+            self._probes_in_flight -= 1
+            if self._state != STATE_HALF_OPEN:
+                return
+            if failed:
+                self._open()
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_max_calls:
+                    self.reset()
+            return
+        if self._state != STATE_CLOSED:
+            return  # started while closed, finished after the breaker moved on
+
+        now = self._clock()
+        self._expire(now)
+        second = int(now)
+        if not self._buckets or self._buckets[-1].second != second:
+            self._buckets.append(_Bucket(second))
+        bucket = self._buckets[-1]
+        bucket.calls += 1
+        self._calls += 1
+        if failed:
+            bucket.failures += 1
+            self._failures += 1
+        if slow:
+            bucket.slow += 1
+            self._slow += 1
+        rate = self._failures / self._calls
+        self.failure_rate_gauge.labels(breaker=self.name).set(rate)
+        if self._calls >= self.minimum_calls and rate >= self.failure_rate_threshold:
+            self._open()
+
+    def _expire(self, now: float):
+        oldest = int(now) - self.window_seconds
+        while self._buckets and self._buckets[0].second <= oldest:
+            bucket = self._buckets.popleft()
+            self._calls -= bucket.calls
+            self._failures -= bucket.failures
+            self._slow -= bucket.slow
+
+    def _clear_window(self):
+        self._buckets.clear()
+        self._calls = self._failures = self._slow = 0
+        self.failure_rate_gauge.labels(breaker=self.name).set(0)
+
+    def _open(self):
+        self._trips += 1
+        open_for = min(self.open_seconds * 2 ** (self._trips - 1), self.max_open_seconds)
+        self.opened_at = self._clock()
+        self.open_until = self.opened_at + open_for
+        logger.warning(f"Circuit breaker {self.name} opened for {open_for:g}s (trip {self._trips}, failure rate {self._failures}/{self._calls})")
+        self._clear_window()
+        self._transition(STATE_OPEN)
+
+    def _transition(self, state: str):
+        if state == STATE_HALF_OPEN:
+            # Probes still in flight from an earlier half-open decrement the count when they finish
+            self._probe_successes = 0
+        if state != self._state:
+            self.transitions.labels(breaker=self.name, state=state).inc()
+        self._state = state
+        self._publish_state()
+
+    def _publish_state(self):
+        for state in STATES:
+            self.state_gauge.labels(breaker=self.name, state=state).set(1 if state == self._state else 0)
+
+
+class BulkheadFullError(Exception):
+    """Raised instead of waiting when the bulkhead's queue is full (or the wait timed out)"""
+
+
+class Bulkhead:
+    """
+    Caps concurrent calls at ``max_concurrent``. Up to ``max_queue`` more
+    wait in FIFO order, for at most ``queue_timeout`` seconds; anything
+    beyond that is rejected at once with ``BulkheadFullError`` so the caller
+    can fall back instead of piling up sockets and tasks.
+
+    Put it outside the circuit breaker: an open breaker then frees the slot
+    immediately, and rejections here are never counted as upstream failures.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int = 50,
+        max_queue: int = 100,
+        queue_timeout: Optional[float] = 1.0,
+        registry: Optional[CollectorRegistry] = None,
+    ):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        self.in_flight_gauge = Gauge(
+            'bulkhead_in_flight',
+            'Calls currently running inside the bulkhead',
+            ['bulkhead'],
+            registry=registry
+        )
+        self.queue_depth_gauge = Gauge(
+            'bulkhead_queue_depth',
+            'Calls waiting for a bulkhead slot',
+            ['bulkhead'],
+            registry=registry
+        )
+        self.rejections = Counter(
+            'bulkhead_rejected_total',
+            'Calls rejected by the bulkhead',
+            ['bulkhead', 'reason'],
+            registry=registry
+        )
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self._in_flight < self.max_concurrent and not self._waiters:
+            self._in_flight += 1
+            self._publish()
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejections.labels(bulkhead=self.name, reason="queue_full").inc()
+            raise BulkheadFullError(f"Bulkhead {self.name} full ({self._in_flight} running, {len(self._waiters)} queued)")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._publish()
+        try:
+            # release() hands its slot straight to the first waiter, so
+            # _in_flight is already counted for us when this returns
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # got the slot just as the timeout fired
+            self.rejections.labels(bulkhead=self.name, reason="timeout").inc()
+            raise BulkheadFullError(f"Bulkhead {self.name}: no slot within {self.queue_timeout}s") from None
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # got the slot just as we were cancelled
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._publish()
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._publish()
+                return
+        self._in_flight -= 1
+        self._publish()
+
+    async def call(self, func, *args, **kwargs):
+        await self.acquire()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            self.release()
+
+    def __call__(self, func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.call(func, *args, **kwargs)
+        return wrapper
+
+    def _publish(self):
+        self.in_flight_gauge.labels(bulkhead=self.name).set(self._in_flight)
+        self.queue_depth_gauge.labels(bulkhead=self.name).set(len(self._waiters))
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """The caller's own (client supplied) deadline ran out; says nothing about the upstream"""
+
+
+class Deadline:
+    """Point in (monotonic) time by which the current request must be answered"""
+
+    def __init__(self, budget: float, client_supplied: bool = False, clock: Callable[[], float] = time.monotonic):
+        self.budget = budget
+        self.client_supplied = client_supplied
+        self._clock = clock
+        self.expires_at = clock() + budget
+
+    def remaining(self) -> float:
+        return max(self.expires_at - self._clock(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+# Deadline of the request being served; tasks started from it (e.g. cache loads) inherit it
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+class Hedger:
+    """
+    Hedged requests: if the first attempt has not answered after the observed
+    ``quantile`` latency (p95 by default), a second identical attempt is
+    started and whichever succeeds first wins; the other is cancelled.
+
+    Only successful latencies feed the estimate, and no hedge is sent until
+    ``min_samples`` of them were seen. Hedges are paid for from a token
+    bucket refilled by ``max_ratio`` per call, so at most ~10% extra load
+    reaches the upstream even when it is slow across the board.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        quantile: float = 0.95,
+        min_delay: float = 0.01,
+        max_ratio: float = 0.1,
+        min_samples: int = 20,
+        window: int = 1000,
+        registry: Optional[CollectorRegistry] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self._clock = clock
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._since_sorted = 0
+        self._delay: Optional[float] = None
+        self._tokens = 1.0
+
+        self.calls = Counter(
+            'hedge_calls_total',
+            'Calls eligible for hedging',
+            ['hedger'],
+            registry=registry
+        )
+        self.hedges = Counter(
+            'hedge_requests_total',
+            'Hedge attempts sent (hedge rate = hedge_requests_total / hedge_calls_total)',
+            ['hedger'],
+            registry=registry
+        )
+        self.wins = Counter(
+            'hedge_wins_total',
+            'Calls answered by the hedge attempt (win rate = hedge_wins_total / hedge_requests_total)',
+            ['hedger'],
+            registry=registry
+        )
+        self.delay_gauge = Gauge(
+            'hedge_delay_seconds',
+            'Current hedge delay (observed latency quantile)',
+            ['hedger'],
+            registry=registry
+        )
+
+    def delay(self) -> Optional[float]:
+        """Hedge delay, or None while there are too few samples"""
+        if len(self._samples) < self.min_samples:
+            return None
+        # Re-sort every ~5% of the window instead of on every call
+        if self._delay is None or self._since_sorted >= max(len(self._samples) // 20, 1):
+            ordered = sorted(self._samples)
+            self._delay = max(ordered[min(int(len(ordered) * self.quantile), len(ordered) - 1)], self.min_delay)
+            self._since_sorted = 0
+            self.delay_gauge.labels(hedger=self.name).set(self._delay)
+        return self._delay
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self._since_sorted += 1
+
+    async def call(self, attempt: Callable[[float], Awaitable[Any]], timeout: float) -> Any:
+        """Run ``attempt(timeout_left)``, hedging it once if it is slow"""
+        self.calls.labels(hedger=self.name).inc()
+        self._tokens = min(self._tokens + self.max_ratio, 10.0)
+        start = self._clock()
+        primary = asyncio.ensure_future(attempt(timeout))
+        tasks = [primary]
+        try:
+            delay = self.delay()
+            if delay is not None and delay < timeout and self._tokens >= 1:
+                await asyncio.wait(tasks, timeout=delay)
+                if not primary.done():
+                    self._tokens -= 1
+                    self.hedges.labels(hedger=self.name).inc()
+                    tasks.append(asyncio.ensure_future(attempt(max(timeout - (self._clock() - start), 0.0))))
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in tasks if task in done and task.exception() is None]
+                if succeeded:
+                    winner = succeeded[0]
+                    break
+                if not pending:
+                    return primary.result()  # every attempt failed: raise the primary's error
+            self.observe(self._clock() - start)
+            if winner is not primary:
+                self.wins.labels(hedger=self.name).inc()
+            return winner.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
@@ -0,0 +1,143 @@
+"""
+Production launcher for app.py.
+
+Imports the app once, then pre-forks N uvicorn workers that share the
+listening socket (and, copy-on-write, the already imported code and data).
+SIGTERM / Ctrl+C makes every worker stop accepting, finish in-flight
+requests (up to --graceful-timeout seconds) and exit.
+
+Each worker keeps its own products_db, ETag epoch and enrichment cache
+(only the rate-limit counters are shared), so a product created on one
+worker is unknown to the others. WORKERS therefore defaults to 1; raise it
+only for read-only load or once the store is shared.
+
+    python serve.py                       # WORKERS workers (default: 1)
+    python serve.py --workers 4 --port 8000
+    python serve.py --reload              # development: single process, auto-reload
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import sys
+import traceback
+
+import uvicorn
+
+logger = logging.getLogger("serve")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "1")),
+                        help="Worker processes; each has its own in-memory product store")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="Seconds to drain in-flight requests on shutdown")
+    parser.add_argument("--reload", action="store_true", default=os.getenv("RELOAD", "False").lower() == "true",
+                        help="Auto-reload on code changes (single process, development only)")
+    return parser.parse_args(argv)
+
+
+class Supervisor:
+    """Forks the workers, restarts any that die, forwards shutdown to all of them"""
+
+    def __init__(self, config: uvicorn.Config, sock, workers: int):
+        self.config = config
+        self.sock = sock
+        self.workers = workers
+        self.children = set()
+        self.should_exit = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_exit)
+        signal.signal(signal.SIGINT, self.handle_exit)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.children:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            self.children.discard(pid)
+            if not self.should_exit:
+                logger.warning(f"Worker {pid} exited unexpectedly, starting a new one")
+                self.spawn()
+        logger.info("All workers stopped")
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children.add(pid)
+            return
+
+        # Child: own process group so a terminal Ctrl+C reaches only the
+        # supervisor, which then sends exactly one SIGTERM (uvicorn treats a
+        # second signal as "force exit" and would skip the drain)
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            uvicorn.Server(self.config).run(sockets=[self.sock])
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            logging.shutdown()
+            os._exit(code)
+
+    def handle_exit(self, signum, frame):
+        if self.should_exit:
+            return
+        self.should_exit = True
+        logger.info(f"Received {signal.Signals(signum).name}, draining {len(self.children)} workers")
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The shm:// rate limit storage picks its default file by PORT when app.py is imported
+    os.environ["PORT"] = str(args.port)
+
+    if args.reload:
+        uvicorn.run("app:app", host=args.host, port=args.port, reload=True, log_config=None)
+        return
+
+    # Import before forking: every worker shares these pages copy-on-write
+    import app as app_module
+
+    config = uvicorn.Config(
+        app_module.app,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="auto",  # uvloop when installed
+        http="auto",  # httptools when installed
+        log_config=None,  # keep the app's logging setup
+        access_log=False,  # MetricsMiddleware already writes access lines
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+
+    if args.workers <= 1 or not hasattr(os, "fork"):
+        # No fork on Windows: run a single worker in this process
+        uvicorn.Server(config).run()
+        return
+
+    sock = config.bind_socket()
+    logger.info(f"Starting {args.workers} workers on {args.host}:{args.port}")
+    # Keep the imported objects out of GC passes so the workers do not dirty the shared pages
+    gc.freeze()
+    Supervisor(config, sock, args.workers).run()
+    sock.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
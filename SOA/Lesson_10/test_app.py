@@ -0,0 +1,968 @@
+"""In-process tests for app.py (no running server or internet needed)"""
+import asyncio
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import tempfile
+import time
+
+import httpx
+import pybreaker
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from limits import parse
+from limits.strategies import FixedWindowRateLimiter
+
+# Must be set before app.py is imported: test runs neither append to app.log nor
+# share (and reset) rate limit counters with a server running on this host
+_scratch = tempfile.mkdtemp()
+os.environ.setdefault("LOG_FILE", os.path.join(_scratch, "app.log"))
+os.environ.setdefault("REDIS_URL", f"shm://{os.path.join(_scratch, 'ratelimit.sqlite')}")
+
+import app as app_module
+import loadtest
+import metrics_exposition
+from compression import choose_encoding
+from enrichment_refresher import EnrichmentRefresher, FrequencySketch
+from health import HealthProbeMiddleware
+from logging_setup import BatchingQueueListener, JsonFormatter, SamplingFilter
+from prometheus_client import CollectorRegistry
+from ratelimit_storage import SharedMemoryStorage
+from resilience import (STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, AdaptiveCircuitBreaker, Bulkhead, BulkheadFullError,
+                        Hedger)
+
+
+def stub_upstream(delay: float = 0.0, status_code: int = 200):
+    """Local stand-in for jsonplaceholder, returning a fake post per id"""
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        if delay:
+            await asyncio.sleep(delay)
+        post_id = int(request.url.path.rsplit("/", 1)[-1])
+        return httpx.Response(status_code, json={"id": post_id, "title": f"post {post_id}"})
+
+    client = httpx.AsyncClient(base_url="http://upstream.test", transport=httpx.MockTransport(handler))
+    return client, calls
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    app_module.limiter.reset()
+    app_module.external_api_breaker.reset()
+    app_module.enrichment_cache.clear()
+    app_module.metrics_exposition.invalidate()
+    yield
+    app_module.http_client = None
+
+
+@pytest.fixture
+def client():
+    with TestClient(app_module.app) as c:
+        yield c
+
+
+def test_product_enriched_from_upstream(client):
+    app_module.http_client, calls = stub_upstream()
+
+    response = client.get("/products/1")
+
+    assert response.status_code == 200
+    assert response.json()["name"] == "Laptop"
+    assert response.json()["external_info"] == {"title": "post 1", "rating": 4.5}
+    assert calls == ["/posts/1"]
+
+
+def test_slow_upstream_does_not_block_event_loop():
+    app_module.http_client, calls = stub_upstream(delay=0.2)
+
+    async def run():
+        start = time.perf_counter()
+        await asyncio.gather(*(app_module.get_external_data(i) for i in range(1, 11)))
+        return time.perf_counter() - start
+
+    # 10 calls of 0.2s each must overlap instead of running back to back
+    assert asyncio.run(run()) < 1.0
+    assert len(calls) == 10
+
+
+def test_deadline_counts_as_breaker_failure(client):
+    app_module.http_client, _ = stub_upstream(delay=1.0)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(app_module.get_external_data(1, timeout=0.05))
+    assert app_module.external_api_breaker.snapshot()["failures"] == 1
+
+
+def test_breaker_opens_and_short_circuits(client):
+    app_module.http_client, calls = stub_upstream(status_code=500)
+
+    for _ in range(app_module.BREAKER_MINIMUM_CALLS):
+        app_module.enrichment_cache.clear()  # skip negative caching, hit the upstream each time
+        assert client.get("/products/1").status_code == 200
+    assert app_module.external_api_breaker.current_state == pybreaker.STATE_OPEN
+
+    # Open breaker: the product is still served, upstream is not called again
+    app_module.enrichment_cache.clear()
+    assert client.get("/products/1").status_code == 200
+    assert len(calls) == app_module.BREAKER_MINIMUM_CALLS
+
+    status = client.post("/test/circuit-breaker/reset").json()
+    assert status["circuit_breaker_state"] == "closed" and status["window"]["calls"] == 0
+
+
+def test_circuit_breaker_test_route(client):
+    response = client.get("/test/circuit-breaker")
+
+    assert response.status_code == 200
+    status = response.json()
+    assert status["result"] == {"error": "Simulated circuit breaker failure"}
+    assert status["circuit_breaker_state"] == "closed" and status["fail_count"] == 1
+
+
+def make_breaker(now, **options):
+    options = {"failure_rate_threshold": 0.5, "window_seconds": 10, "minimum_calls": 4, "slow_call_seconds": 1.0,
+               "open_seconds": 5, "max_open_seconds": 20, "half_open_max_calls": 2, **options}
+    return AdaptiveCircuitBreaker("test", registry=CollectorRegistry(), clock=lambda: now[0], **options)
+
+
+async def outcome(breaker, now, fail=False, took=0.0):
+    async def call():
+        now[0] += took
+        if fail:
+            raise RuntimeError("upstream down")
+        return "ok"
+    try:
+        return await breaker.call(call)
+    except RuntimeError:
+        return "failed"
+    except pybreaker.CircuitBreakerError:
+        return "rejected"
+
+
+def test_breaker_trips_on_failure_rate_in_window():
+    now = [100.0]
+    breaker = make_breaker(now)
+
+    async def run():
+        # 2 failures in 6 calls (33%) stays closed; old failures slide out of the window
+        for fail in (True, False, False, False, True, False):
+            await outcome(breaker, now, fail)
+        assert breaker.current_state == STATE_CLOSED
+        now[0] += 11
+        assert breaker.snapshot()["calls"] == 0
+
+        # A slow success counts as a failure: 2 slow + 1 failure of 4 calls
+        await outcome(breaker, now, took=1.5)
+        await outcome(breaker, now)
+        await outcome(breaker, now, took=1.5)
+        assert breaker.current_state == STATE_CLOSED  # below minimum_calls
+        await outcome(breaker, now, fail=True)
+        assert breaker.current_state == STATE_OPEN
+        assert await outcome(breaker, now) == "rejected"
+
+    asyncio.run(run())
+    samples = {(s.name, tuple(sorted(s.labels.items()))): s.value for m in breaker.outcomes.collect() for s in m.samples}
+    assert samples[("circuit_breaker_calls_total", (("breaker", "test"), ("outcome", "slow")))] == 2
+    assert samples[("circuit_breaker_calls_total", (("breaker", "test"), ("outcome", "rejected")))] == 1
+
+
+def test_breaker_half_open_probes_and_backoff():
+    now = [0.0]
+    breaker = make_breaker(now, minimum_calls=2)
+
+    async def run():
+        for _ in range(2):
+            await outcome(breaker, now, fail=True)
+        assert breaker.open_until == 5
+
+        # Only half_open_max_calls probes at once; a failed probe reopens for twice as long
+        now[0] = 5
+        gate = asyncio.Event()
+
+        async def slow_probe():
+            await gate.wait()
+            raise RuntimeError("still down")
+
+        probes = [asyncio.ensure_future(breaker.call(slow_probe)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert breaker.current_state == STATE_HALF_OPEN
+        assert await outcome(breaker, now) == "rejected"
+        gate.set()
+        await asyncio.gather(*probes, return_exceptions=True)
+        assert breaker.current_state == STATE_OPEN and breaker.open_until == 5 + 10
+
+        # Enough successful probes close it and reset the backoff
+        now[0] = 15
+        assert [await outcome(breaker, now) for _ in range(2)] == ["ok", "ok"]
+        assert breaker.current_state == STATE_CLOSED
+        for _ in range(2):
+            await outcome(breaker, now, fail=True)
+        assert breaker.open_until == now[0] + 5
+
+    asyncio.run(run())
+    states = {s.labels["state"]: s.value for m in breaker.state_gauge.collect() for s in m.samples}
+    assert states == {STATE_CLOSED: 0, STATE_OPEN: 1, STATE_HALF_OPEN: 0}
+
+
+def test_bulkhead_queues_then_rejects():
+    bulkhead = Bulkhead("test", max_concurrent=2, max_queue=1, queue_timeout=0.05, registry=CollectorRegistry())
+    gate = asyncio.Event()
+    order = []
+
+    async def call(name):
+        order.append(name)
+        await gate.wait()
+        return name
+
+    async def run():
+        running = [asyncio.ensure_future(bulkhead.call(call, name)) for name in ("a", "b", "c")]
+        await asyncio.sleep(0)
+        assert (bulkhead.in_flight, bulkhead.queue_depth) == (2, 1)
+        # Queue full: rejected at once, without waiting
+        with pytest.raises(BulkheadFullError):
+            await bulkhead.call(call, "d")
+
+        # The queued call gets the first freed slot
+        gate.set()
+        assert await asyncio.gather(*running) == ["a", "b", "c"]
+        assert order == ["a", "b", "c"] and bulkhead.in_flight == 0
+
+        # A queued call gives up after queue_timeout
+        gate.clear()
+        running = [asyncio.ensure_future(bulkhead.call(call, name)) for name in ("a", "b")]
+        await asyncio.sleep(0)
+        with pytest.raises(BulkheadFullError):
+            await bulkhead.call(call, "late")
+        assert bulkhead.queue_depth == 0
+        gate.set()
+        await asyncio.gather(*running)
+        assert bulkhead.in_flight == 0
+
+    asyncio.run(run())
+    rejected = {s.labels["reason"]: s.value for m in bulkhead.rejections.collect() for s in m.samples if s.name == "bulkhead_rejected_total"}
+    assert rejected == {"queue_full": 1, "timeout": 1}
+
+
+def test_bulkhead_slot_granted_at_timeout_is_not_leaked(monkeypatch):
+    bulkhead = Bulkhead("test", max_concurrent=1, max_queue=1, queue_timeout=0.05, registry=CollectorRegistry())
+
+    async def granted_as_timeout_fires(waiter, timeout):
+        bulkhead.release()  # the running call hands its slot to the queued waiter...
+        raise asyncio.TimeoutError  # ...in the same instant its queue_timeout expires
+
+    async def run():
+        await bulkhead.acquire()
+        monkeypatch.setattr(asyncio, "wait_for", granted_as_timeout_fires)
+        with pytest.raises(BulkheadFullError):
+            await bulkhead.acquire()
+        monkeypatch.undo()
+        return bulkhead.in_flight
+
+    assert asyncio.run(run()) == 0
+
+
+def test_full_bulkhead_falls_back_without_tripping_breaker(client, monkeypatch):
+    app_module.http_client, calls = stub_upstream()
+    monkeypatch.setattr(app_module.external_api_bulkhead, "max_concurrent", 0)
+    monkeypatch.setattr(app_module.external_api_bulkhead, "max_queue", 0)
+
+    for _ in range(app_module.BREAKER_MINIMUM_CALLS):
+        response = client.get("/products/1")
+        assert response.status_code == 200
+        assert response.json()["external_info"] == {"error": "External service busy"}
+    assert calls == []
+    assert app_module.external_api_breaker.snapshot()["calls"] == 0
+
+    # Rejections are not negatively cached: the next call goes through
+    monkeypatch.undo()
+    assert client.get("/products/1").json()["external_info"] == {"title": "post 1", "rating": 4.5}
+
+
+def test_client_deadline_propagates_and_is_not_held_against_upstream(client, monkeypatch):
+    sent = []
+
+    async def handler(request: httpx.Request):
+        sent.append(int(request.headers[app_module.DEADLINE_HEADER]))
+        await asyncio.sleep(0.5)
+        return httpx.Response(200, json={"title": "late"})
+
+    app_module.http_client = httpx.AsyncClient(base_url="http://upstream.test", transport=httpx.MockTransport(handler))
+
+    start = time.perf_counter()
+    response = client.get("/products/1", headers={app_module.DEADLINE_HEADER: "50"})
+    assert time.perf_counter() - start < 0.4
+    assert response.json()["external_info"] == {"error": "External service timeout"}
+    assert 0 < sent[0] <= 50
+    # The client's short budget is neither a breaker failure nor negatively cached
+    assert app_module.external_api_breaker.snapshot()["failures"] == 0
+    assert len(app_module.enrichment_cache) == 0
+
+    # The route's own budget is: running out of it is the upstream's fault
+    monkeypatch.setitem(app_module.ROUTE_BUDGETS, "/products/{product_id}", 0.05)
+    assert client.get("/products/1").json()["external_info"] == {"error": "External service timeout"}
+    # The shared load times out a moment after the request stopped waiting for it
+    until = time.monotonic() + 2
+    while app_module.external_api_breaker.snapshot()["failures"] == 0 and time.monotonic() < until:
+        time.sleep(0.01)
+    assert app_module.external_api_breaker.snapshot()["failures"] == 1
+
+
+def test_hedger_fires_after_quantile_and_counts_wins():
+    hedger = Hedger("test", min_samples=5, max_ratio=0.5, registry=CollectorRegistry())
+    for _ in range(5):
+        hedger.observe(0.02)
+    attempts = []
+
+    async def attempt(timeout):
+        attempts.append(timeout)
+        # First attempt stalls, the hedge answers quickly
+        await asyncio.sleep(1.0 if len(attempts) == 1 else 0.0)
+        return len(attempts)
+
+    async def run():
+        start = time.perf_counter()
+        assert await hedger.call(attempt, timeout=2.0) == 2
+        assert time.perf_counter() - start < 0.5
+        assert attempts[1] < 2.0  # the hedge only gets what is left of the deadline
+
+        # No tokens left for another hedge right away: the slow attempt is awaited
+        attempts.clear()
+        hedger._tokens = 0.0
+        assert await hedger.call(lambda timeout: asyncio.sleep(0.05, "slow"), timeout=2.0) == "slow"
+
+    asyncio.run(run())
+    values = {m.name: s.value for m in (*hedger.calls.collect(), *hedger.hedges.collect(), *hedger.wins.collect())
+              for s in m.samples if s.name.endswith("_total")}
+    assert values == {"hedge_calls": 2, "hedge_requests": 1, "hedge_wins": 1}
+
+
+def test_product_store_indexes():
+    store = app_module.ProductStore([
+        {"id": 1, "name": "A", "price": 10.0, "in_stock": True},
+        {"id": 5, "name": "B", "price": 50.0, "in_stock": False},
+    ])
+
+    created = store.create({"name": "C", "price": 30.0, "in_stock": True})
+    assert created["id"] == 6
+    store.delete(6)
+    assert store.create({"name": "D", "price": 20.0, "in_stock": True})["id"] == 7  # ids never reused
+
+    store.update(1, {"price": 60.0, "in_stock": False})
+    assert [p["id"] for p in store.by_price(15, 55)] == [7, 5]
+    assert [p["id"] for p in store.by_stock(False)] == [1, 5]
+    assert store.get(404) is None and store.delete(404) is None
+
+    # An invalid record is refused before any index changes
+    version = store.version
+    with pytest.raises(ValueError):
+        store.update(1, {"price": None})
+    with pytest.raises(ValueError):
+        store.update_many([(5, {"price": 55.0}), (1, {"price": None})])
+    assert store.get(1)["price"] == 60.0 and store.get(5)["price"] == 50.0 and store.version == version
+    assert [p["id"] for p in store.by_price(55, 65)] == [1]
+
+
+def test_update_rejects_null_fields(client, monkeypatch):
+    monkeypatch.setattr(app_module, "products_db", app_module.ProductStore(app_module.products_db.list()))
+    app_module.http_client, _ = stub_upstream()
+
+    assert client.put("/products/1", json={"price": None}).status_code == 422
+    assert client.put("/products/1", json={"description": None}).json()["description"] is None
+    assert client.get("/products/1").json()["price"] == 999.99
+    batch = client.patch("/products:batch", json=[{"id": 1, "in_stock": None}]).json()
+    assert batch["results"][0]["status"] == 422
+
+
+def test_crud_and_filters(client):
+    created = client.post("/products", json={"name": "Cable", "price": 5.0, "in_stock": False}).json()
+    assert client.get("/products", params={"in_stock": False}).json()[-1]["id"] == created["id"]
+    assert [p["name"] for p in client.get("/products", params={"max_price": 50}).json()] == ["Cable", "Mouse"]
+
+    assert client.put(f"/products/{created['id']}", json={"price": 7.5}).json()["price"] == 7.5
+    assert client.delete(f"/products/{created['id']}").status_code == 200
+    assert client.delete(f"/products/{created['id']}").status_code == 404
+
+
+def test_keyset_pagination_and_projection(client, monkeypatch):
+    monkeypatch.setattr(app_module, "products_db", app_module.ProductStore(app_module.products_db.list()))
+    first = client.get("/products", params={"limit": 2, "fields": "name"})
+    assert first.json() == [{"id": 1, "name": "Laptop"}, {"id": 2, "name": "Mouse"}]
+    assert first.headers["x-next-cursor"] == "2"
+    assert 'rel="next"' in first.headers["link"]
+
+    last = client.get("/products", params={"limit": 2, "after": 2})
+    assert [p["id"] for p in last.json()] == [3]
+    assert "x-next-cursor" not in last.headers
+
+    # A deleted row does not shift later pages (unlike offset)
+    created = client.post("/products", json={"name": "Cable", "price": 5.0}).json()
+    client.delete("/products/2")
+    assert [p["id"] for p in client.get("/products", params={"after": 1, "limit": 2}).json()] == [3, created["id"]]
+
+    assert client.get("/products", params={"limit": 10, "in_stock": False, "fields": "price"}).json() == [{"id": 3, "price": 79.99}]
+    assert client.get("/products", params={"fields": "name,secret"}).status_code == 400
+
+
+def test_batch_endpoints_report_per_item(client, monkeypatch):
+    monkeypatch.setattr(app_module, "products_db", app_module.ProductStore(app_module.products_db.list()))
+    version = app_module.products_db.version
+
+    created = client.post("/products:batch", json=[
+        {"name": "Cable", "price": 5.0},
+        {"name": "Bad", "price": -1},
+        "not an object",
+        {"name": "Hub", "price": 25.0, "in_stock": False},
+    ]).json()
+    assert (created["succeeded"], created["failed"]) == (2, 2)
+    assert [r["status"] for r in created["results"]] == [201, 422, 422, 201]
+    assert created["results"][1]["error"].startswith("price:")
+    assert app_module.products_db.version == version + 1  # one write for the whole batch
+    cable, hub = created["results"][0]["id"], created["results"][3]["id"]
+
+    updated = client.patch("/products:batch", json=[{"id": cable, "price": 6.0}, {"id": 404, "price": 1.0}, {"price": 2.0}]).json()
+    assert [r["status"] for r in updated["results"]] == [200, 404, 422]
+    assert app_module.products_db.get(cable)["price"] == 6.0
+    assert app_module.products_db.get(cable)["name"] == "Cable"
+
+    deleted = client.request("DELETE", "/products:batch", json=[cable, "hub", hub, cable]).json()
+    assert [r["status"] for r in deleted["results"]] == [200, 422, 200, 404]
+    assert deleted["succeeded"] == 2 and deleted["results"][1]["error"]
+    assert cable not in app_module.products_db
+
+
+def test_batch_rate_limit_counts_items(client, monkeypatch):
+    monkeypatch.setattr(app_module, "products_db", app_module.ProductStore(app_module.products_db.list()))
+    monkeypatch.setattr(app_module, "batch_item_limit", parse("5/minute"))
+    monkeypatch.setattr(app_module, "BATCH_MAX_ITEMS", 4)
+
+    assert client.post("/products:batch", json=[{"name": "Item", "price": 1.0}] * 5).status_code == 413
+    assert client.post("/products:batch", json=[{"name": "Item", "price": 1.0}] * 4).status_code == 200
+    assert client.post("/products:batch", json=[{"name": "Item", "price": 1.0}] * 2).status_code == 429
+    assert client.post("/products:batch", json=[{"name": "Item", "price": 1.0}]).status_code == 200
+
+
+def test_conditional_get_skips_enrichment(client, monkeypatch):
+    monkeypatch.setattr(app_module, "products_db", app_module.ProductStore(app_module.products_db.list()))
+    app_module.http_client, calls = stub_upstream()
+
+    first = client.get("/products/1")
+    etag = first.headers["etag"]
+    assert len(calls) == 1
+
+    app_module.enrichment_cache.clear()  # a 200 would have to call the upstream again
+    cached = client.get("/products/1", headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+    assert cached.headers["etag"] == etag
+    assert len(calls) == 1
+
+    # Writes to another product leave this ETag alone; writes to this one change it
+    client.put("/products/2", json={"price": 1.0})
+    assert client.get("/products/1", headers={"If-None-Match": etag}).status_code == 304
+    client.put("/products/1", json={"price": 1.0})
+    assert client.get("/products/1", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_enrichment_fallback_has_no_etag(client, monkeypatch):
+    monkeypatch.setattr(app_module, "products_db", app_module.ProductStore(app_module.products_db.list()))
+    app_module.http_client, _ = stub_upstream(status_code=500)
+
+    fallback = client.get("/products/1")
+    assert fallback.json()["external_info"] == {"error": "External service error"}
+    assert "etag" not in fallback.headers
+
+    # Once the upstream recovers the client gets the real data, then 304s
+    app_module.http_client, _ = stub_upstream()
+    app_module.enrichment_cache.clear()
+    enriched = client.get("/products/1")
+    assert enriched.json()["external_info"] == {"title": "post 1", "rating": 4.5}
+    assert client.get("/products/1", headers={"If-None-Match": enriched.headers["etag"]}).status_code == 304
+
+
+def test_catalog_etag_and_if_match(client, monkeypatch):
+    monkeypatch.setattr(app_module, "products_db", app_module.ProductStore(app_module.products_db.list()))
+    app_module.http_client, _ = stub_upstream()
+
+    catalog = client.get("/products").headers["etag"]
+    assert client.get("/products", headers={"If-None-Match": f"W/{catalog}"}).status_code == 304
+    assert client.get("/products", params={"limit": 1}, headers={"If-None-Match": catalog}).status_code == 304
+
+    etag = client.get("/products/2").headers["etag"]
+    updated = client.put("/products/2", json={"price": 30.0}, headers={"If-Match": etag})
+    assert updated.status_code == 200 and updated.headers["etag"] != etag
+
+    # Stale copy: both writes are refused and nothing changes
+    assert client.put("/products/2", json={"price": 1.0}, headers={"If-Match": etag}).status_code == 412
+    assert client.delete("/products/2", headers={"If-Match": etag}).status_code == 412
+    assert app_module.products_db.get(2)["price"] == 30.0
+    assert client.get("/products", headers={"If-None-Match": catalog}).status_code == 200
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate, br", brotli_available=True) == "br"
+    assert choose_encoding("gzip, deflate, br", brotli_available=False) == "gzip"
+    assert choose_encoding("br;q=0.5, gzip", brotli_available=True) == "gzip"
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding(None) is None
+
+
+def test_compression_threshold_and_etag(client, monkeypatch):
+    products = [{"id": i, "name": f"Product {i}", "price": 1.0 + i, "description": "x" * 20, "in_stock": True} for i in range(1, 101)]
+    monkeypatch.setattr(app_module, "products_db", app_module.ProductStore(products))
+
+    small = client.get("/products/1", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers  # below COMPRESSION_MIN_SIZE
+
+    full = client.get("/products", headers={"Accept-Encoding": "gzip"})
+    assert full.headers["content-encoding"] == "gzip"
+    assert full.headers["vary"] == "Accept-Encoding"
+    assert int(full.headers["content-length"]) < len(full.content) / 3
+    assert len(full.json()) == 100
+
+    # The per-encoding ETag still validates against the app's own ETag
+    assert full.headers["etag"].endswith('-gzip"')
+    assert client.get("/products", headers={"Accept-Encoding": "gzip", "If-None-Match": full.headers["etag"]}).status_code == 304
+
+    streamed = client.get("/products/stream", headers={"Accept-Encoding": "gzip"})
+    assert streamed.headers["content-encoding"] == "gzip"
+    assert len(streamed.text.splitlines()) == 100
+
+
+def test_products_ndjson_stream(client, monkeypatch):
+    monkeypatch.setattr(app_module, "PRODUCTS_PAGE_MAX", 2)  # force several chunks
+    response = client.get("/products/stream", params={"fields": "name"})
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == sorted(p["id"] for p in app_module.products_db)
+    assert rows[0] == {"id": 1, "name": "Laptop"}
+    assert [json.loads(line)["id"] for line in client.get("/products/stream", params={"after": 2}).text.splitlines()][0] == 3
+
+
+def test_enrichment_cache_ttl_and_negative_caching():
+    now = [0.0]
+    outcomes = {1: "ok", 2: "fail"}
+    calls = []
+
+    async def loader(key):
+        calls.append(key)
+        if outcomes[key] == "fail":
+            raise RuntimeError("upstream down")
+        return {"id": key}
+
+    cache = app_module.EnrichmentCache(loader, max_size=10, ttl=60, negative_ttl=5, clock=lambda: now[0])
+
+    async def run():
+        assert await cache.get(1) == {"id": 1}
+        assert await cache.get(1) == {"id": 1}
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await cache.get(2)
+        assert calls == [1, 2]
+
+        now[0] = 10  # failure expired, success still fresh
+        outcomes[2] = "ok"
+        assert await cache.get(2) == {"id": 2}
+        assert await cache.get(1) == {"id": 1}
+        assert calls == [1, 2, 2]
+
+    asyncio.run(run())
+
+
+def test_enrichment_cache_lru_eviction():
+    async def loader(key):
+        return key
+
+    cache = app_module.EnrichmentCache(loader, max_size=2)
+
+    async def run():
+        await cache.get(1)
+        await cache.get(2)
+        await cache.get(1)  # 1 is now most recently used
+        await cache.get(3)
+
+    asyncio.run(run())
+    assert list(cache._entries) == [1, 3]
+    assert cache.evictions.labels(reason="size")._value.get() == 1
+
+
+def test_stale_while_revalidate_keeps_value_on_failed_reload():
+    now = [0.0]
+    outcomes = []
+    calls = []
+
+    async def loader(key):
+        calls.append(key)
+        await asyncio.sleep(0)
+        if outcomes and outcomes.pop(0) == "fail":
+            raise RuntimeError("upstream down")
+        return {"id": key, "version": len(calls)}
+
+    cache = app_module.EnrichmentCache(loader, ttl=10, stale_ttl=60, registry=CollectorRegistry(), clock=lambda: now[0])
+
+    async def run():
+        assert await cache.get(1) == {"id": 1, "version": 1}
+        now[0] = 15
+        # Expired: the stale value is returned at once, the reload runs in the background
+        assert await cache.get(1) == {"id": 1, "version": 1}
+        await cache.drain()
+        assert await cache.get(1) == {"id": 1, "version": 2}
+
+        now[0] = 30
+        outcomes.append("fail")
+        assert await cache.get(1) == {"id": 1, "version": 2}
+        await cache.drain()
+        assert await cache.get(1) == {"id": 1, "version": 2}  # failed reload did not replace it
+
+        now[0] = 100  # past the stale window: a real miss
+        assert await cache.get(1) == {"id": 1, "version": 4}
+
+    asyncio.run(run())
+    assert cache.hits.labels(result="stale")._value.get() == 3
+
+
+def test_frequency_sketch_ranks_and_ages():
+    sketch = FrequencySketch(width=64, sample_size=1000)
+    for key, count in ((1, 50), (2, 20), (3, 5)):
+        for _ in range(count):
+            sketch.increment(key)
+    assert sketch.estimate(1) >= 50 and sketch.estimate(2) >= 20 and sketch.estimate(1) > sketch.estimate(3)
+    for _ in range(1000 - 75):
+        sketch.increment(4)
+    assert 25 <= sketch.estimate(1) < 50  # halved once the sample is full
+
+
+def test_refresher_prefetches_hot_keys_and_drains():
+    loads = []
+    gate = asyncio.Event()
+
+    async def loader(key):
+        loads.append(key)
+        await gate.wait()
+        return {"id": key}
+
+    cache = app_module.EnrichmentCache(loader, ttl=300, registry=CollectorRegistry())
+    refresher = EnrichmentRefresher(cache, interval=0.01, top_k=2, concurrency=1, drain_seconds=2,
+                                    registry=CollectorRegistry())
+    for key, count in ((1, 5), (2, 3), (3, 1)):
+        for _ in range(count):
+            refresher.record(key)
+    assert refresher.hottest() == [1, 2]
+
+    async def run():
+        refresher.start()
+        await asyncio.sleep(0.05)
+        assert loads == [1]  # one refresh at a time
+        # Shutdown waits for the running cycle instead of cutting it off
+        stopping = asyncio.ensure_future(refresher.stop())
+        await asyncio.sleep(0.01)
+        gate.set()
+        await stopping
+        assert not refresher.running
+        assert await cache.get(1) == {"id": 1} and await cache.get(2) == {"id": 2}
+        assert loads == [1, 2]
+        assert not cache.needs_refresh(1, within=10)
+
+    asyncio.run(run())
+    assert refresher.refreshes.labels(result="success")._value.get() == 2
+
+
+def test_concurrent_misses_share_one_upstream_call():
+    app_module.http_client, calls = stub_upstream(delay=0.1)
+
+    async def run():
+        return await asyncio.gather(*(app_module.enrichment_cache.get(2) for _ in range(20)))
+
+    results = asyncio.run(run())
+    assert all(r["title"] == "post 2" for r in results)
+    assert calls == ["/posts/2"]
+
+
+def test_cache_metrics_exported(client):
+    app_module.http_client, calls = stub_upstream()
+    for _ in range(3):
+        client.get("/products/1")
+
+    metrics = client.get("/metrics").text
+    assert calls == ["/posts/1"]
+    assert 'enrichment_cache_hits_total{result="success"}' in metrics
+    assert "enrichment_cache_misses_total" in metrics
+
+
+def test_enrichment_does_not_mutate_stored_product(client):
+    app_module.http_client, _ = stub_upstream()
+
+    client.get("/products/1")
+
+    assert "external_info" not in app_module.products_db.get(1)
+    assert all("external_info" not in p for p in client.get("/products").json())
+
+
+def test_product_list_body_rebuilt_only_after_writes(client):
+    first = client.get("/products")
+    assert first.headers["content-type"] == "application/json"
+    assert app_module.get_products_json() is app_module.get_products_json()
+
+    created = client.post("/products", json={"name": "Webcam", "price": 49.0}).json()
+    assert client.get("/products").json()[-1]["name"] == "Webcam"
+
+    client.put(f"/products/{created['id']}", json={"name": "HD Webcam"})
+    assert client.get("/products").json()[-1]["name"] == "HD Webcam"
+
+    client.delete(f"/products/{created['id']}")
+    assert client.get("/products").json() == first.json()
+
+
+def test_queue_logging_writes_json_lines(tmp_path):
+    log_file = tmp_path / "out.log"
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(JsonFormatter())
+    log_queue = queue.Queue()
+    listener = BatchingQueueListener(log_queue, [handler], batch_size=4)
+    logger = logging.getLogger("test.queue")
+    logger.propagate = False
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+
+    for i in range(10):
+        logger.warning("request %d", i, extra={"status": 200})
+    listener.stop()
+
+    lines = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert [line["message"] for line in lines] == [f"request {i}" for i in range(10)]
+    assert lines[0]["status"] == 200 and lines[0]["level"] == "WARNING"
+
+    # A record that cannot be formatted is reported and skipped; the writer keeps going
+    listener.start()
+    log_queue.put(logging.LogRecord("test.queue", logging.WARNING, "", 0, "bad %d", ("x",), None))
+    logger.warning("after the bad record")
+    listener.stop()
+    lines = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert lines[-1]["message"] == "after the bad record" and len(lines) == 11
+
+    sampler = SamplingFilter(0.0)
+    info = logging.LogRecord("app.access", logging.INFO, "", 0, "GET /", (), None)
+    error = logging.LogRecord("app.access", logging.ERROR, "", 0, "GET /", (), None)
+    assert not sampler.filter(info) and sampler.filter(error)
+
+
+def metric_series(name: str) -> int:
+    return sum(len(metric.samples) for metric in app_module.registry.collect() if metric.name == name)
+
+
+def test_route_template_labels():
+    def scope(method, path):
+        return {"type": "http", "method": method, "path": path, "root_path": "", "app": app_module.app}
+
+    assert app_module.route_template(scope("GET", "/products/123")) == "/products/{product_id}"
+    assert app_module.route_template(scope("PATCH", "/products/123")) == "/products/{product_id}"
+    assert app_module.route_template(scope("GET", "/no/such/path")) == app_module.UNMATCHED_ROUTE
+    for i in range(100_000):
+        assert app_module.route_template(scope("GET", f"/products/{i}")) == "/products/{product_id}"
+
+
+def test_metric_series_bounded_by_routes(client):
+    app_module.http_client, _ = stub_upstream()
+    client.get("/products/1")
+    client.get("/products/1000")
+    client.get("/unknown/1")
+    before = {name: metric_series(name) for name in ("api_requests", "api_request_duration_seconds")}
+
+    for i in range(2000, 3000):
+        if i % 50 == 0:
+            app_module.limiter.reset()  # stay under 100/minute so every call is a 404
+        client.get(f"/products/{i}")
+        client.get(f"/unknown/{i}")
+
+    assert {name: metric_series(name) for name in before} == before
+    app_module.metrics_exposition.invalidate()
+    metrics = client.get("/metrics").text
+    assert 'endpoint="/products/{product_id}"' in metrics
+    assert 'endpoint="<unmatched>"' in metrics
+    assert "/products/2999" not in metrics
+    assert "api_requests_in_progress" in metrics and "api_response_size_bytes" in metrics
+
+
+def test_health_probes_bypass_middleware(client, monkeypatch):
+    app_module.metrics_exposition.invalidate()
+    assert client.get("/health/live").json() == {"status": "alive"}
+    ready = client.get("/health/ready")
+    assert ready.status_code == 200
+    assert ready.json()["status"] == "ready" and ready.json()["circuit_breaker"] == "closed"
+    assert set(ready.json()["backlog"]) == {"external_api_in_flight", "external_api_queued", "enrichment_loads", "log_records"}
+
+    # Neither rate limited nor seen by the metrics middleware
+    for _ in range(200):
+        assert client.get("/health/live").status_code == 200
+    assert "/health/live" not in client.get("/metrics").text
+
+    # An overloaded worker is taken out of rotation
+    monkeypatch.setattr(app_module.loop_lag_monitor, "lag", 2.0)
+    ready, details = app_module.readiness()
+    assert not ready and details["event_loop_lag_ms"] == 2000.0
+
+
+def test_readiness_check_cached_for_window():
+    now = [0.0]
+    checks = []
+
+    def check():
+        checks.append(now[0])
+        return len(checks) == 1, {"checks": len(checks)}
+
+    inner = FastAPI()
+    probe_app = HealthProbeMiddleware(inner, check=check, cache_seconds=0.5, clock=lambda: now[0])
+    with TestClient(probe_app) as probe:
+        assert probe.get("/health/ready").json() == {"status": "ready", "checks": 1}
+        now[0] = 0.4
+        assert probe.get("/health/ready").status_code == 200
+        now[0] = 0.5
+        response = probe.get("/health/ready")
+        assert response.status_code == 503 and response.json() == {"status": "not_ready", "checks": 2}
+        assert probe.head("/health/live").content == b""
+        assert probe.get("/other").status_code == 404  # everything else reaches the app
+    assert checks == [0.0, 0.5]
+
+
+def test_metrics_middleware_passes_streaming_through():
+    stream_app = FastAPI()
+    stream_app.add_middleware(app_module.MetricsMiddleware)
+
+    @stream_app.get("/stream")
+    async def stream():
+        async def chunks():
+            for i in range(3):
+                yield f"chunk {i}\n".encode()
+        return StreamingResponse(chunks(), status_code=206)
+
+    sent = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.sleep(3600)  # client stays connected
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/stream", "raw_path": b"/stream", "root_path": "",
+             "query_string": b"", "headers": [], "client": ("10.0.0.1", 1234), "server": ("test", 80)}
+    before = app_module.request_count.labels(method="GET", endpoint="/stream", status=206)._value.get()
+    asyncio.run(stream_app(scope, receive, send))
+
+    bodies = [m["body"] for m in sent if m["type"] == "http.response.body" and m.get("body")]
+    assert bodies == [b"chunk 0\n", b"chunk 1\n", b"chunk 2\n"]
+    assert app_module.request_count.labels(method="GET", endpoint="/stream", status=206)._value.get() == before + 1
+
+
+def test_metrics_exposition_cached_and_shared(monkeypatch):
+    now = [0.0]
+    renders = []
+    exposition = metrics_exposition.CachedExposition(app_module.registry, ttl=5, clock=lambda: now[0])
+    real_generate = metrics_exposition.generate_latest
+
+    def counting_generate(registry):
+        renders.append(1)
+        time.sleep(0.05)
+        return real_generate(registry)
+
+    monkeypatch.setattr(metrics_exposition, "generate_latest", counting_generate)
+
+    async def run():
+        bodies = await asyncio.gather(*(exposition.render() for _ in range(10)))
+        assert len(set(bodies)) == 1
+        now[0] = 4
+        await exposition.render()
+        assert len(renders) == 1
+        now[0] = 6
+        await exposition.render()
+        assert len(renders) == 2
+
+    asyncio.run(run())
+
+
+def test_metrics_gzip_when_accepted(client):
+    plain = client.get("/metrics", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert "api_requests_total" in plain.text
+
+    raw = client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+    assert raw.headers["content-encoding"] == "gzip"
+    assert "api_requests_total" in raw.text  # httpx decodes gzip transparently
+
+    assert not metrics_exposition.accepts_gzip("gzip;q=0, identity")
+
+
+def hit_shared_limit(path: str, attempts: int, results):
+    limiter = FixedWindowRateLimiter(SharedMemoryStorage(f"shm://{path}"))
+    limit = parse("50/minute")
+    results.put(sum(limiter.hit(limit, "127.0.0.1", "get_products") for _ in range(attempts)))
+
+
+def test_shared_rate_limit_honored_across_processes(tmp_path):
+    path = str(tmp_path / "limits.sqlite")
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    workers = [ctx.Process(target=hit_shared_limit, args=(path, 40, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    admitted = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    # 4 workers x 40 attempts against one 50/minute limit; memory:// would admit 160
+    assert sum(admitted) <= 50
+    assert sum(admitted) >= 40  # only tokens stranded in the last leases are lost
+
+
+def test_shared_storage_fast_path_and_reset(tmp_path):
+    storage = SharedMemoryStorage(f"shm://{tmp_path / 'limits.sqlite'}?batch=5")
+    limiter = FixedWindowRateLimiter(storage)
+    limit = parse("12/minute")
+    key = limit.key_for("client")
+
+    assert all(limiter.hit(limit, "client") for _ in range(12))
+    assert not limiter.hit(limit, "client")
+    assert storage.get(key) == 12
+
+    storage.reset()
+    assert storage.get(key) == 0 and limiter.hit(limit, "client")
+
+
+def test_latency_histogram_percentiles():
+    histogram = loadtest.LatencyHistogram()
+    for value in range(1, 100_001):
+        histogram.record(value)
+
+    assert histogram.total == 100_000 and histogram.max == 100_000
+    for pct in (50, 90, 99, 99.9):
+        exact = 100_000 * pct / 100
+        assert abs(histogram.percentile(pct) - exact) / exact < 1 / 128
+    assert len(histogram.counts) < 1500  # fixed-size slots, not one per value
+
+
+def test_loadtest_runs_offline_and_writes_report(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(app_module.limiter, "enabled", True)  # the run switches it off
+    monkeypatch.setattr(app_module, "products_db", app_module.ProductStore(app_module.products_db.list()))
+    out = tmp_path / "report.json"
+
+    loadtest.main(["run", "--rate", "100", "--seconds", "1", "--upstream-latency-ms", "1",
+                   "--mix", "get_product=3,list_products=1,create_product=2,delete_product=1", "--app-logs",
+                   "--out", str(out)])
+
+    report = json.loads(out.read_text())
+    assert report["target"] == "in-process"
+    assert set(report["endpoints"]) <= {"get_product", "list_products", "create_product", "delete_product"}
+    assert report["writes"]["created"] > 0 and report["writes"]["deleted"] > 0
+    assert loadtest.write_problems(report) == []
+    assert loadtest.write_problems({**report, "writes": {"created": 0, "updated": 0, "deleted": 0}})
+    assert report["overall"]["requests"] > 50 and report["overall"]["failed"] == 0
+    assert sum(count for _, count in report["overall"]["histogram"]["buckets"]) == report["overall"]["requests"]
+    assert loadtest.compare(report, report, threshold=10) == 0